@@ -0,0 +1,46 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from app.config import PROFILING_ENABLED
+from app.services.profiling import profile_store
+from app.services.sharding import get_shard_router
+from typing import Dict, List
+
+router = APIRouter()
+
+@router.post("/profiling", response_model=Dict)
+def arm_profiling(requests: int = Query(1, ge=0, description="Number of upcoming requests to profile")):
+    """Profile the next requests with the sampling profiler (0 disarms)"""
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=400, detail="Profiling is disabled (PROFILING_ENABLED)")
+    return {"armed": profile_store.arm(requests)}
+
+@router.get("/profiles", response_model=List[Dict])
+def get_profiles():
+    """Summaries of the latest request profiles, newest first"""
+    return profile_store.list()
+
+@router.get("/profiles/{profile_id}", response_model=Dict)
+def get_profile(profile_id: int):
+    """A request profile: Redis and SQL calls with their time, and the sampled stacks"""
+    report = profile_store.get(profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return report
+
+@router.get("/shards", response_model=Dict)
+def get_shards():
+    """Shard workers and the owner of each symbol routed so far"""
+    shard_router = get_shard_router()
+    if shard_router is None:
+        raise HTTPException(status_code=400, detail="Sharding is disabled (SHARDING_ENABLED)")
+    return shard_router.assignments()
+
+@router.post("/shards", response_model=Dict)
+async def resize_shards(workers: int = Query(..., ge=1, description="Number of shard workers")):
+    """Add or remove shard workers; symbols that change owner are handed over first"""
+    shard_router = get_shard_router()
+    if shard_router is None:
+        raise HTTPException(status_code=400, detail="Sharding is disabled (SHARDING_ENABLED)")
+    moves = await run_in_threadpool(shard_router.resize, workers)
+    return {"shards": shard_router.ring.shards,
+            "moved": {symbol: {"from": old, "to": new} for symbol, (old, new) in moves.items()}}
@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from app.db.postgres import get_db
+from app.models.candle import Candle, CandleRebuildRequest, CandleRebuildResponse
+from app.services.candle_backfill import rebuild_candles, traded_symbols
+from app.services.market_data import MarketDataService
+from typing import List
+
+router = APIRouter()
+
+@router.get("/", response_model=List[Candle])
+def get_candles(
+    symbol: str = Query(..., description="Symbol to get candles for"),
+    interval: str = Query("1m", description="Candle interval"),
+    limit: int = Query(100, description="Maximum number of closed candles to return"),
+):
+    """Get the most recent closed candles of a symbol, newest first"""
+    return MarketDataService().get_ohlc_data(symbol, interval, limit)
+
+@router.post("/rebuild", response_model=CandleRebuildResponse)
+def rebuild(request: CandleRebuildRequest, db: Session = Depends(get_db)):
+    """Recompute candles from the trades table and reload them into Redis"""
+    symbols = request.symbols or traded_symbols(db)
+    try:
+        loaded = {
+            symbol: rebuild_candles(db, symbol, request.intervals, request.start, request.end)
+            for symbol in symbols
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return CandleRebuildResponse(candles=loaded)
@@ -1,23 +1,84 @@
+import uuid
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
+from app.config import MAX_ORDER_BATCH_SIZE, ORDER_QUEUE_ENABLED, ORDER_SEQUENCER_ENABLED
 from app.db.postgres import get_db
-from app.models.order import OrderCreate, Order, OrderStatus
+from app.messaging.consumer import get_order_consumer
+from app.messaging.publisher import get_order_publisher
+from app.models.order import OrderCreate, Order, OrderStatus, OrderAccepted, OrderBatchResult, OrderBatchResponse
 from app.services.order_service import OrderService
+from app.services.sequencer import get_order_sequencer
 from typing import List, Dict, Optional
+import asyncio
 
 router = APIRouter()
 
-@router.post("/", response_model=Order, status_code=201)
-def create_order(order: OrderCreate, db: Session = Depends(get_db)):
+def queue_order(order: OrderCreate, db: Session) -> OrderAccepted:
+    """Validate an order, give it an id and publish it to its symbol's queue"""
+    is_valid, error_message = OrderService(db).validate_order(order)
+    if not is_valid:
+        raise ValueError(error_message)
+    order_id = str(uuid.uuid4())
+    get_order_publisher().publish(order_id, order)
+    consumer = get_order_consumer()
+    if consumer:
+        consumer.ensure(order.symbol)
+    return OrderAccepted(order_id=order_id, symbol=order.symbol)
+
+@router.post("/", response_model=Order, status_code=201,
+             responses={202: {"model": OrderAccepted, "description": "Queued for matching (ORDER_QUEUE_ENABLED)"}})
+async def create_order(order: OrderCreate, db: Session = Depends(get_db)):
     """Create a new order"""
-    order_service = OrderService(db)
-    
     try:
-        created_order, trades = order_service.create_order(order)
+        if ORDER_QUEUE_ENABLED:
+            # Answer as soon as the order is queued; it is matched by its symbol's consumer
+            accepted = await run_in_threadpool(queue_order, order, db)
+            return JSONResponse(status_code=202, content=jsonable_encoder(accepted))
+        if ORDER_SEQUENCER_ENABLED:
+            # Matched in arrival order by the symbol's single-writer sequencer
+            created_order, trades = await get_order_sequencer().submit(order.symbol, order)
+        else:
+            order_service = OrderService(db)
+            created_order, trades = await run_in_threadpool(order_service.create_order, order)
         return created_order
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.post("/batch", response_model=OrderBatchResponse, status_code=201)
+async def create_orders(orders: List[OrderCreate], db: Session = Depends(get_db)):
+    """Create and match a batch of orders in one request"""
+    # Checked here so that an oversized batch never reaches the sequencer queues either
+    if len(orders) > MAX_ORDER_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {MAX_ORDER_BATCH_SIZE} orders")
+    
+    if ORDER_SEQUENCER_ENABLED:
+        # Keep the single-writer guarantee: each order joins its symbol's queue in request order
+        sequencer = get_order_sequencer()
+        results = await asyncio.gather(
+            *[sequencer.submit(order.symbol, order) for order in orders],
+            return_exceptions=True
+        )
+    else:
+        order_service = OrderService(db)
+        results = await run_in_threadpool(order_service.create_orders, orders)
+    
+    response = []
+    for result in results:
+        if isinstance(result, ValueError):
+            response.append(OrderBatchResult(error=str(result)))
+        elif isinstance(result, Exception):
+            # Other orders of the batch may already be matched; report this one instead of failing them all
+            print(f"Error processing order of a batch: {type(result).__name__}: {str(result)}")
+            response.append(OrderBatchResult(error=f"Order could not be processed ({type(result).__name__})"))
+        else:
+            created_order, trades = result
+            response.append(OrderBatchResult(order=created_order, trades=trades))
+    
+    return OrderBatchResponse(results=response)
+
 @router.get("/{order_id}", response_model=Order)
 def get_order(order_id: str, db: Session = Depends(get_db)):
     """Get an order by ID"""
@@ -40,6 +101,19 @@ def get_orders(
     orders = order_service.get_orders_by_trader(trader_id, symbol)
     return orders
 
+@router.delete("/", response_model=List[Order])
+def cancel_orders(
+    trader_id: Optional[str] = Query(None, description="Cancel this trader's resting orders"),
+    symbol: Optional[str] = Query(None, description="Cancel resting orders on this symbol"),
+    db: Session = Depends(get_db)
+):
+    """Mass cancel resting orders by trader, symbol, or both"""
+    if trader_id is None and symbol is None:
+        raise HTTPException(status_code=400, detail="A trader_id or a symbol is required")
+    
+    order_service = OrderService(db)
+    return order_service.cancel_orders(trader_id=trader_id, symbol=symbol)
+
 @router.delete("/{order_id}", response_model=Order)
 def cancel_order(order_id: str, db: Session = Depends(get_db)):
     """Cancel an order"""
@@ -54,10 +128,21 @@ def cancel_order(order_id: str, db: Session = Depends(get_db)):
 @router.get("/orderbook/{symbol}", response_model=Dict)
 def get_order_book(
     symbol: str,
-    depth: int = Query(10, description="Depth of the order book to return"),
+    depth: int = Query(10, description="Number of price levels per side to return"),
     db: Session = Depends(get_db)
 ):
-    """Get the current state of the order book for a symbol"""
+    """Get the aggregated price levels of the order book for a symbol"""
     order_service = OrderService(db)
     order_book = order_service.get_order_book(symbol, depth)
+    return order_book
+
+@router.get("/orderbook/{symbol}/orders", response_model=Dict)
+def get_order_book_orders(
+    symbol: str,
+    depth: int = Query(10, description="Number of orders per side to return"),
+    db: Session = Depends(get_db)
+):
+    """Get the individual resting orders at the top of the order book for a symbol"""
+    order_service = OrderService(db)
+    order_book = order_service.get_order_book_orders(symbol, depth)
     return order_book
\ No newline at end of file
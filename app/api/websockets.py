@@ -1,92 +1,302 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from app.db.postgres import get_db
-from app.db.redis_client import get_redis
+from app.db.redis_client import get_redis, get_async_redis
 import redis
 import json
 import asyncio
-from typing import Dict, List, Set
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from app.config import WEBSOCKET_MAX_PENDING_MESSAGES, WEBSOCKET_SEND_TIMEOUT, WEBSOCKET_MAX_UPDATE_RATE
 
 router = APIRouter()
 
-# Store connected WebSocket clients
-connected_clients: Dict[str, Set[WebSocket]] = {}
+class ClientStream:
+    """
+    Outbound side of one WebSocket connection, written by the client's own sender task,
+    so broadcasting only ever buffers and one slow client cannot hold up the others.
+    - conflate=True (order book): pending deltas are merged into one carrying the latest
+      value of each level, so the buffer holds at most one delta however far behind the client is
+    - conflate=False (trades): messages are buffered up to max_pending, past that the client is dropped
+    A client whose send stalls longer than send_timeout is dropped either way.
+    Sequenced messages not newer than `seq` are skipped.
+    """
+
+    def __init__(self, websocket: WebSocket, conflate: bool = False,
+                 max_pending: int = WEBSOCKET_MAX_PENDING_MESSAGES,
+                 send_timeout: float = WEBSOCKET_SEND_TIMEOUT,
+                 max_update_rate: float = WEBSOCKET_MAX_UPDATE_RATE):
+        self.websocket = websocket
+        self.conflate = conflate
+        self.max_pending = max_pending
+        self.send_timeout = send_timeout
+        self.depth = 10
+        self.max_update_rate = max_update_rate
+        self.seq = 0
+        self.closed = False
+        self.dropped = False
+        self.snapshot: Optional[str] = None
+        self.pending: Deque[str] = deque()
+        # Conflated delta: first and last sequence number, latest [price, quantity, orders] per level
+        self.delta: Optional[Dict] = None
+        # Sequenced messages held back while a snapshot is being taken
+        self.resync_buffer: Optional[List[Tuple[int, str, Dict]]] = None
+        self.ready = asyncio.Event()
+        self.task = asyncio.create_task(self._send_loop())
+
+    def set_update_rate(self, max_update_rate: float):
+        self.max_update_rate = max(max_update_rate, 0.0)
+
+    def deliver(self, text: str, message: Dict):
+        """Buffer a broadcast message for this client"""
+        if self.dropped:
+            return
+        seq = message.get("seq") if isinstance(message, dict) else None
+        if seq is not None:
+            if self.resync_buffer is not None:
+                self.resync_buffer.append((seq, text, message))
+                return
+            if seq <= self.seq:
+                return
+            self.seq = seq
+        self._buffer(text, message)
+
+    def _buffer(self, text: str, message: Dict):
+        if self.conflate and isinstance(message, dict) and message.get("type") == "delta":
+            self._merge_delta(text, message)
+        elif len(self.pending) >= self.max_pending:
+            self.drop(1008, "Slow consumer")
+            return
+        else:
+            self.pending.append(text)
+        self.ready.set()
+
+    def _merge_delta(self, text: str, message: Dict):
+        if self.delta is None:
+            self.delta = {
+                "first_seq": message["seq"], "seq": message["seq"], "symbol": message.get("symbol"),
+                "text": text, "bids": {}, "asks": {}
+            }
+        else:
+            # More than one delta pending, the original text no longer describes it
+            self.delta["seq"] = message["seq"]
+            self.delta["text"] = None
+        for side in ("bids", "asks"):
+            levels = self.delta[side]
+            for level in message.get(side, ()):
+                levels[level[0]] = level
+
+    def _take_delta(self) -> Optional[str]:
+        delta, self.delta = self.delta, None
+        if delta is None:
+            return None
+        if delta["text"] is not None:
+            return delta["text"]
+        return json.dumps({
+            "seq": delta["seq"],
+            "first_seq": delta["first_seq"],
+            "type": "delta",
+            "symbol": delta["symbol"],
+            "bids": list(delta["bids"].values()),
+            "asks": list(delta["asks"].values())
+        })
+
+    async def send_snapshot(self, symbol: str):
+        """Send a depth snapshot, followed only by the deltas it does not include"""
+        self.resync_buffer = []
+        try:
+            snapshot = await run_in_threadpool(get_depth_snapshot, symbol, self.depth)
+        except Exception:
+            self.resync_buffer = None
+            raise
+
+        held, self.resync_buffer = self.resync_buffer, None
+        # Everything buffered before the snapshot was read is part of it
+        self.delta = None
+        self.seq = snapshot["seq"]
+        self.snapshot = json.dumps({"type": "snapshot", **snapshot})
+        self.ready.set()
+        for seq, text, message in held:
+            if seq > self.seq:
+                self.seq = seq
+                self._buffer(text, message)
+
+    def drop(self, code: int, reason: str):
+        """Disconnect the client; its receive loop then sees the disconnect and cleans up"""
+        if self.dropped:
+            return
+        self.dropped = True
+        self.pending.clear()
+        self.delta = None
+        self.close()
+        asyncio.create_task(self._close(code, reason))
+
+    async def _close(self, code: int, reason: str):
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def _send_loop(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                started = loop.time()
+
+                if self.snapshot is not None:
+                    text, self.snapshot = self.snapshot, None
+                    await asyncio.wait_for(self.websocket.send_text(text), self.send_timeout)
+                while self.pending:
+                    await asyncio.wait_for(self.websocket.send_text(self.pending.popleft()), self.send_timeout)
+                text = self._take_delta()
+                if text is not None:
+                    await asyncio.wait_for(self.websocket.send_text(text), self.send_timeout)
+
+                # Deltas arriving in the meantime are conflated into the next update
+                if self.max_update_rate > 0:
+                    await asyncio.sleep(max(0.0, 1.0 / self.max_update_rate - (loop.time() - started)))
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            self.drop(1008, "Send timed out")
+        except Exception:
+            # The socket is gone; the receive loop notices and cleans up
+            pass
+
+    def close(self):
+        # The flag stops the loop even if a cancellation is swallowed by wait_for
+        self.closed = True
+        self.ready.set()
+        self.task.cancel()
+
+# Store connected WebSocket clients, by pub/sub channel
+connected_clients: Dict[str, Set[ClientStream]] = {}
+
+class ChannelSubscriber:
+    """
+    The one Redis subscription of a channel, shared by every client in connected_clients.
+    Each message is decoded once and handed to all of the channel's clients.
+    """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.subscribed = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        pubsub = get_async_redis().pubsub()
+        try:
+            await pubsub.subscribe(self.channel)
+            self.subscribed.set()
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                data = message["data"]
+                text = data.decode() if isinstance(data, bytes) else data
+                try:
+                    decoded = json.loads(text)
+                except ValueError:
+                    decoded = None
+                for client in list(connected_clients.get(self.channel, ())):
+                    client.deliver(text, decoded)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"PubSub error on {self.channel}: {str(e)}")
+        finally:
+            # Never leave joiners waiting on a subscription that failed
+            self.subscribed.set()
+            await pubsub.aclose()
+
+channel_subscribers: Dict[str, ChannelSubscriber] = {}
+
+async def join_channel(channel: str, client: ClientStream):
+    """Add a client to a channel, subscribing to it in Redis for the first client"""
+    connected_clients.setdefault(channel, set()).add(client)
+    subscriber = channel_subscribers.get(channel)
+    if subscriber is None or subscriber.task.done():
+        subscriber = ChannelSubscriber(channel)
+        channel_subscribers[channel] = subscriber
+    await subscriber.subscribed.wait()
+
+def leave_channel(channel: str, client: ClientStream):
+    """Remove a client from a channel, dropping the Redis subscription after the last one"""
+    client.close()
+    clients = connected_clients.get(channel)
+    if clients is None:
+        return
+    clients.discard(client)
+    if not clients:
+        del connected_clients[channel]
+        subscriber = channel_subscribers.pop(channel, None)
+        if subscriber is not None:
+            subscriber.task.cancel()
+
+def get_depth_snapshot(symbol: str, depth: int) -> Dict:
+    """Read the L2 snapshot of a symbol's book, tagged with its delta sequence number"""
+    from app.services.matching_engine import MatchingEngine
+    from app.services.sharding import get_shard_router
+    # With sharding the book (and its delta sequence) lives in the owning worker
+    router = get_shard_router()
+    if router is not None:
+        return router.get_order_book(symbol, depth)
+    order_book = MatchingEngine(get_redis()).get_order_book(symbol)
+    return order_book.get_depth_snapshot(depth)
 
 @router.websocket("/ws/orderbook/{symbol}")
 async def orderbook_websocket(websocket: WebSocket, symbol: str):
     await websocket.accept()
     
-    # Add client to connected clients for this symbol
-    if symbol not in connected_clients:
-        connected_clients[symbol] = set()
-    connected_clients[symbol].add(websocket)
+    channel_name = f"orderbook_updates:{symbol}"
+    client = ClientStream(websocket, conflate=True)
     
     try:
-        # Create Redis pubsub connection
-        redis_client = get_redis()
-        pubsub = redis_client.pubsub()
-        
-        # Subscribe to orderbook updates for this symbol
-        channel_name = f"orderbook_updates:{symbol}"
-        pubsub.subscribe(channel_name)
+        # Subscribe to orderbook updates for this symbol before taking the snapshot,
+        # so no delta between the snapshot and the subscription is missed
+        await join_channel(channel_name, client)
         
-        # Listen for messages in a separate task
-        task = asyncio.create_task(listen_for_messages(pubsub, websocket))
+        # Start with a snapshot; deltas already included in it are skipped
+        await client.send_snapshot(symbol)
         
         # Keep the connection open and handle client messages
         while True:
             data = await websocket.receive_text()
-            # Client can send commands like "depth:20" to change order book depth
+            # Client can send commands like "depth:20" to change order book depth,
+            # or "depth:20:5" to also receive at most 5 updates per second
             if data.startswith("depth:"):
                 try:
-                    depth = int(data.split(":")[1])
-                    # Could implement changing depth here
+                    params = data.split(":")
+                    client.depth = int(params[1])
+                    if len(params) > 2:
+                        client.set_update_rate(float(params[2]))
+                    await client.send_snapshot(symbol)
                 except ValueError:
                     pass
+            # Clients that detect a sequence gap ask for a fresh snapshot
+            elif data == "snapshot":
+                await client.send_snapshot(symbol)
     
     except WebSocketDisconnect:
-        # Remove client from connected clients
-        if symbol in connected_clients:
-            connected_clients[symbol].remove(websocket)
-            if not connected_clients[symbol]:
-                del connected_clients[symbol]
+        pass
     except Exception as e:
         print(f"WebSocket error: {str(e)}")
     finally:
         # Clean up
-        task.cancel()
-        if symbol in connected_clients and websocket in connected_clients[symbol]:
-            connected_clients[symbol].remove(websocket)
-            if not connected_clients[symbol]:
-                del connected_clients[symbol]
-
-async def listen_for_messages(pubsub, websocket: WebSocket):
-    """Listen for Redis pubsub messages and forward to WebSocket client"""
-    try:
-        for message in pubsub.listen():
-            if message["type"] == "message":
-                # Forward the message to the WebSocket client
-                await websocket.send_text(message["data"].decode())
-    except Exception as e:
-        print(f"PubSub error: {str(e)}")
-    finally:
-        pubsub.close()
+        leave_channel(channel_name, client)
 
 @router.websocket("/ws/trades/{symbol}")
 async def trades_websocket(websocket: WebSocket, symbol: str):
     await websocket.accept()
     
+    channel_name = f"trade_updates:{symbol}"
+    client = ClientStream(websocket)
+    
     try:
-        # Create Redis pubsub connection
-        redis_client = get_redis()
-        pubsub = redis_client.pubsub()
-        
         # Subscribe to trade updates for this symbol
-        channel_name = f"trade_updates:{symbol}"
-        pubsub.subscribe(channel_name)
-        
-        # Listen for messages in a separate task
-        task = asyncio.create_task(listen_for_messages(pubsub, websocket))
+        await join_channel(channel_name, client)
         
         # Keep the connection open
         while True:
@@ -98,7 +308,7 @@ async def trades_websocket(websocket: WebSocket, symbol: str):
         print(f"WebSocket error: {str(e)}")
     finally:
         # Clean up
-        task.cancel()
+        leave_channel(channel_name, client)
 
 # Function to publish order book updates
 def publish_orderbook_update(redis_client: redis.Redis, symbol: str, order_book_data: Dict):
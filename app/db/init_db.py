@@ -1,14 +1,65 @@
 from sqlalchemy import create_engine, text
 from app.config import DATABASE_URL
 from app.db.postgres import Base, engine
+from app.models.instrument import get_symbol_spec
 from app.models.order import OrderModel
+from app.models.trade import TradeModel
+
+# Integer columns added to existing tables, and the float columns they are derived from
+FIXED_POINT_COLUMNS = {
+    "orders": [("price_ticks", "price", "tick_size"), ("quantity_lots", "quantity", "lot_size"),
+               ("filled_lots", "filled_quantity", "lot_size")],
+    "trades": [("price_ticks", "price", "tick_size"), ("quantity_lots", "quantity", "lot_size")],
+}
+
+def upgrade_fixed_point_columns():
+    """
+    Add the tick and lot columns to tables created before them (PostgreSQL)
+    and fill them from the float columns with each symbol's spec
+    """
+    if engine.dialect.name != "postgresql":
+        return
+
+    with engine.begin() as conn:
+        for table, columns in FIXED_POINT_COLUMNS.items():
+            for column, _, _ in columns:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} BIGINT"))
+
+            symbols = conn.execute(
+                text(f"SELECT DISTINCT symbol FROM {table} WHERE quantity_lots IS NULL")
+            ).scalars().all()
+            for symbol in symbols:
+                spec = get_symbol_spec(symbol)
+                assignments = ", ".join(
+                    f"{column} = ROUND(CAST({source} AS NUMERIC) / :{size})"
+                    for column, source, size in columns
+                )
+                conn.execute(
+                    text(f"UPDATE {table} SET {assignments} WHERE symbol = :symbol AND quantity_lots IS NULL"),
+                    {"symbol": symbol, "tick_size": spec.tick_size, "lot_size": spec.lot_size}
+                )
+
+def upgrade_order_updated_at():
+    """
+    Give orders.updated_at its insert default and index on tables created before them (PostgreSQL);
+    book recovery replays orders by this column
+    """
+    if engine.dialect.name != "postgresql":
+        return
+
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE orders ALTER COLUMN updated_at SET DEFAULT now()"))
+        conn.execute(text("UPDATE orders SET updated_at = created_at WHERE updated_at IS NULL"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_updated_at ON orders (updated_at)"))
 
 def init_db():
     # Create tables
     Base.metadata.create_all(bind=engine)
-    
+
     # Create indexes or other initialization here
-    
+    upgrade_fixed_point_columns()
+    upgrade_order_updated_at()
+
     print("Database initialized successfully")
 
 if __name__ == "__main__":
@@ -1,11 +1,31 @@
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import DATABASE_URL
+from app.services.metrics import get_order_metrics
+from app.services.profiling import current_request_stats
 
 # Create SQLAlchemy engine
 engine = create_engine(DATABASE_URL)
 
+# Count every statement sent to the database in the order metrics, and charge statements
+# executed while serving a request to that request with their time
+@event.listens_for(engine, "before_cursor_execute")
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    metrics = get_order_metrics()
+    if metrics:
+        metrics.record_db_call()
+    if current_request_stats():
+        conn.info.setdefault("statement_started", []).append(time.perf_counter_ns())
+
+@event.listens_for(engine, "after_cursor_execute")
+def time_statement(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request_stats()
+    started = conn.info.get("statement_started")
+    if stats and started:
+        stats.record_sql(time.perf_counter_ns() - started.pop())
+
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -1,9 +1,64 @@
+import time
 import redis
+import redis.asyncio
+from redis.client import Pipeline
 from app.config import REDIS_URL
+from app.services.metrics import get_order_metrics
+from app.services.profiling import current_request_stats
+
+def _account(commands: int, started: int):
+    """Charge one round trip carrying this many commands to the metrics and the current request"""
+    metrics = get_order_metrics()
+    if metrics:
+        metrics.record_redis_call(commands)
+    stats = current_request_stats()
+    if stats:
+        stats.record_redis(commands, time.perf_counter_ns() - started)
+
+class InstrumentedPipeline(Pipeline):
+    """Pipeline that accounts one Redis round trip per execute, with the commands it carried"""
+
+    def immediate_execute_command(self, *args, **options):
+        # Commands run straight away while WATCHing keys
+        started = time.perf_counter_ns()
+        try:
+            return super().immediate_execute_command(*args, **options)
+        finally:
+            _account(1, started)
+
+    def execute(self, raise_on_error: bool = True):
+        commands = len(self.command_stack)
+        if not commands:
+            return super().execute(raise_on_error)
+        started = time.perf_counter_ns()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            _account(commands, started)
+
+class InstrumentedRedis(redis.Redis):
+    """Redis client that accounts its round trips and commands in the metrics and per request"""
+
+    def execute_command(self, *args, **options):
+        started = time.perf_counter_ns()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            _account(1, started)
+
+    def pipeline(self, transaction=True, shard_hint=None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
 
 # Create Redis connection pool
 redis_pool = redis.ConnectionPool.from_url(REDIS_URL)
 
 # Create Redis client
 def get_redis():
-    return redis.Redis(connection_pool=redis_pool)
\ No newline at end of file
+    return InstrumentedRedis(connection_pool=redis_pool)
+
+# Connection pool for asyncio code (pub/sub fan-out in the websocket layer)
+async_redis_pool = redis.asyncio.ConnectionPool.from_url(REDIS_URL)
+
+# Create asyncio Redis client
+def get_async_redis():
+    return redis.asyncio.Redis(connection_pool=async_redis_pool)
@@ -1,4 +1,6 @@
 from fastapi import FastAPI, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import redis
@@ -11,7 +13,10 @@ from app.config import APP_NAME, APP_VERSION, API_PREFIX
 # Import routers
 from app.api.orders import router as orders_router
 from app.api.trades import router as trades_router
+from app.api.candles import router as candles_router
 from app.api.websockets import router as websockets_router
+from app.api.admin import router as admin_router
+from app.services.profiling import RequestProfilingMiddleware
 
 # Define lifespan context manager
 @asynccontextmanager
@@ -21,11 +26,64 @@ async def lifespan(app: FastAPI):
     from app.db.init_db import init_db
     init_db()
     
+    # Rebuild order books lost from Redis, then keep snapshotting them
+    from app.config import RECOVERY_ENABLED
+    if RECOVERY_ENABLED:
+        from app.db.postgres import SessionLocal
+        from app.services.recovery import recover_order_books, start_book_snapshotter
+        db = SessionLocal()
+        try:
+            recovered = recover_order_books(db)
+            if recovered:
+                print(f"Recovered order books: {recovered}")
+        finally:
+            db.close()
+        start_book_snapshotter()
+    
+    # Match in shard worker processes, one per group of symbols
+    from app.config import SHARDING_ENABLED
+    if SHARDING_ENABLED:
+        from app.services.sharding import start_shard_router
+        await run_in_threadpool(start_shard_router)
+    
     yield  # This is where the app runs
     
     # Shutdown logic
-    # Cleanup resources
-    pass
+    # Match orders still waiting in the in-process order queues
+    from app.messaging.consumer import stop_order_consumer
+    await run_in_threadpool(stop_order_consumer, 10)
+    
+    # Finish orders already queued in the per-symbol sequencers
+    from app.services.sequencer import stop_order_sequencer
+    await stop_order_sequencer()
+    
+    # Let the shard workers write out their persisters, journals and mirrors, then stop them
+    from app.services.sharding import stop_shard_router
+    await run_in_threadpool(stop_shard_router)
+    
+    # Stop reconciling the pre-trade risk view
+    from app.services.risk import stop_risk_cache
+    stop_risk_cache(timeout=5)
+    
+    # Flush the order journal
+    from app.services.journal import stop_journal
+    stop_journal(timeout=5)
+    
+    # Write out trades and order states still queued in the write-behind persister
+    from app.services.persister import stop_persister
+    stop_persister(timeout=10)
+    
+    # Publish the trades and execution reports still buffered
+    from app.messaging.publisher import stop_execution_publisher
+    stop_execution_publisher(timeout=10)
+    
+    # Make sure in-memory order books have been mirrored to Redis
+    from app.models.memory_order_book import flush_order_book_mirror
+    flush_order_book_mirror(timeout=5)
+    
+    # Write a final order book snapshot
+    from app.services.recovery import stop_book_snapshotter
+    stop_book_snapshotter(timeout=5)
 
 # Create the FastAPI app with lifespan
 app = FastAPI(
@@ -43,11 +101,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Charge each request its Redis and SQL calls (Server-Timing header), and profile on demand
+app.add_middleware(RequestProfilingMiddleware)
+
 # Health check route
 @app.get("/health")
 async def health_check():
     return {"status": "ok", "version": APP_VERSION}
 
+# Prometheus scrape endpoint: per-symbol stage latencies and order, Redis and database counters
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    from app.services.metrics import get_order_metrics
+    order_metrics = get_order_metrics()
+    return PlainTextResponse(order_metrics.prometheus() if order_metrics else "",
+                             media_type="text/plain; version=0.0.4")
+
 # Docker services connection test
 @app.get("/test-connections")
 async def test_connections():
@@ -92,4 +161,6 @@ async def test_connections():
 # Include API routers
 app.include_router(orders_router, prefix=f"{API_PREFIX}/orders", tags=["orders"])
 app.include_router(trades_router, prefix=f"{API_PREFIX}/trades", tags=["trades"])
-app.include_router(websockets_router, tags=["websockets"])
\ No newline at end of file
+app.include_router(candles_router, prefix=f"{API_PREFIX}/candles", tags=["candles"])
+app.include_router(websockets_router, tags=["websockets"])
+app.include_router(admin_router, prefix=f"{API_PREFIX}/admin", tags=["admin"])
\ No newline at end of file
@@ -0,0 +1,267 @@
+"""
+Consuming side of queue-driven order ingestion.
+
+One SymbolConsumer thread per symbol queue takes up to ORDER_QUEUE_PREFETCH orders at a time,
+matches them with OrderService.create_orders (one multi-row insert and one commit per batch) and
+acknowledges the whole batch with a single multiple ack of its last delivery. Orders refused by
+validation or risk checks are stored with status REJECTED, so their outcome can be read back by
+order id. A batch that failed before matching started is retried; one that failed after the
+books had changed is never matched again (that would repeat its trades): its orders that did not
+get stored are taken off the books and stored as REJECTED, and the batch is rejected without
+requeueing, like a batch that keeps failing (dead-lettered when the queue has a dead letter
+exchange).
+
+Orders carry the id the API returned, so a redelivered batch (a consumer died before its ack)
+skips the orders already stored instead of matching them twice.
+
+Run dedicated consumers with ORDER_QUEUE_CONSUME off in the API:
+
+    python -m app.messaging.consumer --symbols BTC/USD,ETH/USD
+"""
+import argparse
+import signal
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import insert, select
+from app.config import (
+    ORDER_QUEUE_CONSUME, ORDER_QUEUE_ENABLED, ORDER_QUEUE_MAX_RETRIES, ORDER_QUEUE_POLL_INTERVAL,
+    ORDER_QUEUE_PREFETCH
+)
+from app.messaging.publisher import decode_order, order_queue
+from app.messaging.transport import MessageTransport, get_transport
+from app.models.order import OrderCreate, OrderModel, OrderStatus
+
+class BatchNotMatchedError(Exception):
+    """A batch failed before any of its orders reached a book; it is safe to process it again"""
+
+def _rejected_row(order_id: str, order_create: OrderCreate, filled_quantity: float = 0) -> Dict:
+    return {
+        "order_id": order_id,
+        "trader_id": order_create.trader_id,
+        "symbol": order_create.symbol,
+        "side": order_create.side,
+        "order_type": order_create.order_type,
+        "quantity": order_create.quantity,
+        "price": order_create.price,
+        "status": OrderStatus.REJECTED,
+        "filled_quantity": filled_quantity,
+    }
+
+def reject_unstored_orders(orders: List[Tuple[str, OrderCreate]]) -> int:
+    """
+    Settle a batch that failed after matching started, so every id the API returned resolves:
+    orders missing from the database are taken off their books if they rest there and stored
+    as REJECTED. Returns how many were stored.
+    """
+    from app.db.postgres import SessionLocal
+    from app.services.order_service import OrderService
+
+    db = SessionLocal()
+    try:
+        stored = set(db.scalars(select(OrderModel.order_id)
+                                .where(OrderModel.order_id.in_([order_id for order_id, _ in orders]))))
+        unstored = [(order_id, order_create) for order_id, order_create in orders if order_id not in stored]
+        if not unstored:
+            return 0
+
+        order_service = OrderService(db)
+        rows = []
+        for order_id, order_create in unstored:
+            cancelled = order_service.cancel_order(order_id)
+            rows.append(_rejected_row(order_id, order_create, cancelled.filled_quantity if cancelled else 0))
+        db.execute(insert(OrderModel), rows)
+        db.commit()
+        return len(rows)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def match_queued_orders(orders: List[Tuple[str, OrderCreate]], redelivered: bool = False) -> Dict[str, int]:
+    """
+    Match a batch of queued (order_id, order) in its own db session; returns outcome counts.
+    Failures before matching started are raised as BatchNotMatchedError; after it, the orders
+    left unstored are settled with reject_unstored_orders before the failure is raised.
+    """
+    from app.db.postgres import SessionLocal
+    from app.services.order_service import OrderService
+
+    db = SessionLocal()
+    order_service = None
+    try:
+        try:
+            if redelivered:
+                stored = set(db.scalars(select(OrderModel.order_id)
+                                        .where(OrderModel.order_id.in_([order_id for order_id, _ in orders]))))
+                orders = [(order_id, order_create) for order_id, order_create in orders if order_id not in stored]
+            if not orders:
+                return {"matched": 0, "rejected": 0}
+
+            order_service = OrderService(db)
+            results = order_service.create_orders([order_create for _, order_create in orders],
+                                                  [order_id for order_id, _ in orders])
+        except Exception as e:
+            if order_service is None or not order_service.matching_started:
+                raise BatchNotMatchedError(str(e)) from e
+            db.rollback()
+            try:
+                stored = reject_unstored_orders(orders)
+                print(f"Stored {stored} orders of a batch that failed during matching as rejected")
+            except Exception as reject_error:
+                print(f"Could not store the orders of a batch that failed during matching: {str(reject_error)}")
+            raise
+        rejected = [_rejected_row(order_id, order_create)
+                    for (order_id, order_create), result in zip(orders, results) if isinstance(result, ValueError)]
+        if rejected:
+            db.execute(insert(OrderModel), rejected)
+            db.commit()
+        return {"matched": len(orders) - len(rejected), "rejected": len(rejected)}
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+class SymbolConsumer(threading.Thread):
+    """Matches one symbol queue's orders in batches, acknowledging each batch at once"""
+
+    def __init__(self, transport: MessageTransport, symbol: str,
+                 handler: Callable[..., Dict[str, int]] = match_queued_orders,
+                 prefetch: int = ORDER_QUEUE_PREFETCH, poll_interval: float = ORDER_QUEUE_POLL_INTERVAL,
+                 max_retries: int = ORDER_QUEUE_MAX_RETRIES):
+        super().__init__(name=f"order-consumer:{symbol}", daemon=True)
+        self.transport = transport
+        self.symbol = symbol
+        self.queue_name = order_queue(symbol)
+        self.handler = handler
+        self.prefetch = prefetch
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.batches = 0
+        self.orders = 0
+        self._stopping = threading.Event()
+
+    def run(self):
+        while True:
+            stopping = self._stopping.is_set()
+            try:
+                # Once stopping, take what is still queued without waiting for more
+                deliveries = self.transport.get_batch(self.queue_name, self.prefetch,
+                                                      0 if stopping else self.poll_interval)
+            except Exception as e:
+                if stopping:
+                    return
+                print(f"Order consumer for {self.symbol} could not read its queue: {str(e)}")
+                self._stopping.wait(1.0)
+                continue
+            if not deliveries:
+                if stopping:
+                    return
+                continue
+            self._process(deliveries)
+
+    def _process(self, deliveries):
+        last_tag = deliveries[-1].tag
+        try:
+            orders = [decode_order(delivery.body) for delivery in deliveries]
+        except Exception as e:
+            print(f"Order consumer for {self.symbol} rejected a batch of {len(deliveries)} "
+                  f"it could not decode: {str(e)}")
+            self.transport.reject(self.queue_name, last_tag)
+            return
+
+        redelivered = any(delivery.redelivered for delivery in deliveries)
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.handler(orders, redelivered)
+                break
+            except Exception as e:
+                # Matching again after the books changed would repeat trades and resting orders
+                if not isinstance(e, BatchNotMatchedError) or attempt == self.max_retries:
+                    print(f"Order consumer for {self.symbol} rejected a batch of {len(orders)} orders: {str(e)}")
+                    self.transport.reject(self.queue_name, last_tag)
+                    return
+                # Rows committed before the failure are skipped on the next attempt
+                redelivered = True
+                time.sleep(min(0.05 * (2 ** attempt), 2.0))
+        self.transport.ack(self.queue_name, last_tag)
+        self.batches += 1
+        self.orders += len(orders)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Match what is still queued, then stop"""
+        self._stopping.set()
+        self.join(timeout)
+
+class OrderConsumer:
+    """Runs a SymbolConsumer per symbol, started on first use"""
+
+    def __init__(self, transport: MessageTransport, **consumer_options):
+        self.transport = transport
+        self.consumer_options = consumer_options
+        self.consumers: Dict[str, SymbolConsumer] = {}
+        self._lock = threading.Lock()
+
+    def ensure(self, symbol: str) -> SymbolConsumer:
+        consumer = self.consumers.get(symbol)
+        if consumer is None:
+            with self._lock:
+                consumer = self.consumers.get(symbol)
+                if consumer is None:
+                    consumer = SymbolConsumer(self.transport, symbol, **self.consumer_options)
+                    consumer.start()
+                    self.consumers[symbol] = consumer
+        return consumer
+
+    def stop(self, timeout: Optional[float] = None):
+        with self._lock:
+            consumers = list(self.consumers.values())
+            self.consumers.clear()
+        for consumer in consumers:
+            consumer.stop(timeout)
+
+_order_consumer: Optional[OrderConsumer] = None
+_order_consumer_lock = threading.Lock()
+
+def get_order_consumer() -> Optional[OrderConsumer]:
+    """Get the in-process order consumer, or None unless queued orders are consumed in this process"""
+    global _order_consumer
+    if not (ORDER_QUEUE_ENABLED and ORDER_QUEUE_CONSUME):
+        return None
+    if _order_consumer is None:
+        with _order_consumer_lock:
+            if _order_consumer is None:
+                _order_consumer = OrderConsumer(get_transport())
+    return _order_consumer
+
+def stop_order_consumer(timeout: Optional[float] = None):
+    """Match the orders still queued and stop the consumers"""
+    global _order_consumer
+    if _order_consumer is not None:
+        _order_consumer.stop(timeout)
+        _order_consumer = None
+
+def main():
+    parser = argparse.ArgumentParser(description="Match queued orders for a set of symbols")
+    parser.add_argument("--symbols", required=True, help="Comma-separated symbols whose queues to consume")
+    parser.add_argument("--prefetch", type=int, default=ORDER_QUEUE_PREFETCH, help="Orders per batch")
+    args = parser.parse_args()
+
+    consumer = OrderConsumer(get_transport(), prefetch=args.prefetch)
+    for symbol in (symbol.strip() for symbol in args.symbols.split(",")):
+        if symbol:
+            consumer.ensure(symbol)
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    try:
+        while not stopping.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        pass
+    consumer.stop(timeout=10)
+
+if __name__ == "__main__":
+    main()
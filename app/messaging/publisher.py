@@ -0,0 +1,214 @@
+"""
+Outbound messaging.
+
+OrderPublisher is the publishing side of queue-driven order ingestion. Accepted orders are
+given their order id up front and published to their symbol's queue, so the HTTP request
+returns without waiting for matching. One queue per symbol keeps each book's orders in arrival
+order.
+
+ExecutionPublisher publishes the matching engine's trades and execution reports to downstream
+services (clearing, risk, market data) without putting the broker on the matching path.
+"""
+import json
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from app.config import (
+    EXECUTION_EXCHANGE, EXECUTION_PUBLISH_BATCH_SIZE, EXECUTION_PUBLISH_CONFIRM_TIMEOUT, EXECUTION_PUBLISH_ENABLED,
+    EXECUTION_PUBLISH_FLUSH_INTERVAL, EXECUTION_PUBLISH_MAX_PENDING, ORDER_QUEUE_ENABLED, RABBITMQ_URL
+)
+from app.messaging.transport import ConfirmedChannel, MessageTransport, get_transport
+from app.models.order import OrderCreate
+
+ORDER_QUEUE_PREFIX = "orders."
+
+def order_queue(symbol: str) -> str:
+    """Name of the queue carrying a symbol's orders"""
+    return f"{ORDER_QUEUE_PREFIX}{symbol}"
+
+def encode_order(order_id: str, order_create: OrderCreate) -> bytes:
+    message = order_create.model_dump(mode="json")
+    message["order_id"] = order_id
+    return json.dumps(message, separators=(",", ":")).encode()
+
+def decode_order(body: bytes):
+    """(order_id, OrderCreate) of a queued order"""
+    message = json.loads(body)
+    order_id = message.pop("order_id")
+    return order_id, OrderCreate(**message)
+
+class OrderPublisher:
+    """Publishes accepted orders to their symbol's queue"""
+
+    def __init__(self, transport: MessageTransport):
+        self.transport = transport
+
+    def publish(self, order_id: str, order_create: OrderCreate):
+        self.transport.publish(order_queue(order_create.symbol), encode_order(order_id, order_create))
+
+_order_publisher: Optional[OrderPublisher] = None
+_order_publisher_lock = threading.Lock()
+
+def get_order_publisher() -> Optional[OrderPublisher]:
+    """Get the process-wide order publisher, or None when queue ingestion is disabled"""
+    global _order_publisher
+    if not ORDER_QUEUE_ENABLED:
+        return None
+    if _order_publisher is None:
+        with _order_publisher_lock:
+            if _order_publisher is None:
+                _order_publisher = OrderPublisher(get_transport())
+    return _order_publisher
+
+class ExecutionPublisher:
+    """
+    Publishes trades and execution reports from a background thread.
+    - publish_trade and publish_execution_report only add to a bounded local buffer; when it is
+      full the message is dropped and counted, so the matching thread never waits on the broker
+    - The thread takes up to batch_size messages (or what arrives within flush_interval), publishes
+      them on one long-lived confirmed channel and waits once for the batch's confirms
+    - A batch that is nacked, not confirmed within confirm_timeout, or cut off by a lost channel is
+      published again, in order, with backoff and a new channel if needed; meanwhile new messages
+      build up in the buffer. Messages keep their message_id across retries so consumers can drop
+      the duplicates a retry may cause
+    """
+
+    def __init__(self, channel_factory: Callable = None,
+                 batch_size: int = EXECUTION_PUBLISH_BATCH_SIZE,
+                 flush_interval: float = EXECUTION_PUBLISH_FLUSH_INTERVAL,
+                 max_pending: int = EXECUTION_PUBLISH_MAX_PENDING,
+                 confirm_timeout: float = EXECUTION_PUBLISH_CONFIRM_TIMEOUT):
+        self.channel_factory = channel_factory or (lambda: ConfirmedChannel(RABBITMQ_URL, EXECUTION_EXCHANGE))
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.confirm_timeout = confirm_timeout
+        self.published = 0
+        self.dropped = 0
+        self.retries = 0
+        self._channel = None
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._drop_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._deadline = None
+        self._thread = threading.Thread(target=self._run, name="execution-publisher", daemon=True)
+        self._thread.start()
+
+    def publish_trade(self, trade: Dict):
+        self._put(f"trade.{trade['symbol']}", trade)
+
+    def publish_execution_report(self, report: Dict):
+        self._put(f"execution_report.{report['symbol']}", report)
+
+    def _put(self, routing_key: str, message: Dict):
+        try:
+            self._queue.put_nowait((routing_key, message))
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+
+    def pending(self) -> int:
+        """Number of messages waiting to be published"""
+        return self._queue.qsize()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Publish what is buffered, giving up after timeout, and stop the background thread"""
+        self._deadline = None if timeout is None else time.monotonic() + timeout
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    def _expired(self) -> bool:
+        return self._stopping.is_set() and self._deadline is not None and time.monotonic() >= self._deadline
+
+    def _collect(self) -> List[Tuple[str, Dict]]:
+        """Wait for messages until the batch is full or the flush interval has passed"""
+        try:
+            messages = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(messages) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                messages.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return messages
+
+    def _run(self):
+        while True:
+            messages = self._collect()
+            if not messages:
+                if self._stopping.is_set():
+                    break
+                continue
+            encoded = [(routing_key, json.dumps(message, default=_json_default).encode(), str(uuid.uuid4()))
+                       for routing_key, message in messages]
+            self._publish_with_retry(encoded)
+        if self._channel is not None:
+            self._channel.close()
+
+    def _publish_with_retry(self, messages: List[Tuple[str, bytes, str]]):
+        attempt = 0
+        while True:
+            try:
+                if self._channel is None or not self._channel.is_open:
+                    self._channel = self.channel_factory()
+                self._channel.publish_batch(messages, self.confirm_timeout)
+                self.published += len(messages)
+                return
+            except Exception as e:
+                if self._expired():
+                    print(f"Execution publisher dropped {len(messages) + self.pending()} messages at shutdown: "
+                          f"{type(e).__name__}: {str(e)}")
+                    with self._drop_lock:
+                        self.dropped += len(messages)
+                    # Drain the buffer so the thread can finish
+                    while True:
+                        try:
+                            self._queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        with self._drop_lock:
+                            self.dropped += 1
+                    return
+                if attempt == 0:
+                    print(f"Execution publisher retrying a batch of {len(messages)} messages: "
+                          f"{type(e).__name__}: {str(e)}")
+                attempt += 1
+                self.retries += 1
+                delay = min(0.05 * (2 ** attempt), 5.0)
+                if self._stopping.is_set() and self._deadline is not None:
+                    delay = min(delay, max(0.0, self._deadline - time.monotonic()))
+                time.sleep(delay)
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+_execution_publisher: Optional[ExecutionPublisher] = None
+_execution_publisher_lock = threading.Lock()
+
+def get_execution_publisher() -> Optional[ExecutionPublisher]:
+    """Get the process-wide execution publisher, or None when it is disabled"""
+    global _execution_publisher
+    if not EXECUTION_PUBLISH_ENABLED:
+        return None
+    if _execution_publisher is None:
+        with _execution_publisher_lock:
+            if _execution_publisher is None:
+                _execution_publisher = ExecutionPublisher()
+    return _execution_publisher
+
+def stop_execution_publisher(timeout: Optional[float] = None):
+    """Publish the buffered trades and execution reports and stop the publisher"""
+    global _execution_publisher
+    if _execution_publisher is not None:
+        _execution_publisher.stop(timeout)
+        _execution_publisher = None
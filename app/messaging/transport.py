@@ -0,0 +1,322 @@
+"""
+Message transports for order ingestion and execution publishing.
+
+MessageTransport is the small interface the order publisher and consumers are written against:
+publish a message to a named queue, take up to a prefetch-sized batch of deliveries, and
+acknowledge (or reject) a whole batch at once by its last delivery tag. RabbitMQTransport
+implements it over AMQP with pika; InProcessTransport stands in for the broker inside one
+process (tests, single-node deployments).
+
+ConfirmedChannel is the outbound side for trades and execution reports: one long-lived channel
+publishing to an exchange, with broker confirms awaited once per batch.
+"""
+import itertools
+import queue
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Tuple
+from app.config import ORDER_QUEUE_TRANSPORT, RABBITMQ_URL
+
+class Delivery(NamedTuple):
+    tag: int
+    body: bytes
+    # Delivered before without an ack (e.g. the previous consumer died mid-batch)
+    redelivered: bool = False
+
+class MessageTransport:
+    """Queue operations used by order ingestion"""
+
+    def publish(self, queue_name: str, body: bytes):
+        raise NotImplementedError
+
+    def get_batch(self, queue_name: str, max_messages: int, timeout: float) -> List[Delivery]:
+        """Wait up to timeout for a first message, then take what is already waiting, up to max_messages"""
+        raise NotImplementedError
+
+    def ack(self, queue_name: str, tag: int):
+        """Acknowledge every delivery on the queue up to and including tag"""
+        raise NotImplementedError
+
+    def reject(self, queue_name: str, tag: int):
+        """Drop every delivery on the queue up to and including tag without requeueing it"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class InProcessTransport(MessageTransport):
+    """Queues held in this process; unacknowledged deliveries are tracked per queue"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues: Dict[str, queue.Queue] = {}
+        self._unacked: Dict[str, "OrderedDict[int, bytes]"] = {}
+        self._tags = itertools.count(1)
+
+    def _queue(self, queue_name: str) -> queue.Queue:
+        with self._lock:
+            if queue_name not in self._queues:
+                self._queues[queue_name] = queue.Queue()
+                self._unacked[queue_name] = OrderedDict()
+            return self._queues[queue_name]
+
+    def publish(self, queue_name: str, body: bytes):
+        self._queue(queue_name).put(body)
+
+    def get_batch(self, queue_name: str, max_messages: int, timeout: float) -> List[Delivery]:
+        messages = self._queue(queue_name)
+        try:
+            bodies = [messages.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(bodies) < max_messages:
+            try:
+                bodies.append(messages.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            unacked = self._unacked[queue_name]
+            deliveries = [Delivery(next(self._tags), body) for body in bodies]
+            for delivery in deliveries:
+                unacked[delivery.tag] = delivery.body
+        return deliveries
+
+    def _settle(self, queue_name: str, tag: int):
+        with self._lock:
+            unacked = self._unacked.get(queue_name, {})
+            for settled in [settled for settled in unacked if settled <= tag]:
+                del unacked[settled]
+
+    def ack(self, queue_name: str, tag: int):
+        self._settle(queue_name, tag)
+
+    def reject(self, queue_name: str, tag: int):
+        self._settle(queue_name, tag)
+
+    def pending(self, queue_name: str) -> int:
+        """Messages waiting plus deliveries not acknowledged yet"""
+        messages = self._queue(queue_name)
+        with self._lock:
+            return messages.qsize() + len(self._unacked[queue_name])
+
+class RabbitMQTransport(MessageTransport):
+    """
+    AMQP transport. pika connections are not thread-safe, so each thread gets its own connection
+    and channel. Queues are durable, messages persistent, and queues are declared single active
+    consumer so that only one consumer at a time takes a symbol's orders, in queue order.
+    """
+
+    QUEUE_ARGUMENTS = {"x-single-active-consumer": True}
+
+    def __init__(self, url: str = RABBITMQ_URL):
+        self.url = url
+        self._local = threading.local()
+
+    def _channel(self):
+        import pika
+        channel = getattr(self._local, "channel", None)
+        if channel is None or channel.is_closed:
+            connection = pika.BlockingConnection(pika.URLParameters(self.url))
+            channel = connection.channel()
+            self._local.connection = connection
+            self._local.channel = channel
+            self._local.declared = set()
+            self._local.consumers = {}
+        return channel
+
+    def _declare(self, channel, queue_name: str):
+        if queue_name not in self._local.declared:
+            channel.queue_declare(queue=queue_name, durable=True, arguments=self.QUEUE_ARGUMENTS)
+            self._local.declared.add(queue_name)
+
+    def _reset(self):
+        """Drop this thread's connection after an error; the broker requeues what was not acked"""
+        connection = getattr(self._local, "connection", None)
+        self._local.channel = None
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def publish(self, queue_name: str, body: bytes):
+        import pika
+        try:
+            channel = self._channel()
+            self._declare(channel, queue_name)
+            channel.basic_publish(exchange="", routing_key=queue_name, body=body,
+                                  properties=pika.BasicProperties(delivery_mode=2))
+        except Exception:
+            self._reset()
+            raise
+
+    def get_batch(self, queue_name: str, max_messages: int, timeout: float) -> List[Delivery]:
+        try:
+            channel = self._channel()
+            consumer = self._local.consumers.get(queue_name)
+            if consumer is None:
+                self._declare(channel, queue_name)
+                # The broker pushes up to a batch ahead, so a batch is taken without a round trip per message
+                channel.basic_qos(prefetch_count=max_messages)
+                consumer = channel.consume(queue_name, inactivity_timeout=timeout)
+                self._local.consumers[queue_name] = consumer
+            method, _, body = next(consumer)
+            if method is None:
+                return []
+            deliveries = [Delivery(method.delivery_tag, body, method.redelivered)]
+            while len(deliveries) < max_messages and channel.get_waiting_message_count():
+                method, _, body = next(consumer)
+                deliveries.append(Delivery(method.delivery_tag, body, method.redelivered))
+            return deliveries
+        except Exception:
+            self._reset()
+            raise
+
+    def ack(self, queue_name: str, tag: int):
+        self._channel().basic_ack(delivery_tag=tag, multiple=True)
+
+    def reject(self, queue_name: str, tag: int):
+        self._channel().basic_nack(delivery_tag=tag, multiple=True, requeue=False)
+
+    def close(self):
+        self._reset()
+
+class ConfirmedChannel:
+    """
+    Long-lived AMQP channel in publisher confirm mode, publishing to one exchange.
+    pika's blocking adapter waits for the confirm of every message, so this channel is driven by
+    the asynchronous adapter on its own I/O thread instead. publish_batch sends a whole batch and
+    then waits once; the broker confirms it with one or a few multiple acks.
+    """
+
+    def __init__(self, url: str, exchange: str, exchange_type: str = "topic", connect_timeout: float = 10.0):
+        import pika
+        self.exchange = exchange
+        self.exchange_type = exchange_type
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._error: Exception = None
+        self._channel = None
+        self._next_tag = 0
+        # Delivery tag -> batch, in publish order, until confirmed
+        self._unconfirmed: "OrderedDict[int, _ConfirmBatch]" = OrderedDict()
+        self._connection = pika.SelectConnection(pika.URLParameters(url), on_open_callback=self._on_open,
+                                                 on_open_error_callback=self._on_failed,
+                                                 on_close_callback=self._on_failed)
+        self._thread = threading.Thread(target=self._connection.ioloop.start, name="confirmed-channel", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(connect_timeout) or self._error is not None:
+            error = self._error or TimeoutError(f"No channel to {exchange} after {connect_timeout}s")
+            self.close()
+            raise error
+
+    @property
+    def is_open(self) -> bool:
+        return self._error is None and self._channel is not None and self._channel.is_open
+
+    # Callbacks below run on the I/O thread
+    def _on_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_channel_open(self, channel):
+        self._channel = channel
+        channel.add_on_close_callback(self._on_failed)
+        channel.exchange_declare(self.exchange, self.exchange_type, durable=True,
+                                 callback=lambda _: channel.confirm_delivery(self._on_confirm,
+                                                                             callback=lambda _: self._ready.set()))
+
+    def _on_failed(self, _, error=None):
+        """Connection or channel lost: fail every batch still waiting for confirms"""
+        with self._lock:
+            self._error = error if isinstance(error, Exception) else ConnectionError(f"Channel closed: {error}")
+            batches = set(self._unconfirmed.values())
+            self._unconfirmed.clear()
+        for batch in batches:
+            batch.fail(self._error)
+        self._ready.set()
+        if self._connection.is_open:
+            self._connection.close()
+        elif not self._connection.is_closing:
+            self._connection.ioloop.stop()
+
+    def _on_confirm(self, frame):
+        import pika
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        settled = []
+        with self._lock:
+            while self._unconfirmed:
+                tag = next(iter(self._unconfirmed))
+                if tag > method.delivery_tag or (tag < method.delivery_tag and not method.multiple):
+                    break
+                settled.append(self._unconfirmed.popitem(last=False)[1])
+            if not method.multiple and method.delivery_tag in self._unconfirmed:
+                settled.append(self._unconfirmed.pop(method.delivery_tag))
+        for batch in settled:
+            batch.settle(acked)
+
+    def _send(self, batch: "_ConfirmBatch", messages: List[Tuple[str, bytes, str]]):
+        import pika
+        try:
+            for routing_key, body, message_id in messages:
+                with self._lock:
+                    self._next_tag += 1
+                    self._unconfirmed[self._next_tag] = batch
+                self._channel.basic_publish(self.exchange, routing_key, body,
+                                            properties=pika.BasicProperties(delivery_mode=2, message_id=message_id,
+                                                                            content_type="application/json"))
+        except Exception as e:
+            batch.fail(e)
+
+    def publish_batch(self, messages: List[Tuple[str, bytes, str]], timeout: float):
+        """
+        Publish (routing key, body, message id) messages and wait until the broker has confirmed all
+        of them. Raises when any is nacked, the channel is lost, or confirms take longer than timeout.
+        """
+        if not self.is_open:
+            raise ConnectionError(f"Channel closed: {self._error}")
+        batch = _ConfirmBatch(len(messages))
+        self._connection.ioloop.add_callback_threadsafe(lambda: self._send(batch, messages))
+        if not batch.done.wait(timeout):
+            raise TimeoutError(f"{batch.remaining} of {len(messages)} messages unconfirmed after {timeout}s")
+        if batch.error is not None:
+            raise batch.error
+
+    def close(self):
+        if self._connection.is_open:
+            self._connection.ioloop.add_callback_threadsafe(self._connection.close)
+        self._thread.join(5)
+
+class _ConfirmBatch:
+    """Confirms still expected for one published batch"""
+
+    def __init__(self, size: int):
+        self.remaining = size
+        self.error: Exception = None
+        self.done = threading.Event()
+        if size == 0:
+            self.done.set()
+
+    def settle(self, acked: bool):
+        if not acked and self.error is None:
+            self.error = ConnectionError("Broker nacked a message of the batch")
+        self.remaining -= 1
+        if self.remaining <= 0:
+            self.done.set()
+
+    def fail(self, error: Exception):
+        if self.error is None:
+            self.error = error
+        self.done.set()
+
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_transport() -> MessageTransport:
+    """Get the process-wide transport selected by ORDER_QUEUE_TRANSPORT"""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = InProcessTransport() if ORDER_QUEUE_TRANSPORT == "inprocess" else RabbitMQTransport()
+    return _transport
@@ -0,0 +1,22 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+
+# Pydantic Models
+class Candle(BaseModel):
+    timestamp: int
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+
+class CandleRebuildRequest(BaseModel):
+    symbols: Optional[List[str]] = None  # Every traded symbol when omitted
+    intervals: Optional[List[str]] = None  # The live intervals when omitted
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
+class CandleRebuildResponse(BaseModel):
+    # Candles loaded per symbol and interval
+    candles: Dict[str, Dict[str, int]]
@@ -0,0 +1,58 @@
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Dict, Optional
+from app.config import DEFAULT_TICK_SIZE, DEFAULT_LOT_SIZE, SYMBOL_SPECS
+
+class SymbolSpec:
+    """
+    Price and quantity grid of a symbol.
+    The engine works in integer ticks (price / tick_size) and lots (quantity / lot_size);
+    floats only appear at the API boundary.
+    """
+
+    __slots__ = ("symbol", "tick_size", "lot_size", "tick_value", "lot_value")
+
+    def __init__(self, symbol: str, tick_size: str = DEFAULT_TICK_SIZE, lot_size: str = DEFAULT_LOT_SIZE):
+        self.symbol = symbol
+        self.tick_size = Decimal(str(tick_size))
+        self.lot_size = Decimal(str(lot_size))
+        if self.tick_size <= 0 or self.lot_size <= 0:
+            raise ValueError(f"Tick and lot size of {symbol} must be positive")
+        # Float sizes for approximate arithmetic off the matching path (risk notionals)
+        self.tick_value = float(self.tick_size)
+        self.lot_value = float(self.lot_size)
+
+    @staticmethod
+    def _units(value, size: Decimal, name: str, exact: bool) -> int:
+        units = Decimal(repr(float(value))) / size
+        whole = units.to_integral_value(rounding=ROUND_HALF_EVEN)
+        if exact and units != whole:
+            raise ValueError(f"{name} {value} is not a multiple of {size}")
+        return int(whole)
+
+    def to_ticks(self, price, exact: bool = True) -> int:
+        """Price as integer ticks; raises ValueError for a price off the tick grid unless exact=False"""
+        return self._units(price, self.tick_size, "Price", exact)
+
+    def to_lots(self, quantity, exact: bool = True) -> int:
+        """Quantity as integer lots; raises ValueError for a quantity off the lot grid unless exact=False"""
+        return self._units(quantity, self.lot_size, "Quantity", exact)
+
+    def price(self, ticks: Optional[int]) -> Optional[float]:
+        """Ticks back to a price"""
+        if ticks is None:
+            return None
+        return float(Decimal(int(ticks)) * self.tick_size)
+
+    def quantity(self, lots: int) -> float:
+        """Lots back to a quantity"""
+        return float(Decimal(int(lots)) * self.lot_size)
+
+_specs: Dict[str, SymbolSpec] = {}
+
+def get_symbol_spec(symbol: str) -> SymbolSpec:
+    """Tick and lot size of a symbol, from SYMBOL_SPECS or the defaults"""
+    spec = _specs.get(symbol)
+    if spec is None:
+        spec = SymbolSpec(symbol, **SYMBOL_SPECS.get(symbol, {}))
+        _specs[symbol] = spec
+    return spec
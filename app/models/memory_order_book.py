@@ -0,0 +1,514 @@
+import queue
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from app.models.order import OrderSide, OrderStatus
+from app.models.instrument import get_symbol_spec
+from app.models.order_book import (
+    ORDER_INDEX_KEY, OrderBook, build_order_details, index_entry, level_key, order_member, remaining_lots,
+    trader_orders_key
+)
+from app.models.order_codec import decode_order_details, encode_order_details
+from app.services.metrics import get_order_metrics
+
+class PriceLevel:
+    """All resting orders at one price (in ticks), in arrival (FIFO) order, with their open lots total"""
+
+    __slots__ = ("price_ticks", "orders", "lots")
+
+    def __init__(self, price_ticks: int):
+        self.price_ticks = price_ticks
+        # OrderedDict gives FIFO iteration and O(1) removal by order id
+        self.orders: "OrderedDict[str, Dict]" = OrderedDict()
+        self.lots = 0
+
+class BookSide:
+    """
+    One side of the in-memory book.
+    Price levels are kept in a list sorted so that the best level is always last,
+    which makes best-price lookups and removal of an emptied best level O(1).
+    """
+
+    def __init__(self, side: OrderSide):
+        self.side = side
+        self.levels: Dict[int, PriceLevel] = {}
+        self._keys: List[int] = []
+        # Prices (ticks) whose level totals changed since the last drain
+        self.changed: set = set()
+
+    def _sort_key(self, price_ticks: int) -> int:
+        # Bids: highest price last. Asks: lowest price last.
+        return price_ticks if self.side == OrderSide.BUY else -price_ticks
+
+    def add(self, order_details: Dict):
+        price_ticks = order_details["price_ticks"]
+        level = self.levels.get(price_ticks)
+        if level is None:
+            level = PriceLevel(price_ticks)
+            self.levels[price_ticks] = level
+            key = self._sort_key(price_ticks)
+            self._keys.insert(bisect_left(self._keys, key), key)
+        level.orders[order_details["order_id"]] = order_details
+        level.lots += remaining_lots(order_details)
+        self.changed.add(price_ticks)
+
+    def reduce(self, price_ticks: int, lots: int):
+        """Take filled lots off a level"""
+        level = self.levels.get(price_ticks)
+        if level is not None:
+            level.lots -= lots
+            self.changed.add(price_ticks)
+
+    def remove(self, order_id: str, price_ticks: int) -> bool:
+        level = self.levels.get(price_ticks)
+        if level is None:
+            return False
+        order_details = level.orders.pop(order_id, None)
+        if order_details is None:
+            return False
+        level.lots -= remaining_lots(order_details)
+        self.changed.add(price_ticks)
+        if not level.orders:
+            del self.levels[price_ticks]
+            key = self._sort_key(price_ticks)
+            if self._keys and self._keys[-1] == key:
+                self._keys.pop()
+            else:
+                self._keys.pop(bisect_left(self._keys, key))
+        return True
+
+    def best_level(self) -> Optional[PriceLevel]:
+        if not self._keys:
+            return None
+        return self.levels[self._sort_key(self._keys[-1])]
+
+    def drain_changes(self) -> List[List[int]]:
+        """Absolute [ticks, lots, orders] of every changed level (0 orders: level gone)"""
+        changes = []
+        for price_ticks in self.changed:
+            level = self.levels.get(price_ticks)
+            if level is None:
+                changes.append([price_ticks, 0, 0])
+            else:
+                changes.append([price_ticks, level.lots, len(level.orders)])
+        self.changed = set()
+        return changes
+
+    def iter_levels(self):
+        """Iterate price levels from best to worst"""
+        for key in reversed(self._keys):
+            yield self.levels[self._sort_key(key)]
+
+class RedisBookMirror:
+    """
+    Asynchronously mirrors in-memory book changes to the Redis order book keys.
+    Writes are queued from the matching path and applied by a background thread
+    in pipelined batches, so Redis is a snapshot target rather than on the hot path.
+    Every change carries the absolute (lots, orders) of the order's price level after it,
+    so the levels and depth keys are overwritten rather than incremented and stay exact.
+    That also makes a failed batch safe to write again: it is retried ahead of newer changes
+    until it goes through, which resyncs the levels it left behind.
+    """
+
+    def __init__(self, redis_client, batch_size: int = 500):
+        self.redis = redis_client
+        self.batch_size = batch_size
+        self._queue: "queue.Queue" = queue.Queue()
+        # Failed batches are counted as mirror_errors (None when metrics are disabled)
+        self.metrics = get_order_metrics()
+        self._thread = threading.Thread(target=self._run, name="orderbook-mirror", daemon=True)
+        self._thread.start()
+
+    def save(self, symbol: str, order_details: Dict, level: Tuple[int, int]):
+        """Queue an upsert of a resting order and the (lots, orders) of its level"""
+        self._queue.put(("save", symbol, dict(order_details), level))
+
+    def remove(self, symbol: str, order_details: Dict, level: Tuple[int, int]):
+        """Queue the removal of a resting order and the (lots, orders) left at its level"""
+        self._queue.put(("remove", symbol, order_details, level))
+
+    def flush(self, timeout: Optional[float] = None):
+        """Block until every queued change has been written"""
+        done = threading.Event()
+        self._queue.put(("flush", None, done, None))
+        done.wait(timeout)
+
+    def _run(self):
+        failed = []
+        failures = 0
+        while True:
+            ops = failed or [self._queue.get()]
+            while len(ops) < self.batch_size:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._apply(ops)
+            except Exception as e:
+                print(f"Order book mirror error, retrying {len(ops)} changes: {str(e)}")
+                if self.metrics:
+                    self.metrics.record_mirror_error()
+                # Flushes waiting on this batch are released once it has been written
+                failed = ops
+                failures += 1
+                time.sleep(min(0.05 * (2 ** failures), 2.0))
+                continue
+            failed = []
+            failures = 0
+            for op, _, payload, _ in ops:
+                if op == "flush":
+                    payload.set()
+
+    def _apply(self, ops):
+        pipe = self.redis.pipeline(transaction=False)
+        for op, symbol, order_details, level_state in ops:
+            if op == "flush":
+                continue
+
+            keys = OrderBook(None, symbol)
+            order_id = order_details["order_id"]
+            side_key, levels_key, depth_key = keys._side_keys(order_details["side"])
+
+            if op == "save":
+                score = OrderBook.order_score(order_details["side"], order_details["price_ticks"])
+                pipe.zadd(side_key, {order_member(order_details): score})
+                pipe.hset(keys.order_details_key, order_id, encode_order_details(order_details))
+                pipe.hset(ORDER_INDEX_KEY, order_id, index_entry(order_details["side"], symbol))
+                pipe.hset(trader_orders_key(order_details["trader_id"]), order_id, symbol)
+            else:
+                pipe.zrem(side_key, order_member(order_details))
+                pipe.hdel(keys.order_details_key, order_id)
+                pipe.hdel(ORDER_INDEX_KEY, order_id)
+                pipe.hdel(trader_orders_key(order_details["trader_id"]), order_id)
+
+            price_ticks = order_details["price_ticks"]
+            level = level_key(price_ticks)
+            level_lots, level_orders = level_state
+            if level_orders > 0:
+                pipe.zadd(levels_key, {level: price_ticks})
+                pipe.hset(depth_key, mapping={f"q:{level}": level_lots, f"n:{level}": level_orders})
+            else:
+                pipe.zrem(levels_key, level)
+                pipe.hdel(depth_key, f"q:{level}", f"n:{level}")
+        pipe.execute()
+
+class InMemoryOrderBook:
+    """
+    In-process order book with the same interface as the Redis OrderBook.
+    - Sorted price levels per side, each holding a FIFO queue of resting orders
+    - O(1) best bid / best ask
+    - Optional asynchronous mirror of every change to Redis
+    """
+
+    def __init__(self, symbol: str, mirror: Optional[RedisBookMirror] = None):
+        self.symbol = symbol
+        self.spec = get_symbol_spec(symbol)
+        self.mirror = mirror
+        self.bids = BookSide(OrderSide.BUY)
+        self.asks = BookSide(OrderSide.SELL)
+        self.orders: Dict[str, Dict] = {}
+        # Resting order ids per trader, for mass cancels
+        self.trader_orders: Dict[str, set] = {}
+        # Sequence number of the last published depth delta
+        self.sequence = 0
+        # Matching for a symbol must not interleave between threads
+        self.lock = threading.RLock()
+
+    def _side(self, side) -> BookSide:
+        return self.bids if side == OrderSide.BUY else self.asks
+
+    def _level_state(self, order_details: Dict) -> Tuple[int, int]:
+        """(lots, orders) at an order's price level, (0, 0) once the level is gone"""
+        level = self._side(order_details["side"]).levels.get(order_details["price_ticks"])
+        return (level.lots, len(level.orders)) if level is not None else (0, 0)
+
+    def add_order(self, order) -> str:
+        """Add order to the order book"""
+        return self.restore_order(build_order_details(order))
+
+    def restore_order(self, order_details: Dict, mirror: bool = True) -> str:
+        """Insert already-built order details, keeping their timestamp"""
+        with self.lock:
+            order_id = order_details["order_id"]
+            if order_id in self.orders:
+                self.remove_order(order_id)
+            self.orders[order_id] = order_details
+            self.trader_orders.setdefault(order_details["trader_id"], set()).add(order_id)
+            self._side(order_details["side"]).add(order_details)
+            # Queued under the lock so level states reach the mirror in the order they happened
+            if mirror and self.mirror:
+                self.mirror.save(self.symbol, order_details, self._level_state(order_details))
+        return order_id
+
+    def remove_order(self, order_id: str) -> bool:
+        """Remove order from the order book"""
+        with self.lock:
+            order_details = self.orders.pop(order_id, None)
+            if order_details is None:
+                return False
+            self._side(order_details["side"]).remove(order_id, order_details["price_ticks"])
+            trader_orders = self.trader_orders.get(order_details["trader_id"])
+            if trader_orders is not None:
+                trader_orders.discard(order_id)
+                if not trader_orders:
+                    del self.trader_orders[order_details["trader_id"]]
+            if self.mirror:
+                self.mirror.remove(self.symbol, order_details, self._level_state(order_details))
+        return True
+
+    def cancel_orders(self, order_ids: List[str], trader_id: Optional[str] = None) -> List[Dict]:
+        """Cancel resting orders; returns the details of those that were still resting"""
+        cancelled = []
+        with self.lock:
+            for order_id in order_ids:
+                order_details = self.orders.get(order_id)
+                if order_details is None or not self.remove_order(order_id):
+                    continue
+                cancelled.append(dict(order_details, status=OrderStatus.CANCELLED))
+        return cancelled
+
+    def open_order_ids(self) -> List[str]:
+        """Ids of every resting order of the symbol"""
+        with self.lock:
+            return list(self.orders)
+
+    def update_order(self, order_id: str, quantity_lots: int = None, status: str = None) -> bool:
+        """Update order quantity (in lots) or status"""
+        with self.lock:
+            order_details = self.orders.get(order_id)
+            if order_details is None:
+                return False
+
+            updated = False
+            if quantity_lots is not None and quantity_lots != order_details.get("quantity_lots"):
+                side = self._side(order_details["side"])
+                side.reduce(order_details["price_ticks"], int(order_details.get("quantity_lots", 0)) - int(quantity_lots))
+                order_details["quantity_lots"] = int(quantity_lots)
+                updated = True
+            if status is not None and status != order_details.get("status"):
+                order_details["status"] = status
+                updated = True
+            if updated and self.mirror:
+                self.mirror.save(self.symbol, order_details, self._level_state(order_details))
+        return updated
+
+    def get_order(self, order_id: str) -> Optional[Dict]:
+        """Get the stored details of a resting order"""
+        order_details = self.orders.get(order_id)
+        return dict(order_details) if order_details is not None else None
+
+    def fill_order(self, order_id: str, lots: int) -> Optional[Dict]:
+        """
+        Apply a fill of some lots to a resting order.
+        Fully filled orders are removed from the book; returns a copy of the updated details.
+        The book's own details are always used: a lookup is a dict read here, and a copy held
+        by the caller could be stale.
+        """
+        with self.lock:
+            order_details = self.orders.get(order_id)
+            if order_details is None:
+                return None
+
+            filled_lots = int(order_details.get("filled_lots", 0)) + lots
+            if filled_lots >= int(order_details.get("quantity_lots", 0)):
+                # Removing takes the whole open quantity off the level
+                self.remove_order(order_id)
+                order_details["filled_lots"] = filled_lots
+                order_details["status"] = OrderStatus.FILLED
+            else:
+                self._side(order_details["side"]).reduce(order_details["price_ticks"], lots)
+                order_details["filled_lots"] = filled_lots
+                order_details["status"] = OrderStatus.PARTIALLY_FILLED
+                if self.mirror:
+                    self.mirror.save(self.symbol, order_details, self._level_state(order_details))
+
+            return dict(order_details)
+
+    def peek_orders(self, side, count: int, offset: int = 0) -> List[Dict]:
+        """Details of up to count resting orders of a side in priority order, starting at offset"""
+        entries = []
+        with self.lock:
+            position = 0
+            for level in self._side(side).iter_levels():
+                if position + len(level.orders) <= offset:
+                    position += len(level.orders)
+                    continue
+                for order_details in level.orders.values():
+                    if position >= offset:
+                        entries.append(dict(order_details))
+                        if len(entries) >= count:
+                            return entries
+                    position += 1
+        return entries
+
+    def apply_fills(self, fills: List[Tuple[Dict, int]]) -> List[Optional[Dict]]:
+        """
+        Apply fills (order details as read, lots filled); returns the updated details in the same
+        order, None for orders no longer resting
+        """
+        with self.lock:
+            return [self.fill_order(order_details["order_id"], lots) for order_details, lots in fills]
+
+    def _best(self, side: BookSide) -> Tuple[Optional[str], Optional[int]]:
+        level = side.best_level()
+        if level is None:
+            return None, None
+        return next(iter(level.orders)), level.price_ticks
+
+    def get_best_bid(self) -> Tuple[Optional[str], Optional[int]]:
+        """Get the highest bid order id and price in ticks"""
+        return self._best(self.bids)
+
+    def get_best_ask(self) -> Tuple[Optional[str], Optional[int]]:
+        """Get the lowest ask order id and price in ticks"""
+        return self._best(self.asks)
+
+    def _side_snapshot(self, side: BookSide, depth: int) -> List[Dict]:
+        entries = []
+        for level in side.iter_levels():
+            for order_id, order_details in level.orders.items():
+                if len(entries) >= depth:
+                    return entries
+                entries.append({
+                    "price": self.spec.price(level.price_ticks),
+                    "quantity": self.spec.quantity(order_details.get("quantity_lots", 0)),
+                    "order_id": order_id
+                })
+        return entries
+
+    def _side_depth(self, side: BookSide, depth: int) -> List[Dict]:
+        levels = []
+        for level in side.iter_levels():
+            if len(levels) >= depth:
+                break
+            levels.append({"price": self.spec.price(level.price_ticks), "quantity": self.spec.quantity(level.lots),
+                           "orders": len(level.orders)})
+        return levels
+
+    def drain_level_changes(self) -> Optional[Dict]:
+        """
+        Return and clear the price levels changed since the last call, as absolute
+        [price, quantity, orders] entries (0 orders means the level is gone).
+        """
+        with self.lock:
+            if not self.bids.changed and not self.asks.changed:
+                return None
+            spec = self.spec
+            return {
+                side: [[spec.price(ticks), spec.quantity(lots), orders] for ticks, lots, orders in changes]
+                for side, changes in (("bids", self.bids.drain_changes()), ("asks", self.asks.drain_changes()))
+            }
+
+    def next_sequence(self) -> int:
+        """Assign the next depth delta sequence number"""
+        with self.lock:
+            self.sequence += 1
+            return self.sequence
+
+    def get_depth_snapshot(self, depth: int = 10) -> Dict:
+        """
+        Get the aggregated (L2) price levels of the order book,
+        tagged with the sequence number of the last depth delta they include
+        """
+        with self.lock:
+            return {
+                "symbol": self.symbol,
+                "seq": self.sequence,
+                "bids": self._side_depth(self.bids, depth),
+                "asks": self._side_depth(self.asks, depth),
+                "timestamp": datetime.now(timezone.utc).timestamp()
+            }
+
+    def get_order_book_snapshot(self, depth: int = 10) -> Dict:
+        """Get an order-level (L3) snapshot of the order book at specific depth"""
+        with self.lock:
+            return {
+                "symbol": self.symbol,
+                "bids": self._side_snapshot(self.bids, depth),
+                "asks": self._side_snapshot(self.asks, depth),
+                "timestamp": datetime.now(timezone.utc).timestamp()
+            }
+
+    def load_from_redis(self, redis_client) -> int:
+        """Populate the book from the Redis order book keys; returns the number of orders loaded"""
+        keys = OrderBook(redis_client, self.symbol)
+        loaded = 0
+        for order_id, order_data in redis_client.hgetall(keys.order_details_key).items():
+            order_details = decode_order_details(order_id, self.symbol, order_data)
+            self.restore_order(order_details, mirror=False)
+            loaded += 1
+        return loaded
+
+# Process-wide in-memory books, one per symbol
+_books: Dict[str, InMemoryOrderBook] = {}
+_books_lock = threading.Lock()
+_mirror: Optional[RedisBookMirror] = None
+
+def get_memory_order_book(symbol: str, redis_client=None, mirror: bool = True) -> InMemoryOrderBook:
+    """
+    Get the process-wide in-memory book for a symbol.
+    The first time a symbol is requested the book is loaded from its Redis mirror.
+    """
+    global _mirror
+
+    book = _books.get(symbol)
+    if book is not None:
+        return book
+
+    with _books_lock:
+        book = _books.get(symbol)
+        if book is None:
+            if mirror and redis_client is not None and _mirror is None:
+                _mirror = RedisBookMirror(redis_client)
+            book = InMemoryOrderBook(symbol, _mirror if mirror else None)
+            if redis_client is not None:
+                try:
+                    book.load_from_redis(redis_client)
+                except Exception as e:
+                    print(f"Could not load {symbol} order book from Redis: {str(e)}")
+            _books[symbol] = book
+    return book
+
+def loaded_memory_books() -> Dict[str, InMemoryOrderBook]:
+    """The in-memory books loaded in this process, by symbol"""
+    return dict(_books)
+
+def find_memory_order(order_id: str) -> Optional[str]:
+    """Symbol of the loaded in-memory book an order rests on, if any"""
+    for symbol, book in list(_books.items()):
+        if order_id in book.orders:
+            return symbol
+    return None
+
+def memory_trader_orders(trader_id: str) -> Dict[str, List[str]]:
+    """Resting order ids of a trader on the loaded in-memory books, by symbol"""
+    orders = {}
+    for symbol, book in list(_books.items()):
+        with book.lock:
+            order_ids = list(book.trader_orders.get(trader_id, ()))
+        if order_ids:
+            orders[symbol] = order_ids
+    return orders
+
+def flush_order_book_mirror(timeout: Optional[float] = None):
+    """Wait for pending mirror writes to reach Redis"""
+    if _mirror is not None:
+        _mirror.flush(timeout)
+
+def unload_memory_order_book(symbol: str, timeout: Optional[float] = None) -> bool:
+    """
+    Drop a symbol's in-memory book once its changes have reached the Redis mirror, so another
+    process can load it from there. Returns False if the book was not loaded.
+    """
+    book = _books.get(symbol)
+    if book is None:
+        return False
+    with book.lock:
+        flush_order_book_mirror(timeout)
+        with _books_lock:
+            _books.pop(symbol, None)
+    return True
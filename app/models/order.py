@@ -1,10 +1,12 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Enum, Boolean, ForeignKey
+from sqlalchemy import BigInteger, Column, Integer, String, Float, DateTime, Enum, Boolean, ForeignKey
 from sqlalchemy.sql import func
 from app.db.postgres import Base
 import enum
 from typing import Optional
 from datetime import datetime
 from pydantic import BaseModel, Field
+from typing import List
+from app.models.trade import Trade
 
 # SQLAlchemy Models
 class OrderSide(str, enum.Enum):
@@ -36,8 +38,13 @@ class OrderModel(Base):
     price = Column(Float, nullable=True)
     status = Column(Enum(OrderStatus), default=OrderStatus.PENDING)
     filled_quantity = Column(Float, default=0)
+    # Exact values the engine works with: price in ticks, quantities in lots of the symbol
+    price_ticks = Column(BigInteger, nullable=True)
+    quantity_lots = Column(BigInteger)
+    filled_lots = Column(BigInteger, default=0)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Set on insert too, so orders changed since a book snapshot can be found by this column alone
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
 
 # Pydantic Models
 class OrderBase(BaseModel):
@@ -60,3 +67,17 @@ class Order(OrderBase):
 
     class Config:
         orm_mode = True
+
+class OrderAccepted(BaseModel):
+    """An order queued for matching; its outcome is read back with GET /orders/{order_id}"""
+    order_id: str
+    symbol: str
+    status: OrderStatus = OrderStatus.PENDING
+
+class OrderBatchResult(BaseModel):
+    order: Optional[Order] = None
+    trades: List[Trade] = []
+    error: Optional[str] = None
+
+class OrderBatchResponse(BaseModel):
+    results: List[OrderBatchResult]
@@ -1,83 +1,285 @@
-import json
 import redis
-import uuid
 from datetime import datetime, timezone
 from typing import Dict, List, Optional, Tuple
+from app.models.instrument import SymbolSpec, get_symbol_spec
 from app.models.order import OrderSide, OrderStatus
+from app.models.order_codec import decode_order_details, encode_order_details
+from app.models.order_book_scripts import (
+    APPLY_FILLS_SCRIPT, CANCEL_ORDERS_SCRIPT, DEPTH_SNAPSHOT_SCRIPT, DROP_EMPTY_LEVEL_SCRIPT
+)
+
+# Where every resting order rests, across symbols: order id -> "<side>|<symbol>"
+ORDER_INDEX_KEY = "orders:index"
+
+def trader_orders_key(trader_id: str) -> str:
+    """Hash of a trader's resting orders: order id -> symbol"""
+    return f"trader:{trader_id}:orders"
+
+def index_entry(side, symbol: str) -> str:
+    """Order index value of a resting order (the side first, symbols may contain any character)"""
+    return f"{OrderSide(side).value}|{symbol}"
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+def locate_order(redis_client, order_id: str) -> Optional[Tuple[str, str]]:
+    """Symbol and side of a resting order from the order index, None if it is not resting"""
+    entry = redis_client.hget(ORDER_INDEX_KEY, order_id)
+    if not entry:
+        return None
+    side, symbol = _text(entry).split("|", 1)
+    return symbol, side
+
+def trader_open_orders(redis_client, trader_id: str) -> Dict[str, List[str]]:
+    """Resting order ids of a trader by symbol, from the trader's order index"""
+    orders: Dict[str, List[str]] = {}
+    for order_id, symbol in redis_client.hgetall(trader_orders_key(trader_id)).items():
+        orders.setdefault(_text(symbol), []).append(_text(order_id))
+    return orders
+
+def level_key(price_ticks: int) -> str:
+    """Canonical string for a price level (matches string.format('%d') in the Lua scripts)"""
+    return str(int(price_ticks))
+
+def remaining_lots(order_details: Dict) -> int:
+    """Lots of a resting order still open"""
+    return int(order_details.get("quantity_lots", 0)) - int(order_details.get("filled_lots", 0))
+
+def order_member(order_details: Dict) -> str:
+    """
+    Sorted set member of a resting order: arrival time in microseconds, zero padded, then the
+    order id. Orders at one price share a score and Redis orders equal scores by member,
+    so members sort by time priority.
+    """
+    return f"{int(order_details['created_at'] * 1e6):016d}:{order_details['order_id']}"
+
+def member_order_id(member) -> str:
+    """Order id of a sorted set member"""
+    if isinstance(member, bytes):
+        member = member.decode()
+    return member.split(":", 1)[1] if ":" in member else member
+
+def order_units(order, spec: SymbolSpec = None) -> Tuple[Optional[int], int, int]:
+    """Price ticks, quantity lots and filled lots of an order, from its integer columns when set"""
+    spec = spec or get_symbol_spec(order.symbol)
+    price_ticks = getattr(order, "price_ticks", None)
+    if price_ticks is None and order.price is not None:
+        price_ticks = spec.to_ticks(order.price, exact=False)
+    quantity_lots = getattr(order, "quantity_lots", None)
+    if quantity_lots is None:
+        quantity_lots = spec.to_lots(order.quantity, exact=False)
+    filled_lots = getattr(order, "filled_lots", None)
+    if filled_lots is None:
+        filled_lots = spec.to_lots(order.filled_quantity or 0, exact=False)
+    return price_ticks, quantity_lots, filled_lots
+
+def build_order_details(order) -> Dict:
+    """Build the stored representation of a resting order"""
+    # Timestamp used for time priority within a price level
+    timestamp = datetime.now(timezone.utc).timestamp()
+    price_ticks, quantity_lots, filled_lots = order_units(order)
+    
+    return {
+        "order_id": order.order_id,
+        "trader_id": order.trader_id,
+        "symbol": order.symbol,
+        "side": order.side,
+        "order_type": order.order_type,
+        "quantity_lots": quantity_lots,
+        "price_ticks": price_ticks,
+        "status": order.status,
+        "filled_lots": filled_lots,
+        "created_at": timestamp
+    }
 
 class OrderBook:
     """
     OrderBook implementation using Redis sorted sets.
-    - Buy orders sorted by price (descending) then time (ascending)
-    - Sell orders sorted by price (ascending) then time (ascending)
+    Prices are integer ticks and quantities integer lots (see app/models/instrument.py);
+    floats are only produced for snapshots and depth deltas.
+    - Buy orders scored by -ticks, sell orders by +ticks; members carry the arrival time
+      (order_member) so orders within a level are in time priority
+    - Aggregated (L2) depth per side is maintained on every add, fill and cancel:
+      a sorted set of price levels plus a hash of "q:<ticks>" open lots
+      and "n:<ticks>" order count
+    - Resting orders are indexed across symbols (ORDER_INDEX_KEY) and per trader
+      (trader_orders_key), so cancels need neither the database nor the symbol
     """
     
     def __init__(self, redis_client: redis.Redis, symbol: str):
         self.redis = redis_client
         self.symbol = symbol
+        self.spec = get_symbol_spec(symbol)
         self.buy_orders_key = f"orderbook:{symbol}:buy"
         self.sell_orders_key = f"orderbook:{symbol}:sell"
         self.order_details_key = f"orderbook:{symbol}:details"
+        self.buy_levels_key = f"orderbook:{symbol}:levels:buy"
+        self.sell_levels_key = f"orderbook:{symbol}:levels:sell"
+        self.buy_depth_key = f"orderbook:{symbol}:depth:buy"
+        self.sell_depth_key = f"orderbook:{symbol}:depth:sell"
+        # Sequence number of the last published depth delta
+        self.sequence_key = f"orderbook:{symbol}:seq"
+        # Price levels changed since the last drain: side -> ticks -> (lots, orders)
+        self.level_changes: Dict[str, Dict[int, Tuple[int, int]]] = {"buy": {}, "sell": {}}
+    
+    def _side_keys(self, side) -> Tuple[str, str, str]:
+        """Orders, levels and depth keys for a side"""
+        if side == OrderSide.BUY:
+            return self.buy_orders_key, self.buy_levels_key, self.buy_depth_key
+        return self.sell_orders_key, self.sell_levels_key, self.sell_depth_key
     
     def add_order(self, order) -> str:
         """Add order to the order book"""
-        # Create score for sorting
-        # For buy orders, negative price to sort in descending order
-        timestamp = datetime.now(timezone.utc).timestamp()
-        
-        # Store order details
-        order_details = {
-            "order_id": order.order_id,
-            "trader_id": order.trader_id,
-            "symbol": order.symbol,
-            "side": order.side,
-            "order_type": order.order_type,
-            "quantity": order.quantity,
-            "price": order.price,
-            "status": order.status,
-            "filled_quantity": order.filled_quantity,
-            "created_at": timestamp
-        }
-        
-        # Add to sorted set based on side
-        if order.side == OrderSide.BUY:
-            # Sort by negative price (highest first), then timestamp
-            score = (-float(order.price) * 1e10) + timestamp
-            self.redis.zadd(self.buy_orders_key, {order.order_id: score})
-        else:
-            # Sort by price (lowest first), then timestamp
-            score = (float(order.price) * 1e10) + timestamp
-            self.redis.zadd(self.sell_orders_key, {order.order_id: score})
+        return self.restore_order(build_order_details(order))
+    
+    def restore_order(self, order_details: Dict) -> str:
+        """Write already-built order details to the book, keeping their timestamp"""
+        order_id = order_details["order_id"]
+        price_ticks = order_details["price_ticks"]
+        orders_key, levels_key, depth_key = self._side_keys(order_details["side"])
+        level = level_key(price_ticks)
         
-        # Store order details
-        self.redis.hset(self.order_details_key, order.order_id, json.dumps(order_details))
+        pipe = self.redis.pipeline(transaction=False)
+        # Add to sorted set based on side and store order details
+        pipe.zadd(orders_key, {order_member(order_details): self.order_score(order_details["side"], price_ticks)})
+        pipe.hset(self.order_details_key, order_id, encode_order_details(order_details))
+        # Add to the aggregated price level
+        pipe.zadd(levels_key, {level: price_ticks})
+        pipe.hincrby(depth_key, f"q:{level}", remaining_lots(order_details))
+        pipe.hincrby(depth_key, f"n:{level}", 1)
+        self._index_order(pipe, order_details)
+        results = pipe.execute()
+        self.record_level_change(order_details["side"], price_ticks, results[3], results[4])
         
-        return order.order_id
+        return order_id
+    
+    @staticmethod
+    def order_score(side, price_ticks: int) -> int:
+        """Sorted set score giving price priority for a side (time priority is in the member)"""
+        if side == OrderSide.BUY:
+            # Highest price first
+            return -int(price_ticks)
+        # Lowest price first
+        return int(price_ticks)
+    
+    def _index_order(self, pipe, order_details: Dict):
+        """Queue the order and trader index entries of a resting order"""
+        order_id = order_details["order_id"]
+        pipe.hset(ORDER_INDEX_KEY, order_id, index_entry(order_details["side"], self.symbol))
+        pipe.hset(trader_orders_key(order_details["trader_id"]), order_id, self.symbol)
+    
+    @staticmethod
+    def _unindex_order(pipe, order_details: Dict):
+        """Queue the removal of a resting order's index entries"""
+        pipe.hdel(ORDER_INDEX_KEY, order_details["order_id"])
+        pipe.hdel(trader_orders_key(order_details["trader_id"]), order_details["order_id"])
     
     def remove_order(self, order_id: str) -> bool:
         """Remove order from the order book"""
-        # Check which side the order is on
-        buy_removed = self.redis.zrem(self.buy_orders_key, order_id)
-        sell_removed = self.redis.zrem(self.sell_orders_key, order_id)
+        order_details = self.get_order(order_id)
+        if order_details is None:
+            # No details to locate the order; make sure it is not left on either side
+            for orders_key in (self.buy_orders_key, self.sell_orders_key):
+                members = [member for member, _ in self.redis.zscan_iter(orders_key, match=f"*:{order_id}")]
+                if members:
+                    self.redis.zrem(orders_key, *members)
+            return False
         
-        # Remove order details
-        details_removed = self.redis.hdel(self.order_details_key, order_id)
+        return self._remove_resting(order_details, remaining_lots(order_details))
+    
+    def _remove_resting(self, order_details: Dict, open_lots: int) -> bool:
+        """Remove a resting order and take its open lots off its price level"""
+        order_id = order_details["order_id"]
+        orders_key, levels_key, depth_key = self._side_keys(order_details["side"])
+        level = level_key(order_details["price_ticks"])
+        
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zrem(orders_key, order_member(order_details))
+        pipe.hdel(self.order_details_key, order_id)
+        pipe.hincrby(depth_key, f"q:{level}", -open_lots)
+        pipe.hincrby(depth_key, f"n:{level}", -1)
+        self._unindex_order(pipe, order_details)
+        removed, details_removed, level_lots, orders_left = pipe.execute()[:4]
+        self.record_level_change(order_details["side"], order_details["price_ticks"], level_lots, orders_left)
+        
+        # Drop the level once its last order is gone
+        if orders_left <= 0:
+            drop_level = self.redis.register_script(DROP_EMPTY_LEVEL_SCRIPT)
+            drop_level(keys=[levels_key, depth_key], args=[level])
+        
+        return removed > 0 and details_removed > 0
+    
+    def cancel_orders(self, order_ids: List[str], trader_id: Optional[str] = None, attempts: int = 3) -> List[Dict]:
+        """
+        Cancel resting orders in two round trips: one HMGET of their details, then one script call
+        removing every order whose details are unchanged and updating each touched level once.
+        Orders rewritten by a concurrent fill in between are read again, up to attempts times.
+        Ids without details are dropped from the order index (and from trader_id's, if given).
+        Returns the details of the cancelled orders.
+        """
+        cancelled = []
+        pending = list(dict.fromkeys(order_ids))
+        cancel = self.redis.register_script(CANCEL_ORDERS_SCRIPT)
+        for _ in range(attempts):
+            if not pending:
+                break
+            
+            read: Dict[str, Dict] = {}
+            args, missing = [], []
+            for order_id, order_data in zip(pending, self.redis.hmget(self.order_details_key, pending)):
+                if not order_data:
+                    missing.append(order_id)
+                    continue
+                order_details = decode_order_details(order_id, self.symbol, order_data)
+                read[order_id] = order_details
+                args += [order_id, order_data, OrderSide(order_details["side"]).value, order_member(order_details),
+                         level_key(order_details["price_ticks"]), remaining_lots(order_details),
+                         trader_orders_key(order_details["trader_id"])]
+            if missing:
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.hdel(ORDER_INDEX_KEY, *missing)
+                if trader_id is not None:
+                    pipe.hdel(trader_orders_key(trader_id), *missing)
+                pipe.execute()
+            if not args:
+                break
+            
+            removed, levels = cancel(
+                keys=[self.order_details_key, self.buy_orders_key, self.sell_orders_key,
+                      self.buy_levels_key, self.buy_depth_key, self.sell_levels_key, self.sell_depth_key,
+                      ORDER_INDEX_KEY],
+                args=args
+            )
+            for i in range(0, len(levels), 4):
+                self.record_level_change(_text(levels[i]), levels[i + 1], levels[i + 2], levels[i + 3])
+            
+            removed = {_text(order_id) for order_id in removed}
+            for order_id, order_details in read.items():
+                if order_id in removed:
+                    order_details["status"] = OrderStatus.CANCELLED
+                    cancelled.append(order_details)
+            pending = [order_id for order_id in read if order_id not in removed]
         
-        return (buy_removed or sell_removed) and details_removed > 0
+        return cancelled
+    
+    def open_order_ids(self) -> List[str]:
+        """Ids of every resting order of the symbol"""
+        return [_text(order_id) for order_id in self.redis.hkeys(self.order_details_key)]
 
-    def update_order(self, order_id: str, quantity: float = None, status: str = None) -> bool:
-        """Update order quantity or status"""
+    def update_order(self, order_id: str, quantity_lots: int = None, status: str = None) -> bool:
+        """Update order quantity (in lots) or status"""
         # Get order details
-        order_json = self.redis.hget(self.order_details_key, order_id)
-        if not order_json:
+        order_details = self.get_order(order_id)
+        if order_details is None:
             return False
         
-        order_details = json.loads(order_json)
         updated = False
+        lots_delta = 0
         
         # Update quantity if provided
-        if quantity is not None and quantity != order_details.get("quantity"):
-            order_details["quantity"] = quantity
+        if quantity_lots is not None and quantity_lots != order_details.get("quantity_lots"):
+            lots_delta = int(quantity_lots) - int(order_details.get("quantity_lots", 0))
+            order_details["quantity_lots"] = int(quantity_lots)
             updated = True
         
         # Update status if provided
@@ -86,76 +288,280 @@ class OrderBook:
             updated = True
         
         if updated:
-            # Store updated details
-            self.redis.hset(self.order_details_key, order_id, json.dumps(order_details))
+            # Store updated details and keep the price level total in line
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hset(self.order_details_key, order_id, encode_order_details(order_details))
+            if lots_delta:
+                _, _, depth_key = self._side_keys(order_details["side"])
+                level = level_key(order_details["price_ticks"])
+                pipe.hincrby(depth_key, f"q:{level}", lots_delta)
+                pipe.hget(depth_key, f"n:{level}")
+            results = pipe.execute()
+            if lots_delta:
+                self.record_level_change(order_details["side"], order_details["price_ticks"], results[1], results[2])
         
         return updated
     
-    def get_best_bid(self) -> Tuple[Optional[str], Optional[float]]:
-        """Get the highest bid order id and price"""
-        # Get highest bid (first element in sorted set)
-        best_bid = self.redis.zrange(self.buy_orders_key, 0, 0, withscores=True)
-        if not best_bid:
-            return None, None
+    def get_order(self, order_id: str) -> Optional[Dict]:
+        """Get the stored details of a resting order"""
+        order_data = self.redis.hget(self.order_details_key, order_id)
+        if not order_data:
+            return None
+        return decode_order_details(order_id, self.symbol, order_data)
+    
+    def fill_order(self, order_id: str, lots: int, order_details: Dict = None) -> Optional[Dict]:
+        """
+        Apply a fill of some lots to a resting order.
+        Fully filled orders are removed from the book; returns the updated details.
+        Callers that already read the details can pass them to save a lookup.
+        """
+        if order_details is None:
+            order_details = self.get_order(order_id)
+        if order_details is None:
+            return None
         
-        order_id = best_bid[0][0].decode() if isinstance(best_bid[0][0], bytes) else best_bid[0][0]
-        order_json = self.redis.hget(self.order_details_key, order_id)
-        if not order_json:
-            return None, None
+        order_details["filled_lots"] = int(order_details.get("filled_lots", 0)) + lots
+        if order_details["filled_lots"] >= int(order_details.get("quantity_lots", 0)):
+            order_details["status"] = OrderStatus.FILLED
+            self._remove_resting(order_details, lots)
+        else:
+            order_details["status"] = OrderStatus.PARTIALLY_FILLED
+            _, _, depth_key = self._side_keys(order_details["side"])
+            level = level_key(order_details["price_ticks"])
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hset(self.order_details_key, order_id, encode_order_details(order_details))
+            pipe.hincrby(depth_key, f"q:{level}", -lots)
+            pipe.hget(depth_key, f"n:{level}")
+            results = pipe.execute()
+            self.record_level_change(order_details["side"], order_details["price_ticks"], results[1], results[2])
         
-        order_details = json.loads(order_json)
-        return order_id, order_details.get("price")
+        return order_details
     
-    def get_best_ask(self) -> Tuple[Optional[str], Optional[float]]:
-        """Get the lowest ask order id and price"""
-        # Get lowest ask (first element in sorted set)
-        best_ask = self.redis.zrange(self.sell_orders_key, 0, 0, withscores=True)
-        if not best_ask:
-            return None, None
+    def peek_orders(self, side, count: int, offset: int = 0) -> List[Dict]:
+        """
+        Details of up to count resting orders of a side in priority order, starting at offset,
+        in two round trips. Entries left without details are dropped from the book on the way.
+        """
+        orders_key, _, _ = self._side_keys(side)
+        members = self.redis.zrange(orders_key, offset, offset + count - 1)
+        if not members:
+            return []
+        
+        order_ids = [member_order_id(member) for member in members]
+        values = self.redis.hmget(self.order_details_key, order_ids)
+        orphans = [member for member, order_data in zip(members, values) if not order_data]
+        if orphans:
+            self.redis.zrem(orders_key, *orphans)
+        
+        return [
+            decode_order_details(order_id, self.symbol, order_data)
+            for order_id, order_data in zip(order_ids, values) if order_data
+        ]
+    
+    def apply_fills(self, fills: List[Tuple[Dict, int]]) -> List[Optional[Dict]]:
+        """
+        Apply fills (order details as read, lots filled) to resting orders in one script call:
+        fully filled orders are removed and each touched level is updated.
+        A fill is only applied while the order is unchanged since it was read; orders cancelled,
+        filled or amended in between come back as None. Returns the updated details in the same order.
+        """
+        if not fills:
+            return []
+        
+        args = []
+        for order_details, lots in fills:
+            args += [order_details["order_id"], int(order_details.get("quantity_lots", 0)),
+                     int(order_details.get("filled_lots", 0)), OrderSide(order_details["side"]).value,
+                     order_member(order_details), level_key(order_details["price_ticks"]), lots,
+                     trader_orders_key(order_details["trader_id"])]
+        apply = self.redis.register_script(APPLY_FILLS_SCRIPT)
+        applied, levels = apply(
+            keys=[self.order_details_key, self.buy_orders_key, self.sell_orders_key,
+                  self.buy_levels_key, self.buy_depth_key, self.sell_levels_key, self.sell_depth_key,
+                  ORDER_INDEX_KEY],
+            args=args
+        )
+        for i in range(0, len(levels), 4):
+            self.record_level_change(_text(levels[i]), levels[i + 1], levels[i + 2], levels[i + 3])
+        
+        updated = []
+        for (order_details, lots), was_applied in zip(fills, applied):
+            if not int(was_applied):
+                updated.append(None)
+                continue
+            order_details = dict(order_details)
+            order_details["filled_lots"] = int(order_details.get("filled_lots", 0)) + lots
+            if order_details["filled_lots"] >= int(order_details.get("quantity_lots", 0)):
+                order_details["status"] = OrderStatus.FILLED
+            else:
+                order_details["status"] = OrderStatus.PARTIALLY_FILLED
+            updated.append(order_details)
+        return updated
+    
+    def record_level_change(self, side, price_ticks: int, lots, orders):
+        """Remember the new totals of a price level for the next depth delta"""
+        orders = int(orders or 0)
+        lots = int(lots or 0) if orders > 0 else 0
+        side = "buy" if side == OrderSide.BUY else "sell"
+        self.level_changes[side][int(price_ticks)] = (lots, orders)
+    
+    def drain_level_changes(self) -> Optional[Dict]:
+        """
+        Return and clear the price levels changed since the last call, as absolute
+        [price, quantity, orders] entries (0 orders means the level is gone).
+        """
+        if not self.level_changes["buy"] and not self.level_changes["sell"]:
+            return None
         
-        order_id = best_ask[0][0].decode() if isinstance(best_ask[0][0], bytes) else best_ask[0][0]
-        order_json = self.redis.hget(self.order_details_key, order_id)
-        if not order_json:
+        spec = self.spec
+        changes = {
+            "bids": [[spec.price(ticks), spec.quantity(lots), orders]
+                     for ticks, (lots, orders) in self.level_changes["buy"].items()],
+            "asks": [[spec.price(ticks), spec.quantity(lots), orders]
+                     for ticks, (lots, orders) in self.level_changes["sell"].items()]
+        }
+        self.level_changes = {"buy": {}, "sell": {}}
+        return changes
+    
+    def _best(self, orders_key: str) -> Tuple[Optional[str], Optional[int]]:
+        # The best order is the first member; its price is the absolute score
+        best = self.redis.zrange(orders_key, 0, 0, withscores=True)
+        if not best:
             return None, None
+        member, score = best[0]
+        return member_order_id(member), abs(int(score))
+    
+    def get_best_bid(self) -> Tuple[Optional[str], Optional[int]]:
+        """Get the highest bid order id and price in ticks"""
+        return self._best(self.buy_orders_key)
+    
+    def get_best_ask(self) -> Tuple[Optional[str], Optional[int]]:
+        """Get the lowest ask order id and price in ticks"""
+        return self._best(self.sell_orders_key)
+    
+    def get_depth_snapshot(self, depth: int = 10) -> Dict:
+        """
+        Get the aggregated (L2) price levels of the order book in a single script call,
+        tagged with the sequence number of the last depth delta they include
+        """
+        depth_snapshot = self.redis.register_script(DEPTH_SNAPSHOT_SCRIPT)
+        bid_levels, ask_levels, sequence = depth_snapshot(
+            keys=[self.buy_levels_key, self.buy_depth_key, self.sell_levels_key, self.sell_depth_key,
+                  self.sequence_key],
+            args=[depth]
+        )
         
-        order_details = json.loads(order_json)
-        return order_id, order_details.get("price")
+        def parse(levels) -> List[Dict]:
+            return [
+                {"price": self.spec.price(int(levels[i])), "quantity": self.spec.quantity(int(levels[i + 1])),
+                 "orders": int(levels[i + 2])}
+                for i in range(0, len(levels), 3)
+            ]
+        
+        return {
+            "symbol": self.symbol,
+            "seq": int(sequence),
+            "bids": parse(bid_levels),
+            "asks": parse(ask_levels),
+            "timestamp": datetime.now(timezone.utc).timestamp()
+        }
     
-    def get_order_book_snapshot(self, depth: int = 10) -> Dict:
-        """Get a snapshot of the order book at specific depth"""
-        bid_orders = self.redis.zrange(self.buy_orders_key, 0, depth-1, withscores=True)
-        ask_orders = self.redis.zrange(self.sell_orders_key, 0, depth-1, withscores=True)
-        
-        bids = []
-        asks = []
-        
-        # Process bid orders
-        for order_id_bytes, _ in bid_orders:
-            order_id = order_id_bytes.decode() if isinstance(order_id_bytes, bytes) else order_id_bytes
-            order_json = self.redis.hget(self.order_details_key, order_id)
-            if order_json:
-                order_details = json.loads(order_json)
-                bids.append({
-                    "price": order_details.get("price"),
-                    "quantity": order_details.get("quantity"),
-                    "order_id": order_id
-                })
+    def rebuild_indexes(self) -> int:
+        """
+        Recompute the order sorted sets, aggregated depth keys and order indexes from the resting
+        order details. Used after migrating details written by older versions (or by versions
+        without the order indexes); returns the number of levels.
+        """
+        stored = self.redis.hgetall(self.order_details_key)
+        orders = [decode_order_details(order_id, self.symbol, order_data) for order_id, order_data in stored.items()]
+        return self.load_orders(orders, list(stored.values()))
+    
+    def load_orders(self, orders: List[Dict], encoded: Optional[List[bytes]] = None, chunk_size: int = 1000) -> int:
+        """
+        Replace the whole book with the given resting orders in one transaction: details, sorted
+        sets, aggregated depth and order indexes, written in bulk commands of chunk_size entries.
+        Orders of the old book that are not reloaded are taken out of the order indexes.
+        Details already encoded for storage can be passed along to be written as they are.
+        Returns the number of levels.
+        """
+        if encoded is None:
+            encoded = [encode_order_details(order_details) for order_details in orders]
         
-        # Process ask orders
-        for order_id_bytes, _ in ask_orders:
-            order_id = order_id_bytes.decode() if isinstance(order_id_bytes, bytes) else order_id_bytes
-            order_json = self.redis.hget(self.order_details_key, order_id)
-            if order_json:
-                order_details = json.loads(order_json)
-                asks.append({
-                    "price": order_details.get("price"),
-                    "quantity": order_details.get("quantity"),
+        order_ids = {order_details["order_id"] for order_details in orders}
+        # (order id, trader id) of every order of the old book that is not reloaded
+        stale = []
+        for order_id, order_data in self.redis.hgetall(self.order_details_key).items():
+            order_id = order_id.decode() if isinstance(order_id, bytes) else order_id
+            if order_id not in order_ids:
+                stale.append((order_id, decode_order_details(order_id, self.symbol, order_data).get("trader_id")))
+        
+        members = {"buy": {}, "sell": {}}
+        levels: Dict[Tuple[str, int], List[int]] = {}
+        for order_details in orders:
+            side = OrderSide(order_details["side"]).value
+            price_ticks = order_details["price_ticks"]
+            members[side][order_member(order_details)] = self.order_score(side, price_ticks)
+            level = levels.setdefault((side, price_ticks), [0, 0])
+            level[0] += remaining_lots(order_details)
+            level[1] += 1
+        
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(self.order_details_key, self.buy_orders_key, self.sell_orders_key, self.buy_levels_key,
+                    self.sell_levels_key, self.buy_depth_key, self.sell_depth_key)
+        for i in range(0, len(stale), chunk_size):
+            chunk = stale[i:i + chunk_size]
+            pipe.hdel(ORDER_INDEX_KEY, *[order_id for order_id, _ in chunk])
+            stale_traders: Dict[str, List[str]] = {}
+            for order_id, trader_id in chunk:
+                if trader_id:
+                    stale_traders.setdefault(trader_id, []).append(order_id)
+            for trader_id, trader_orders in stale_traders.items():
+                pipe.hdel(trader_orders_key(trader_id), *trader_orders)
+        for i in range(0, len(orders), chunk_size):
+            chunk = orders[i:i + chunk_size]
+            pipe.hset(self.order_details_key, mapping={
+                order_details["order_id"]: order_data
+                for order_details, order_data in zip(chunk, encoded[i:i + chunk_size])
+            })
+            pipe.hset(ORDER_INDEX_KEY, mapping={
+                order_details["order_id"]: index_entry(order_details["side"], self.symbol) for order_details in chunk
+            })
+            traders: Dict[str, Dict[str, str]] = {}
+            for order_details in chunk:
+                traders.setdefault(order_details["trader_id"], {})[order_details["order_id"]] = self.symbol
+            for trader_id, trader_orders in traders.items():
+                pipe.hset(trader_orders_key(trader_id), mapping=trader_orders)
+        for side, side_members in members.items():
+            side_items = list(side_members.items())
+            for i in range(0, len(side_items), chunk_size):
+                pipe.zadd(self._side_keys(side)[0], dict(side_items[i:i + chunk_size]))
+        for (side, price_ticks), (lots, count) in levels.items():
+            _, levels_key, depth_key = self._side_keys(side)
+            level = level_key(price_ticks)
+            pipe.zadd(levels_key, {level: price_ticks})
+            pipe.hset(depth_key, mapping={f"q:{level}": lots, f"n:{level}": count})
+        pipe.execute()
+        
+        return len(levels)
+    
+    def _snapshot_side(self, orders_key: str, depth: int) -> List[Dict]:
+        entries = []
+        for member in self.redis.zrange(orders_key, 0, depth - 1):
+            order_id = member_order_id(member)
+            order_details = self.get_order(order_id)
+            if order_details:
+                entries.append({
+                    "price": self.spec.price(order_details.get("price_ticks")),
+                    "quantity": self.spec.quantity(order_details.get("quantity_lots", 0)),
                     "order_id": order_id
                 })
-        
+        return entries
+    
+    def get_order_book_snapshot(self, depth: int = 10) -> Dict:
+        """Get an order-level (L3) snapshot of the order book at specific depth"""
         return {
             "symbol": self.symbol,
-            "bids": bids,
-            "asks": asks,
-            "timestamp": datetime.now(timezone.utc).timestamp() 
-        }
\ No newline at end of file
+            "bids": self._snapshot_side(self.buy_orders_key, depth),
+            "asks": self._snapshot_side(self.sell_orders_key, depth),
+            "timestamp": datetime.now(timezone.utc).timestamp()
+        }
@@ -0,0 +1,474 @@
+"""
+Lua scripts executed server-side against the Redis order book and market data keys.
+Each script runs atomically, so concurrent workers never see a half-applied sweep.
+"""
+
+# Stored order details (app/models/order_codec.py) read and rewritten from Lua, shared by the
+# scripts below: the version 2 binary layout through struct, or JSON through cjson.
+ORDER_CODEC_LUA = """
+-- Fixed prefix of the binary layout, and status codes from order_codec.STATUSES
+local HEADER = '>BBBBi8i8i8d'
+local HEADER_SIZE = 36
+local STATUS_CODES = {active = 1, filled = 2, partially_filled = 3}
+
+-- Integers as Redis arguments and level names (plain tostring switches to exponents)
+local function int(x)
+    return string.format('%d', x)
+end
+
+local function read_order(raw)
+    if string.sub(raw, 1, 1) == '{' then
+        local stored = cjson.decode(raw)
+        local trader_id = type(stored.trader_id) == 'string' and stored.trader_id or nil
+        return {json = stored, quantity = tonumber(stored.quantity_lots) or 0,
+                filled = tonumber(stored.filled_lots) or 0, trader_id = trader_id}
+    end
+    local version, side, order_type, status, quantity, filled, price, created_at = struct.unpack(HEADER, raw)
+    local trader_id = string.sub(raw, HEADER_SIZE + 2, HEADER_SIZE + 1 + string.byte(raw, HEADER_SIZE + 1))
+    return {raw = raw, version = version, side = side, order_type = order_type, quantity = quantity,
+            filled = filled, price = price, created_at = created_at, trader_id = trader_id}
+end
+
+local function write_order(stored, filled, status)
+    if stored.json then
+        stored.json.filled_lots = filled
+        stored.json.status = status
+        return cjson.encode(stored.json)
+    end
+    return struct.pack(HEADER, stored.version, stored.side, stored.order_type, STATUS_CODES[status],
+                       stored.quantity, filled, stored.price, stored.created_at)
+        .. string.sub(stored.raw, HEADER_SIZE + 1)
+end
+"""
+
+# Match an incoming order against the opposite side of the book in a single call.
+# Prices are integer ticks and quantities integer lots throughout.
+#
+# KEYS[1] buy sorted set, KEYS[2] sell sorted set, KEYS[3] order details hash
+# KEYS[4] buy levels, KEYS[5] buy depth, KEYS[6] sell levels, KEYS[7] sell depth
+# KEYS[8] order index (order_book.ORDER_INDEX_KEY)
+# ARGV[1] incoming order (JSON: order_id, trader_id, side, order_type, price_ticks, quantity_lots, filled_lots);
+#         price_ticks is the worst price to trade at, null to sweep without a price limit
+# ARGV[2] score to rest the remainder with (limit orders only)
+# ARGV[3] incoming order details encoded for storage (app/models/order_codec.py)
+# ARGV[4] sorted set member to rest the remainder with (order_book.order_member)
+# ARGV[5] resting orders read per ranged fetch
+# ARGV[6] most price levels to sweep (0: no limit)
+# ARGV[7] symbol
+#
+# Resting details are read and rewritten in either stored encoding (ORDER_CODEC_LUA).
+# Trader order index keys (trader:<id>:orders) are derived from the stored trader ids, so they
+# are not declared in KEYS; this relies on a single Redis instance, as the rest of the book does.
+#
+# Returns {filled lots, status, fills, levels} with fills a flat list of
+# maker order id, price ticks, lots, maker filled lots, maker status, maker trader id ('' when
+# unknown) per fill and levels
+# a flat list of side, price ticks, level lots, level orders per touched level
+MATCH_ORDER_SCRIPT = ORDER_CODEC_LUA + """
+local order = cjson.decode(ARGV[1])
+local is_buy = order.side == 'buy'
+local book_key = is_buy and KEYS[2] or KEYS[1]
+local own_key = is_buy and KEYS[1] or KEYS[2]
+local details_key = KEYS[3]
+local book_levels = is_buy and KEYS[6] or KEYS[4]
+local book_depth = is_buy and KEYS[7] or KEYS[5]
+local own_levels = is_buy and KEYS[4] or KEYS[6]
+local own_depth = is_buy and KEYS[5] or KEYS[7]
+local index_key = KEYS[8]
+local symbol = ARGV[7]
+
+
+-- Drop an order that left the book from the order and trader indexes
+local function unindex_order(order_id, trader_id)
+    redis.call('HDEL', index_key, order_id)
+    if trader_id then
+        redis.call('HDEL', 'trader:' .. trader_id .. ':orders', order_id)
+    end
+end
+
+
+-- New totals of every price level touched, keyed by side and level
+local level_changes = {}
+local function record_level(side, price, lots, count)
+    level_changes[side .. ':' .. int(price)] = {side, price, tonumber(lots), tonumber(count)}
+end
+
+-- Take lots (and optionally an order) off a price level, dropping it once empty
+local book_side = is_buy and 'sell' or 'buy'
+local function reduce_level(price, lots, orders)
+    local level = int(price)
+    local level_lots = redis.call('HINCRBY', book_depth, 'q:' .. level, int(-lots))
+    local count
+    if orders > 0 then
+        count = tonumber(redis.call('HINCRBY', book_depth, 'n:' .. level, -orders))
+    else
+        count = tonumber(redis.call('HGET', book_depth, 'n:' .. level) or '0')
+    end
+    if count <= 0 then
+        redis.call('HDEL', book_depth, 'q:' .. level, 'n:' .. level)
+        redis.call('ZREM', book_levels, level)
+        level_lots = 0
+    end
+    record_level(book_side, price, level_lots, count)
+end
+
+local limit = nil
+if order.price_ticks ~= nil and order.price_ticks ~= cjson.null then
+    limit = tonumber(order.price_ticks)
+end
+
+local filled = tonumber(order.filled_lots) or 0
+local remaining = tonumber(order.quantity_lots) - filled
+local fills = {}
+
+local fetch_size = tonumber(ARGV[5]) or 50
+local max_levels = tonumber(ARGV[6]) or 0
+local levels_swept = 0
+local level_price = nil
+local stopped = false
+
+-- Read the best fetch_size orders at a time; consumed orders leave the set, so each refetch starts at 0
+while remaining > 0 and not stopped do
+    local batch = redis.call('ZRANGE', book_key, 0, fetch_size - 1, 'WITHSCORES')
+    if #batch == 0 then
+        break
+    end
+
+    -- Members are "<arrival time>:<order id>", scores -ticks (bids) or +ticks (asks)
+    local maker_ids = {}
+    for i = 1, #batch, 2 do
+        maker_ids[#maker_ids + 1] = string.match(batch[i], ':(.+)$') or batch[i]
+    end
+    local maker_values = redis.call('HMGET', details_key, unpack(maker_ids))
+
+    for j, maker_id in ipairs(maker_ids) do
+        local member = batch[2 * j - 1]
+        local price = math.abs(tonumber(batch[2 * j]))
+        if limit ~= nil and ((is_buy and price > limit) or ((not is_buy) and price < limit)) then
+            stopped = true
+            break
+        end
+        if price ~= level_price then
+            if max_levels > 0 and levels_swept >= max_levels then
+                stopped = true
+                break
+            end
+            levels_swept = levels_swept + 1
+            level_price = price
+        end
+
+        local maker_raw = maker_values[j]
+        if not maker_raw then
+            -- Orphaned entry without details, drop it
+            redis.call('ZREM', book_key, member)
+        else
+            local stored = read_order(maker_raw)
+            local available = stored.quantity - stored.filled
+
+            if available <= 0 then
+                redis.call('ZREM', book_key, member)
+                redis.call('HDEL', details_key, maker_id)
+                unindex_order(maker_id, stored.trader_id)
+                reduce_level(price, 0, 1)
+            else
+                local lots = math.min(remaining, available)
+                local maker_filled = stored.filled + lots
+                local maker_status
+
+                if maker_filled >= stored.quantity then
+                    maker_status = 'filled'
+                    redis.call('ZREM', book_key, member)
+                    redis.call('HDEL', details_key, maker_id)
+                    unindex_order(maker_id, stored.trader_id)
+                    reduce_level(price, lots, 1)
+                else
+                    maker_status = 'partially_filled'
+                    redis.call('HSET', details_key, maker_id, write_order(stored, maker_filled, maker_status))
+                    reduce_level(price, lots, 0)
+                end
+
+                filled = filled + lots
+                remaining = remaining - lots
+                for _, value in ipairs({maker_id, price, lots, maker_filled, maker_status, stored.trader_id or ''}) do
+                    fills[#fills + 1] = value
+                end
+            end
+        end
+
+        if remaining <= 0 then
+            break
+        end
+    end
+end
+
+local status
+if remaining <= 0 then
+    status = 'filled'
+elseif filled > 0 then
+    status = 'partially_filled'
+else
+    status = 'active'
+end
+
+-- Rest the remainder of a limit order
+if remaining > 0 and order.order_type == 'limit' then
+    redis.call('ZADD', own_key, ARGV[2], ARGV[4])
+    local resting = read_order(ARGV[3])
+    redis.call('HSET', details_key, order.order_id, write_order(resting, filled, status))
+    redis.call('HSET', index_key, order.order_id, order.side .. '|' .. symbol)
+    if resting.trader_id then
+        redis.call('HSET', 'trader:' .. resting.trader_id .. ':orders', order.order_id, symbol)
+    end
+
+    local level = int(limit)
+    redis.call('ZADD', own_levels, level, level)
+    local level_lots = redis.call('HINCRBY', own_depth, 'q:' .. level, int(remaining))
+    local count = redis.call('HINCRBY', own_depth, 'n:' .. level, 1)
+    record_level(order.side, limit, level_lots, count)
+end
+
+local levels = {}
+for _, change in pairs(level_changes) do
+    for _, value in ipairs(change) do
+        levels[#levels + 1] = value
+    end
+end
+
+return {filled, status, fills, levels}
+"""
+
+# Apply fills to resting orders read earlier with peek_orders, in one call.
+# A fill is only applied while the order still has the quantity and filled lots it was read with;
+# orders cancelled, filled or amended since are left untouched for the caller to skip.
+#
+# KEYS[1] order details hash, KEYS[2] buy sorted set, KEYS[3] sell sorted set
+# KEYS[4] buy levels, KEYS[5] buy depth, KEYS[6] sell levels, KEYS[7] sell depth
+# KEYS[8] order index
+# ARGV order id, quantity lots as read, filled lots as read, side, sorted set member,
+#      price level (ticks), lots to fill, trader order index key, repeated
+#
+# Returns {applied, levels} with applied 1 or 0 per fill and levels a flat list of
+# side, price ticks, level lots, level orders per touched level
+APPLY_FILLS_SCRIPT = ORDER_CODEC_LUA + """
+local applied = {}
+local level_changes = {}
+
+for i = 1, #ARGV, 8 do
+    local order_id = ARGV[i]
+    local raw = redis.call('HGET', KEYS[1], order_id)
+    local stored = raw and read_order(raw)
+    if stored and stored.quantity == tonumber(ARGV[i + 1]) and stored.filled == tonumber(ARGV[i + 2]) then
+        local side = ARGV[i + 3]
+        local is_buy = side == 'buy'
+        local levels_key = is_buy and KEYS[4] or KEYS[6]
+        local depth_key = is_buy and KEYS[5] or KEYS[7]
+        local level = ARGV[i + 5]
+        local lots = tonumber(ARGV[i + 6])
+        local filled = stored.filled + lots
+
+        local removed = 0
+        if filled >= stored.quantity then
+            redis.call('ZREM', is_buy and KEYS[2] or KEYS[3], ARGV[i + 4])
+            redis.call('HDEL', KEYS[1], order_id)
+            redis.call('HDEL', KEYS[8], order_id)
+            redis.call('HDEL', ARGV[i + 7], order_id)
+            removed = 1
+        else
+            redis.call('HSET', KEYS[1], order_id, write_order(stored, filled, 'partially_filled'))
+        end
+
+        local level_lots = tonumber(redis.call('HINCRBY', depth_key, 'q:' .. level, int(-lots)))
+        local count = tonumber(redis.call('HINCRBY', depth_key, 'n:' .. level, -removed))
+        if count <= 0 then
+            redis.call('HDEL', depth_key, 'q:' .. level, 'n:' .. level)
+            redis.call('ZREM', levels_key, level)
+            level_lots = 0
+        end
+        level_changes[side .. ':' .. level] = {side, tonumber(level), level_lots, count}
+        applied[#applied + 1] = 1
+    else
+        applied[#applied + 1] = 0
+    end
+end
+
+local levels = {}
+for _, change in pairs(level_changes) do
+    for _, value in ipairs(change) do
+        levels[#levels + 1] = value
+    end
+end
+
+return {applied, levels}
+"""
+
+# Aggregated (L2) depth of both sides in one call.
+#
+# KEYS[1] buy levels, KEYS[2] buy depth, KEYS[3] sell levels, KEYS[4] sell depth
+# KEYS[5] depth delta sequence
+# ARGV[1] number of levels per side
+#
+# Returns {bids, asks, sequence}, bids and asks each a flat list of price ticks, open lots, order count
+DEPTH_SNAPSHOT_SCRIPT = """
+local depth = tonumber(ARGV[1])
+
+local function read_side(levels_key, depth_key, best_first_is_highest)
+    local levels
+    if best_first_is_highest then
+        levels = redis.call('ZREVRANGE', levels_key, 0, depth - 1)
+    else
+        levels = redis.call('ZRANGE', levels_key, 0, depth - 1)
+    end
+
+    local out = {}
+    for _, level in ipairs(levels) do
+        local totals = redis.call('HMGET', depth_key, 'q:' .. level, 'n:' .. level)
+        out[#out + 1] = level
+        out[#out + 1] = totals[1] or '0'
+        out[#out + 1] = totals[2] or '0'
+    end
+    return out
+end
+
+return {
+    read_side(KEYS[1], KEYS[2], true),
+    read_side(KEYS[3], KEYS[4], false),
+    tonumber(redis.call('GET', KEYS[5]) or '0')
+}
+"""
+
+# Remove a price level if no orders are left on it.
+#
+# KEYS[1] levels sorted set, KEYS[2] depth hash
+# ARGV[1] price level (ticks)
+DROP_EMPTY_LEVEL_SCRIPT = """
+local count = tonumber(redis.call('HGET', KEYS[2], 'n:' .. ARGV[1]) or '0')
+if count <= 0 then
+    redis.call('HDEL', KEYS[2], 'q:' .. ARGV[1], 'n:' .. ARGV[1])
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# Assign the next sequence number to a depth delta and publish it, atomically,
+# so messages on the channel are always in sequence order.
+#
+# KEYS[1] depth delta sequence
+# ARGV[1] channel, ARGV[2] delta (JSON object without "seq")
+#
+# Returns the sequence number
+PUBLISH_DELTA_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('PUBLISH', ARGV[1], '{"seq":' .. seq .. ',' .. string.sub(ARGV[2], 2))
+return seq
+"""
+
+# Fold a batch of pre-aggregated candles into the current candle of every interval,
+# closing candles onto their history list as newer ones start.
+#
+# KEYS[1] last price, then per interval: KEYS[2i] current candle, KEYS[2i+1] candle history list
+# ARGV[1] {"history": <candles kept per list>, "intervals": [[[timestamp, open, high, low, close, volume], ...], ...]}
+#         with each interval's candles in time order, intervals in KEYS order
+# ARGV[2] last traded price
+CANDLE_UPDATE_SCRIPT = """
+local args = cjson.decode(ARGV[1])
+
+for i, candles in ipairs(args.intervals) do
+    local current_key = KEYS[2 * i]
+    local history_key = KEYS[2 * i + 1]
+    local raw = redis.call('GET', current_key)
+    local current = raw and cjson.decode(raw) or nil
+
+    for _, candle in ipairs(candles) do
+        if current == nil or candle[1] > current.timestamp then
+            if current ~= nil then
+                redis.call('LPUSH', history_key, cjson.encode(current))
+                redis.call('LTRIM', history_key, 0, args.history - 1)
+            end
+            current = {timestamp = candle[1], open = candle[2], high = candle[3],
+                       low = candle[4], close = candle[5], volume = candle[6]}
+        elseif candle[1] == current.timestamp then
+            current.high = math.max(current.high, candle[3])
+            current.low = math.min(current.low, candle[4])
+            current.close = candle[5]
+            current.volume = current.volume + candle[6]
+        end
+        -- Trades for an already closed candle are left to a rebuild from the trades table
+    end
+
+    redis.call('SET', current_key, cjson.encode(current))
+end
+
+redis.call('SET', KEYS[1], ARGV[2])
+return 1
+"""
+
+# Cancel resting orders that still hold the details they were read with, in one call.
+# Orders changed since (filled or partially filled concurrently) are left for the caller to re-read.
+#
+# KEYS[1] order details hash, KEYS[2] buy sorted set, KEYS[3] sell sorted set
+# KEYS[4] buy levels, KEYS[5] buy depth, KEYS[6] sell levels, KEYS[7] sell depth
+# KEYS[8] order index
+# ARGV order id, details as read, side, sorted set member, price level (ticks), open lots,
+#      trader order index key, repeated
+#
+# Returns {cancelled, levels} with cancelled the ids removed and levels a flat list of
+# side, price ticks, level lots, level orders per touched level
+CANCEL_ORDERS_SCRIPT = """
+local cancelled = {}
+local level_changes = {}
+
+for i = 1, #ARGV, 7 do
+    local order_id = ARGV[i]
+    if redis.call('HGET', KEYS[1], order_id) == ARGV[i + 1] then
+        local side = ARGV[i + 2]
+        local is_buy = side == 'buy'
+        local levels_key = is_buy and KEYS[4] or KEYS[6]
+        local depth_key = is_buy and KEYS[5] or KEYS[7]
+        local level = ARGV[i + 4]
+
+        redis.call('ZREM', is_buy and KEYS[2] or KEYS[3], ARGV[i + 3])
+        redis.call('HDEL', KEYS[1], order_id)
+        redis.call('HDEL', KEYS[8], order_id)
+        redis.call('HDEL', ARGV[i + 6], order_id)
+
+        local level_lots = tonumber(redis.call('HINCRBY', depth_key, 'q:' .. level,
+                                               string.format('%d', -tonumber(ARGV[i + 5]))))
+        local count = tonumber(redis.call('HINCRBY', depth_key, 'n:' .. level, -1))
+        if count <= 0 then
+            redis.call('HDEL', depth_key, 'q:' .. level, 'n:' .. level)
+            redis.call('ZREM', levels_key, level)
+            level_lots = 0
+        end
+        level_changes[side .. ':' .. level] = {side, tonumber(level), level_lots, count}
+        cancelled[#cancelled + 1] = order_id
+    end
+end
+
+local levels = {}
+for _, change in pairs(level_changes) do
+    for _, value in ipairs(change) do
+        levels[#levels + 1] = value
+    end
+end
+
+return {cancelled, levels}
+"""
+
+# Replace hash fields only if they still hold the value they were read with,
+# so values rewritten concurrently by the engine are left alone.
+#
+# KEYS[1] hash
+# ARGV field, expected value, new value, repeated
+#
+# Returns the number of fields replaced
+REPLACE_IF_UNCHANGED_SCRIPT = """
+local replaced = 0
+for i = 1, #ARGV, 3 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 2])
+        replaced = replaced + 1
+    end
+end
+return replaced
+"""
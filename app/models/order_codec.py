@@ -0,0 +1,119 @@
+"""
+Encoding of resting order details stored in orderbook:{symbol}:details.
+
+Version 2 is a fixed big-endian layout (37 bytes plus the trader id):
+    B version | B side | B order type | B status |
+    q quantity lots | q filled lots | q price ticks (0 when unset) | d created_at |
+    B trader id length | trader id (utf-8)
+The order id is the hash field and the symbol is part of the key, so neither is stored.
+The numeric prefix is also read and rewritten by the Lua match script with struct.
+
+Version 1 (float quantity, filled quantity and price) and JSON documents (first byte "{")
+are still decoded, converting floats to ticks and lots with the symbol's spec, so books
+can be migrated with app/utils/migrate_order_details.py.
+"""
+import json
+import math
+import struct
+from typing import Dict, Optional, Tuple
+from app.config import ORDER_DETAILS_CODEC
+from app.models.instrument import get_symbol_spec
+from app.models.order import OrderSide, OrderStatus, OrderType
+
+ORDER_CODEC_VERSION = 2
+
+# Code tables: position in the tuple is the stored code. Only ever append,
+# and keep the status codes in MATCH_ORDER_SCRIPT in line.
+SIDES = (OrderSide.BUY, OrderSide.SELL)
+ORDER_TYPES = (OrderType.LIMIT, OrderType.MARKET)
+STATUSES = (
+    OrderStatus.PENDING,
+    OrderStatus.ACTIVE,
+    OrderStatus.FILLED,
+    OrderStatus.PARTIALLY_FILLED,
+    OrderStatus.CANCELLED,
+    OrderStatus.REJECTED,
+)
+
+HEADER = struct.Struct(">BBBBqqqdB")
+HEADER_V1 = struct.Struct(">BBBBddddB")
+
+def _code(table: Tuple, value) -> int:
+    return table.index(type(table[0])(value))
+
+def encode_order_details(order_details: Dict, codec: str = None) -> bytes:
+    """Encode order details for storage with the configured codec"""
+    if (codec or ORDER_DETAILS_CODEC) == "json":
+        return json.dumps(order_details).encode()
+
+    trader_id = (order_details.get("trader_id") or "").encode()
+    if len(trader_id) > 255:
+        raise ValueError("Trader ID is too long to encode")
+
+    return HEADER.pack(
+        ORDER_CODEC_VERSION,
+        _code(SIDES, order_details["side"]),
+        _code(ORDER_TYPES, order_details.get("order_type") or OrderType.LIMIT),
+        _code(STATUSES, order_details.get("status") or OrderStatus.ACTIVE),
+        int(order_details.get("quantity_lots") or 0),
+        int(order_details.get("filled_lots") or 0),
+        int(order_details.get("price_ticks") or 0),
+        float(order_details.get("created_at") or 0),
+        len(trader_id)
+    ) + trader_id
+
+def _from_floats(order_id: str, symbol: str, trader_id: str, side, order_type, status,
+                 quantity: float, filled_quantity: float, price: Optional[float], created_at: float) -> Dict:
+    """Details stored with float quantities and price, converted to lots and ticks"""
+    spec = get_symbol_spec(symbol)
+    return {
+        "order_id": order_id,
+        "trader_id": trader_id,
+        "symbol": symbol,
+        "side": OrderSide(side).value,
+        "order_type": OrderType(order_type).value,
+        "quantity_lots": spec.to_lots(quantity or 0, exact=False),
+        "price_ticks": None if price is None else spec.to_ticks(price, exact=False),
+        "status": OrderStatus(status).value,
+        "filled_lots": spec.to_lots(filled_quantity or 0, exact=False),
+        "created_at": float(created_at or 0)
+    }
+
+def decode_order_details(order_id: str, symbol: str, data: bytes) -> Dict:
+    """Decode stored order details (binary or JSON, any version)"""
+    if isinstance(order_id, bytes):
+        order_id = order_id.decode()
+    if data[:1] in (b"{", "{"):
+        stored = json.loads(data)
+        if "quantity_lots" in stored:
+            return stored
+        return _from_floats(order_id, symbol, stored.get("trader_id"), stored["side"],
+                            stored.get("order_type") or OrderType.LIMIT,
+                            stored.get("status") or OrderStatus.ACTIVE, stored.get("quantity"),
+                            stored.get("filled_quantity"), stored.get("price"), stored.get("created_at"))
+
+    version = data[0]
+    if version == 1:
+        _, side, order_type, status, quantity, filled_quantity, price, created_at, trader_id_length = \
+            HEADER_V1.unpack_from(data)
+        trader_id = data[HEADER_V1.size:HEADER_V1.size + trader_id_length].decode()
+        return _from_floats(order_id, symbol, trader_id, SIDES[side], ORDER_TYPES[order_type],
+                            STATUSES[status], quantity, filled_quantity,
+                            None if math.isnan(price) else price, created_at)
+    if version != ORDER_CODEC_VERSION:
+        raise ValueError(f"Unsupported order details version: {version}")
+
+    _, side, order_type, status, quantity_lots, filled_lots, price_ticks, created_at, trader_id_length = \
+        HEADER.unpack_from(data)
+    return {
+        "order_id": order_id,
+        "trader_id": data[HEADER.size:HEADER.size + trader_id_length].decode(),
+        "symbol": symbol,
+        "side": SIDES[side].value,
+        "order_type": ORDER_TYPES[order_type].value,
+        "quantity_lots": quantity_lots,
+        "price_ticks": price_ticks or None,
+        "status": STATUSES[status].value,
+        "filled_lots": filled_lots,
+        "created_at": created_at
+    }
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import BigInteger, Column, Integer, String, Float, DateTime, ForeignKey
 from sqlalchemy.sql import func
 from app.db.postgres import Base
 from datetime import datetime
@@ -15,6 +15,9 @@ class TradeModel(Base):
     symbol = Column(String, index=True)
     quantity = Column(Float)
     price = Column(Float)
+    # Exact values the engine works with: price in ticks, quantity in lots of the symbol
+    quantity_lots = Column(BigInteger)
+    price_ticks = Column(BigInteger)
     executed_at = Column(DateTime(timezone=True), server_default=func.now())
 
 # Pydantic Models
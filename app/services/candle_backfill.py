@@ -0,0 +1,140 @@
+import json
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import Float, cast, func, select
+from sqlalchemy.orm import Session
+from app.config import CANDLE_HISTORY_LENGTH, CANDLE_REBUILD_CHUNK_SIZE
+from app.db.redis_client import get_redis
+from app.models.trade import TradeModel
+from app.services.candles import OHLC_INTERVALS, parse_interval
+
+# Candles as column arrays: bucket timestamp, open, high, low, close, volume
+Candles = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+def group_candles(buckets: np.ndarray, opens: np.ndarray, highs: np.ndarray, lows: np.ndarray,
+                  closes: np.ndarray, volumes: np.ndarray) -> Candles:
+    """
+    Reduce rows sorted by bucket into one candle per bucket.
+    Works on raw trades (open = high = low = close = price) as well as on partial candles.
+    """
+    if len(buckets) == 0:
+        return buckets, opens, highs, lows, closes, volumes
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)] - 1
+    return (
+        buckets[starts],
+        opens[starts],
+        np.maximum.reduceat(highs, starts),
+        np.minimum.reduceat(lows, starts),
+        closes[ends],
+        np.add.reduceat(volumes, starts)
+    )
+
+def build_candles(timestamps: np.ndarray, prices: np.ndarray, quantities: np.ndarray,
+                  interval_seconds: int) -> Candles:
+    """Candles of one interval from trades in execution order"""
+    buckets = (np.floor(timestamps / interval_seconds) * interval_seconds).astype(np.int64)
+    return group_candles(buckets, prices, prices, prices, prices, quantities)
+
+def merge_candles(parts: List[Candles]) -> Candles:
+    """Join candles computed chunk by chunk, merging the buckets split across chunks"""
+    if not parts:
+        empty = np.array([], dtype=float)
+        return np.array([], dtype=np.int64), empty, empty, empty, empty, empty
+    columns = [np.concatenate([part[i] for part in parts]) for i in range(6)]
+    return group_candles(*columns)
+
+def epoch_seconds(executed_at: datetime) -> float:
+    # Naive timestamps are stored in UTC
+    if executed_at.tzinfo is None:
+        executed_at = executed_at.replace(tzinfo=timezone.utc)
+    return executed_at.timestamp()
+
+def trade_chunks(db: Session, symbol: str, start: Optional[datetime] = None,
+                 end: Optional[datetime] = None,
+                 chunk_size: int = CANDLE_REBUILD_CHUNK_SIZE) -> Iterable[np.ndarray]:
+    """Stream a symbol's trades in execution order as (n, 3) arrays of timestamp, price, quantity"""
+    # Let Postgres convert timestamps to epoch seconds; other databases return datetimes
+    epoch_in_sql = db.get_bind().dialect.name == "postgresql"
+    executed_at = cast(func.extract("epoch", TradeModel.executed_at), Float) if epoch_in_sql \
+        else TradeModel.executed_at
+
+    query = (
+        select(executed_at, TradeModel.price, TradeModel.quantity)
+        .where(TradeModel.symbol == symbol)
+        .order_by(TradeModel.executed_at, TradeModel.id)
+    )
+    if start is not None:
+        query = query.where(TradeModel.executed_at >= start)
+    if end is not None:
+        query = query.where(TradeModel.executed_at < end)
+
+    result = db.execute(query.execution_options(yield_per=chunk_size))
+    for rows in result.partitions():
+        if not epoch_in_sql:
+            rows = [(epoch_seconds(row[0]), row[1], row[2]) for row in rows]
+        yield np.array(rows, dtype=float).reshape(-1, 3)
+
+def compute_candles(chunks: Iterable[np.ndarray], intervals: Dict[str, int]) -> Dict[str, Candles]:
+    """OHLCV for every interval from a stream of trade chunks, one pass over the trades"""
+    parts: Dict[str, List[Candles]] = {name: [] for name in intervals}
+    for chunk in chunks:
+        timestamps, prices, quantities = chunk[:, 0], chunk[:, 1], chunk[:, 2]
+        for name, seconds in intervals.items():
+            parts[name].append(build_candles(timestamps, prices, quantities, seconds))
+    return {name: merge_candles(interval_parts) for name, interval_parts in parts.items()}
+
+def load_candles(redis_client, symbol: str, interval: str, candles: Candles,
+                 history_length: int = CANDLE_HISTORY_LENGTH) -> int:
+    """
+    Replace a symbol's candle store for one interval: the last candle becomes the current one,
+    the history_length before it the closed history (newest first). Returns candles written.
+    """
+    count = len(candles[0])
+    if count == 0:
+        return 0
+
+    tail = slice(max(0, count - history_length - 1), count)
+    columns = [column[tail].tolist() for column in candles]
+    documents = [
+        json.dumps({"timestamp": timestamp, "open": open_, "high": high, "low": low,
+                    "close": close, "volume": volume})
+        for timestamp, open_, high, low, close, volume in zip(*columns)
+    ]
+
+    history_key = f"ohlc:{symbol}:{interval}"
+    current_key = f"current_ohlc:{symbol}:{interval}"
+    closed = documents[-2::-1]
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(history_key)
+    for i in range(0, len(closed), 1000):
+        pipe.rpush(history_key, *closed[i:i + 1000])
+    pipe.set(current_key, documents[-1])
+    pipe.execute()
+    return len(documents)
+
+def rebuild_candles(db: Session, symbol: str, intervals: Optional[List[str]] = None,
+                    start: Optional[datetime] = None, end: Optional[datetime] = None,
+                    redis_client=None, chunk_size: int = CANDLE_REBUILD_CHUNK_SIZE,
+                    history_length: int = CANDLE_HISTORY_LENGTH) -> Dict[str, int]:
+    """
+    Recompute a symbol's candles from the trades table and bulk-load them into Redis.
+    Intervals default to the live ones; any <number><s|m|h|d|w> interval can be built.
+    Trades executed while the rebuild runs may be overwritten in the current candle,
+    so run it with the symbol quiet. Returns the number of candles loaded per interval.
+    """
+    names = intervals or list(OHLC_INTERVALS)
+    interval_seconds = {name: parse_interval(name) for name in names}
+    redis_client = redis_client if redis_client else get_redis()
+
+    candles = compute_candles(trade_chunks(db, symbol, start, end, chunk_size), interval_seconds)
+    return {
+        name: load_candles(redis_client, symbol, name, interval_candles, history_length)
+        for name, interval_candles in candles.items()
+    }
+
+def traded_symbols(db: Session) -> List[str]:
+    """Every symbol with at least one trade"""
+    return list(db.scalars(select(TradeModel.symbol).distinct().order_by(TradeModel.symbol)))
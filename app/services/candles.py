@@ -0,0 +1,100 @@
+import json
+from datetime import datetime
+from typing import Dict, List, Optional
+from app.config import CANDLE_UPDATES_ENABLED, CANDLE_HISTORY_LENGTH, CANDLE_INTERVALS
+from app.db.redis_client import get_redis
+from app.models.order_book_scripts import CANDLE_UPDATE_SCRIPT
+
+INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+def parse_interval(name: str) -> int:
+    """Length in seconds of an interval name such as 1m, 15m, 4h or 1d"""
+    try:
+        seconds = int(name[:-1]) * INTERVAL_UNITS[name[-1]]
+    except (KeyError, ValueError, IndexError):
+        raise ValueError(f"Invalid candle interval: {name}")
+    if seconds <= 0:
+        raise ValueError(f"Invalid candle interval: {name}")
+    return seconds
+
+# Candle intervals and their length in seconds
+OHLC_INTERVALS = {
+    name.strip(): parse_interval(name.strip()) for name in CANDLE_INTERVALS.split(",") if name.strip()
+}
+
+def trade_timestamp(trade: Dict) -> float:
+    executed_at = trade["executed_at"]
+    if isinstance(executed_at, datetime):
+        return executed_at.timestamp()
+    return float(executed_at)
+
+def aggregate_trades(trades: List[Dict], interval_seconds: int) -> List[List[float]]:
+    """
+    Collapse trades (in execution order) into one [timestamp, open, high, low, close, volume]
+    candle per interval they fall in, in time order
+    """
+    candles: Dict[int, List[float]] = {}
+    for trade in trades:
+        timestamp = int(trade_timestamp(trade) // interval_seconds) * interval_seconds
+        price = trade["price"]
+        candle = candles.get(timestamp)
+        if candle is None:
+            candles[timestamp] = [timestamp, price, price, price, price, trade["quantity"]]
+        else:
+            candle[2] = max(candle[2], price)
+            candle[3] = min(candle[3], price)
+            candle[4] = price
+            candle[5] += trade["quantity"]
+    return [candles[timestamp] for timestamp in sorted(candles)]
+
+class CandleAggregator:
+    """
+    Builds OHLC candles from the engine's trades.
+    Trades are collected with add_trades() and written by flush(): per symbol, the trades are
+    folded into one candle per interval they touch, and all intervals plus the last price are
+    updated atomically in a single script call.
+    """
+
+    def __init__(self, redis_client=None, intervals: Dict[str, int] = None,
+                 history_length: int = CANDLE_HISTORY_LENGTH):
+        self.redis = redis_client if redis_client else get_redis()
+        self.intervals = intervals or OHLC_INTERVALS
+        self.history_length = history_length
+        self.pending: Dict[str, List[Dict]] = {}
+        self._update_script = None
+
+    def add_trades(self, trades: List[Dict]):
+        """Queue trades for the next flush"""
+        if not CANDLE_UPDATES_ENABLED:
+            return
+        for trade in trades:
+            self.pending.setdefault(trade["symbol"], []).append(trade)
+
+    def flush(self) -> int:
+        """Write the queued trades into the candles; returns the number of trades written"""
+        pending, self.pending = self.pending, {}
+        written = 0
+        for symbol, trades in pending.items():
+            self.update_candles(symbol, trades)
+            written += len(trades)
+        return written
+
+    def update_candles(self, symbol: str, trades: List[Dict]):
+        """Fold one symbol's trades (in execution order) into its candles in one round trip"""
+        if not trades:
+            return
+        if self._update_script is None:
+            self._update_script = self.redis.register_script(CANDLE_UPDATE_SCRIPT)
+
+        keys = [f"last_price:{symbol}"]
+        candles = []
+        for interval_name, interval_seconds in self.intervals.items():
+            keys.append(f"current_ohlc:{symbol}:{interval_name}")
+            keys.append(f"ohlc:{symbol}:{interval_name}")
+            candles.append(aggregate_trades(trades, interval_seconds))
+
+        self._update_script(
+            keys=keys,
+            args=[json.dumps({"history": self.history_length, "intervals": candles}),
+                  str(trades[-1]["price"])]
+        )
@@ -0,0 +1,342 @@
+"""
+Append-only journal of the orders and cancels the matching engine receives, for deterministic replay.
+
+The journal is a directory of fixed-size segment files named after the sequence number of their
+first record. Each file is preallocated and written through mmap. A record is
+    I payload length | I crc32 | Q sequence | d timestamp (epoch seconds) | B kind | payload
+with the crc32 over everything after it. A zero length marks the end of the written part.
+Payloads:
+    order   B side | B order type | q price ticks (0: none) | q quantity lots | q filled lots |
+            then order id, symbol and trader id, each as B length | utf-8
+    cancel  symbol as B length | utf-8, I count, then count order ids as B length | utf-8
+Appending only copies the record into the mapped segment. A background thread flushes the
+written range with msync every fsync interval, so one flush covers every record appended in that
+window (group commit). Callers that need durability can wait for their sequence number.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from app.config import JOURNAL_DIR, JOURNAL_ENABLED, JOURNAL_FSYNC_INTERVAL, JOURNAL_SEGMENT_SIZE
+from app.models.instrument import get_symbol_spec
+from app.models.order import OrderSide, OrderStatus, OrderType
+from app.models.order_book import order_units
+
+RECORD_HEADER = struct.Struct(">IIQdB")
+# Part of the header covered by the crc32: sequence, timestamp and kind
+RECORD_PREFIX = struct.Struct(">QdB")
+ORDER_FIELDS = struct.Struct(">BBqqq")
+COUNT = struct.Struct(">I")
+
+ORDER = 1
+CANCEL = 2
+
+SIDES = (OrderSide.BUY, OrderSide.SELL)
+ORDER_TYPES = (OrderType.LIMIT, OrderType.MARKET)
+# Codes by value; the enums are str subclasses, so plain strings look up the same entries
+SIDE_CODES = {side.value: code for code, side in enumerate(SIDES)}
+ORDER_TYPE_CODES = {order_type.value: code for code, order_type in enumerate(ORDER_TYPES)}
+
+SEGMENT_SUFFIX = ".journal"
+
+def _pack_text(value: str) -> bytes:
+    encoded = (value or "").encode()
+    if len(encoded) > 255:
+        raise ValueError("Journal text fields are limited to 255 bytes")
+    return bytes((len(encoded),)) + encoded
+
+def _unpack_text(data, offset: int) -> Tuple[str, int]:
+    length = data[offset]
+    return data[offset + 1:offset + 1 + length].decode(), offset + 1 + length
+
+def segment_name(first_sequence: int) -> str:
+    return f"{first_sequence:020d}{SEGMENT_SUFFIX}"
+
+def list_segments(directory: str) -> List[Tuple[int, str]]:
+    """(first sequence, path) of every segment in a journal directory, in order"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        (int(name[:-len(SEGMENT_SUFFIX)]), os.path.join(directory, name))
+        for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)
+    )
+
+class JournalRecord:
+    """A decoded journal record: an inbound order or a cancel of one or more orders on a symbol"""
+
+    __slots__ = ("sequence", "timestamp", "kind", "order_id", "symbol", "trader_id", "side", "order_type",
+                 "price_ticks", "quantity_lots", "filled_lots", "order_ids")
+
+    def __init__(self, sequence: int, timestamp: float, kind: int, payload):
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.kind = kind
+        if kind == ORDER:
+            side, order_type, price_ticks, self.quantity_lots, self.filled_lots = ORDER_FIELDS.unpack_from(payload)
+            self.side = SIDES[side]
+            self.order_type = ORDER_TYPES[order_type]
+            self.price_ticks = price_ticks or None
+            self.order_id, offset = _unpack_text(payload, ORDER_FIELDS.size)
+            self.symbol, offset = _unpack_text(payload, offset)
+            self.trader_id, _ = _unpack_text(payload, offset)
+            self.order_ids = [self.order_id]
+        else:
+            self.symbol, offset = _unpack_text(payload, 0)
+            (count,) = COUNT.unpack_from(payload, offset)
+            offset += COUNT.size
+            self.order_ids = []
+            for _ in range(count):
+                order_id, offset = _unpack_text(payload, offset)
+                self.order_ids.append(order_id)
+            self.order_id = self.trader_id = self.side = self.order_type = None
+            self.price_ticks = self.quantity_lots = self.filled_lots = None
+
+def scan_segment(data) -> Iterator[Tuple[int, int, float, int, bytes]]:
+    """
+    (offset after the record, sequence, timestamp, kind, payload) of every intact record in a
+    mapped segment, stopping at the end marker or at the first torn or out of sequence record
+    """
+    offset = 0
+    previous = None
+    while offset + RECORD_HEADER.size <= len(data):
+        length, crc, sequence, timestamp, kind = RECORD_HEADER.unpack_from(data, offset)
+        end = offset + RECORD_HEADER.size + length
+        if length == 0 or end > len(data) or (previous is not None and sequence != previous + 1):
+            return
+        payload = data[offset + RECORD_HEADER.size:end]
+        if zlib.crc32(payload, zlib.crc32(RECORD_PREFIX.pack(sequence, timestamp, kind))) != crc:
+            return
+        yield end, sequence, timestamp, kind, payload
+        previous = sequence
+        offset = end
+
+class OrderJournal:
+    """Writer side of the journal; appends are thread-safe and never wait for the disk"""
+
+    def __init__(self, directory: str = JOURNAL_DIR, segment_size: int = JOURNAL_SEGMENT_SIZE,
+                 fsync_interval: float = JOURNAL_FSYNC_INTERVAL):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._durable = threading.Condition()
+        # Segments rolled over but not yet flushed and closed by the flusher
+        self._retired: List[Tuple[object, mmap.mmap]] = []
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._offset = 0
+        self._flushed_offset = 0
+        self.next_sequence = 1
+        self.durable_sequence = 0
+        self._open_last_segment()
+
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="order-journal", daemon=True)
+        self._thread.start()
+
+    def _open_last_segment(self):
+        segments = list_segments(self.directory)
+        if not segments:
+            self._open_segment(1)
+            return
+
+        first_sequence, path = segments[-1]
+        if os.path.getsize(path) == 0:
+            # Created but never preallocated
+            self._open_segment(first_sequence)
+            self.next_sequence = first_sequence
+            self.durable_sequence = first_sequence - 1
+            return
+        self._file = open(path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._offset = 0
+        self.next_sequence = first_sequence
+        for end, sequence, _, _, _ in scan_segment(self._map):
+            self._offset, self.next_sequence = end, sequence + 1
+        # Clear a torn tail so nothing after the new records can be mistaken for data
+        self._map[self._offset:] = bytes(len(self._map) - self._offset)
+        self._flushed_offset = self._offset
+        self.durable_sequence = self.next_sequence - 1
+
+    def _open_segment(self, first_sequence: int):
+        path = os.path.join(self.directory, segment_name(first_sequence))
+        self._file = open(path, "w+b")
+        self._file.truncate(self.segment_size)
+        self._map = mmap.mmap(self._file.fileno(), self.segment_size)
+        self._offset = 0
+        self._flushed_offset = 0
+
+    def append(self, kind: int, payload: bytes) -> int:
+        """Append a record; returns its sequence number"""
+        timestamp = time.time()
+        with self._lock:
+            sequence = self.next_sequence
+            crc = zlib.crc32(payload, zlib.crc32(RECORD_PREFIX.pack(sequence, timestamp, kind)))
+            record = RECORD_HEADER.pack(len(payload), crc, sequence, timestamp, kind) + payload
+            end = self._offset + len(record)
+            if end + RECORD_HEADER.size > len(self._map):
+                if len(record) + RECORD_HEADER.size > self.segment_size:
+                    raise ValueError("Journal record is larger than a segment")
+                # The flusher syncs and closes the full segment off this path
+                self._retired.append((self._file, self._map))
+                self._open_segment(sequence)
+                end = len(record)
+            self._map[end - len(record):end] = record
+            self._offset = end
+            self.next_sequence = sequence + 1
+            return sequence
+
+    def record_order(self, order) -> int:
+        """Append an inbound order (price and quantities in ticks and lots, from its integer attributes when set)"""
+        price_ticks, quantity_lots, filled_lots = order_units(order)
+        payload = b"".join((
+            ORDER_FIELDS.pack(SIDE_CODES[order.side], ORDER_TYPE_CODES[order.order_type],
+                              price_ticks or 0, quantity_lots, filled_lots),
+            _pack_text(order.order_id), _pack_text(order.symbol), _pack_text(order.trader_id)
+        ))
+        return self.append(ORDER, payload)
+
+    def record_cancel(self, symbol: str, order_ids: List[str]) -> int:
+        """Append a cancel of resting orders on a symbol"""
+        payload = _pack_text(symbol) + COUNT.pack(len(order_ids)) + b"".join(map(_pack_text, order_ids))
+        return self.append(CANCEL, payload)
+
+    def wait_durable(self, sequence: int, timeout: Optional[float] = None) -> bool:
+        """Block until a record has been flushed to disk"""
+        with self._durable:
+            return self._durable.wait_for(lambda: self.durable_sequence >= sequence, timeout)
+
+    def flush(self):
+        """Flush everything appended so far to disk"""
+        with self._lock:
+            retired, self._retired = self._retired, []
+            current, start, end = self._map, self._flushed_offset, self._offset
+            sequence = self.next_sequence - 1
+
+        for segment_file, segment_map in retired:
+            segment_map.flush()
+            segment_map.close()
+            segment_file.close()
+        if end > start:
+            # msync needs a page aligned start
+            aligned = start - start % mmap.PAGESIZE
+            current.flush(aligned, end - aligned)
+            with self._lock:
+                if current is self._map:
+                    self._flushed_offset = max(self._flushed_offset, end)
+
+        with self._durable:
+            if sequence > self.durable_sequence:
+                self.durable_sequence = sequence
+                self._durable.notify_all()
+
+    def _run(self):
+        while not self._stopping.wait(self.fsync_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Order journal flush error: {str(e)}")
+
+    def close(self, timeout: Optional[float] = None):
+        """Stop the flusher, flush what is left and close the current segment"""
+        self._stopping.set()
+        self._thread.join(timeout)
+        self.flush()
+        with self._lock:
+            self._map.close()
+            self._file.close()
+
+class JournalReader:
+    """Reads records back from a journal directory, optionally a range of sequence numbers"""
+
+    def __init__(self, directory: str = JOURNAL_DIR):
+        self.directory = directory
+
+    def records(self, start: Optional[int] = None, end: Optional[int] = None) -> Iterator[JournalRecord]:
+        """Records with start <= sequence <= end, in sequence order"""
+        segments = list_segments(self.directory)
+        for i, (first_sequence, path) in enumerate(segments):
+            if end is not None and first_sequence > end:
+                return
+            # Skip whole segments that end before the range starts
+            if start is not None and i + 1 < len(segments) and segments[i + 1][0] <= start:
+                continue
+            if os.path.getsize(path) == 0:
+                continue
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for _, sequence, timestamp, kind, payload in scan_segment(data):
+                    if start is not None and sequence < start:
+                        continue
+                    if end is not None and sequence > end:
+                        return
+                    yield JournalRecord(sequence, timestamp, kind, payload)
+
+class ReplayOrder:
+    """An order rebuilt from a journal record, with the attributes the matching engine uses"""
+
+    def __init__(self, record: JournalRecord):
+        spec = get_symbol_spec(record.symbol)
+        self.order_id = record.order_id
+        self.trader_id = record.trader_id
+        self.symbol = record.symbol
+        self.side = record.side
+        self.order_type = record.order_type
+        self.price_ticks = record.price_ticks
+        self.quantity_lots = record.quantity_lots
+        self.filled_lots = record.filled_lots
+        self.price = spec.price(record.price_ticks) if record.price_ticks is not None else None
+        self.quantity = spec.quantity(record.quantity_lots)
+        self.filled_quantity = spec.quantity(record.filled_lots)
+        self.status = OrderStatus.ACTIVE
+
+def replay_journal(matching_engine, records: Iterable[JournalRecord]) -> Dict:
+    """
+    Feed journal records through a matching engine in order (no database writes).
+    Returns counts of orders, cancels and trades, and the last sequence replayed.
+    """
+    summary = {"orders": 0, "cancels": 0, "cancelled": 0, "trades": 0, "last_sequence": None}
+    for record in records:
+        if record.kind == ORDER:
+            summary["trades"] += len(matching_engine.process_order(ReplayOrder(record)))
+            summary["orders"] += 1
+        elif record.kind == CANCEL:
+            summary["cancelled"] += len(matching_engine.cancel_orders(record.symbol, record.order_ids))
+            summary["cancels"] += 1
+        summary["last_sequence"] = record.sequence
+    return summary
+
+_journal: Optional[OrderJournal] = None
+_journal_lock = threading.Lock()
+
+def get_journal() -> Optional[OrderJournal]:
+    """Get the process-wide order journal, or None when it is disabled"""
+    global _journal
+    if not JOURNAL_ENABLED:
+        return None
+    if _journal is None:
+        with _journal_lock:
+            if _journal is None:
+                _journal = OrderJournal()
+    return _journal
+
+def open_journal(directory: str) -> Optional[OrderJournal]:
+    """Open the process-wide journal in a directory of its own (one per shard worker), if enabled"""
+    global _journal
+    if not JOURNAL_ENABLED:
+        return None
+    with _journal_lock:
+        if _journal is None:
+            _journal = OrderJournal(directory)
+    return _journal
+
+def stop_journal(timeout: Optional[float] = None):
+    """Flush and close the journal"""
+    global _journal
+    if _journal is not None:
+        _journal.close(timeout)
+        _journal = None
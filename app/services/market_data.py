@@ -3,6 +3,8 @@ import json
 from datetime import datetime, timezone
 from typing import Dict, List, Optional
 from app.db.redis_client import get_redis
+from app.models.order_book_scripts import PUBLISH_DELTA_SCRIPT
+from app.services.candles import CandleAggregator
 
 class MarketDataService:
     """Service for managing and distributing market data"""
@@ -15,6 +17,29 @@ class MarketDataService:
         channel_name = f"orderbook_updates:{symbol}"
         self.redis.publish(channel_name, json.dumps(order_book_data))
     
+    def publish_order_book_delta(self, symbol: str, changes: Dict, sequence: Optional[int] = None,
+                                 sequence_key: Optional[str] = None) -> int:
+        """
+        Publish changed price levels as a sequenced delta on the order book channel.
+        Pass the sequence number when the caller assigns it (in-memory books), or the
+        Redis sequence key to have it assigned atomically with the publish.
+        """
+        channel_name = f"orderbook_updates:{symbol}"
+        delta = {
+            "type": "delta",
+            "symbol": symbol,
+            "bids": changes.get("bids", []),
+            "asks": changes.get("asks", []),
+            "timestamp": datetime.now(timezone.utc).timestamp()
+        }
+        
+        if sequence is not None:
+            self.redis.publish(channel_name, json.dumps({"seq": sequence, **delta}))
+            return sequence
+        
+        publish_delta = self.redis.register_script(PUBLISH_DELTA_SCRIPT)
+        return publish_delta(keys=[sequence_key], args=[channel_name, json.dumps(delta)])
+    
     def publish_trade_update(self, symbol: str, trade_data: Dict):
         """Publish trade updates to Redis channel"""
         channel_name = f"trade_updates:{symbol}"
@@ -48,72 +73,5 @@ class MarketDataService:
     
     def update_ohlc_data(self, symbol: str, price: float, quantity: float):
         """Update OHLC data for a symbol with a new trade"""
-        # Get current timestamp
-        now = datetime.now(timezone.utc)
-        
-        # Define intervals to update
-        intervals = {
-            "1m": 60,  # 1 minute in seconds
-            "5m": 300,  # 5 minutes
-            "15m": 900,  # 15 minutes
-            "1h": 3600,  # 1 hour
-            "4h": 14400,  # 4 hours
-            "1d": 86400,  # 1 day
-        }
-        
-        for interval_name, interval_seconds in intervals.items():
-            # Calculate the current interval timestamp
-            interval_timestamp = int(now.timestamp() / interval_seconds) * interval_seconds
-            
-            ohlc_key = f"ohlc:{symbol}:{interval_name}"
-            current_key = f"current_ohlc:{symbol}:{interval_name}"
-            
-            # Get current OHLC data for this interval
-            current_ohlc = self.redis.get(current_key)
-            
-            if current_ohlc:
-                current_data = json.loads(current_ohlc)
-                
-                # Check if we're still in the same interval
-                if current_data["timestamp"] == interval_timestamp:
-                    # Update high and low prices
-                    current_data["high"] = max(current_data["high"], price)
-                    current_data["low"] = min(current_data["low"], price)
-                    
-                    # Update close price and volume
-                    current_data["close"] = price
-                    current_data["volume"] += quantity
-                    
-                    # Save updated data
-                    self.redis.set(current_key, json.dumps(current_data))
-                else:
-                    # We've moved to a new interval
-                    # Save the previous interval data to the OHLC list
-                    self.redis.lpush(ohlc_key, json.dumps(current_data))
-                    self.redis.ltrim(ohlc_key, 0, 999)  # Keep last 1000 intervals
-                    
-                    # Create new interval data
-                    new_data = {
-                        "timestamp": interval_timestamp,
-                        "open": price,
-                        "high": price,
-                        "low": price,
-                        "close": price,
-                        "volume": quantity
-                    }
-                    
-                    # Save new interval data
-                    self.redis.set(current_key, json.dumps(new_data))
-            else:
-                # No current data, create new interval
-                new_data = {
-                    "timestamp": interval_timestamp,
-                    "open": price,
-                    "high": price,
-                    "low": price,
-                    "close": price,
-                    "volume": quantity
-                }
-                
-                # Save new interval data
-                self.redis.set(current_key, json.dumps(new_data))
\ No newline at end of file
+        trade = {"price": price, "quantity": quantity, "executed_at": datetime.now(timezone.utc)}
+        CandleAggregator(self.redis).update_candles(symbol, [trade])
@@ -1,232 +1,491 @@
+import math
+import time
 import uuid
 from datetime import datetime, timezone
 from typing import List, Dict, Tuple, Optional
 import redis
 import json
-from app.models.order_book import OrderBook
-from app.models.order import OrderSide, OrderStatus
+from contextlib import nullcontext
+from app.config import (
+    ORDER_BOOK_BACKEND, ORDER_BOOK_REDIS_MIRROR, PUBLISH_ORDER_BOOK_DELTAS,
+    MATCH_FETCH_SIZE, MARKET_ORDER_MAX_LEVELS, MARKET_ORDER_MAX_SLIPPAGE
+)
+from app.models.instrument import get_symbol_spec
+from app.models.order_book import (
+    ORDER_INDEX_KEY, OrderBook, build_order_details, locate_order, order_member, order_units,
+    trader_open_orders
+)
+from app.models.order_book_scripts import MATCH_ORDER_SCRIPT
+from app.models.order_codec import encode_order_details
+from app.models.memory_order_book import find_memory_order, get_memory_order_book, memory_trader_orders
+from app.models.order import OrderSide, OrderStatus, OrderType
 from app.db.redis_client import get_redis
+from app.messaging.publisher import get_execution_publisher
+from app.services.candles import CandleAggregator
+from app.services.market_data import MarketDataService
+from app.services.journal import get_journal
+from app.services.metrics import get_order_metrics
+from app.services.persister import get_persister
 
 class MatchingEngine:
     """Matching engine for processing orders and executing trades"""
     
-    def __init__(self, redis_client=None):
+    def __init__(self, redis_client=None, backend: str = None, persister=None, journal=None, executions=None):
         self.redis = redis_client if redis_client else get_redis()
+        self.backend = backend or ORDER_BOOK_BACKEND
+        # Write-behind persister for trades and order states (None writes through the db session)
+        self.persister = persister if persister is not None else get_persister()
+        # Journal of inbound orders and cancels (None when disabled; pass False to skip it)
+        self.journal = (journal if journal is not None else get_journal()) or None
+        # Per-symbol stage latencies and counters (None when disabled)
+        self.metrics = get_order_metrics()
+        # Trades and execution reports for downstream services (None when disabled; pass False to skip it)
+        self.executions = (executions if executions is not None else get_execution_publisher()) or None
+        self.market_data = MarketDataService(self.redis)
+        # OHLC candles built from this engine's trades
+        self.candles = CandleAggregator(self.redis)
+        # Resting orders read per ranged fetch while sweeping
+        self.fetch_size = max(1, MATCH_FETCH_SIZE)
+        self._match_script = None
     
-    def process_order(self, order, db=None) -> List[Dict]:
+    def get_order_book(self, symbol: str):
+        """Get the order book for a symbol from the configured backend"""
+        if self.backend == "memory":
+            return get_memory_order_book(symbol, self.redis, mirror=ORDER_BOOK_REDIS_MIRROR)
+        return OrderBook(self.redis, symbol)
+    
+    def locate_order(self, order_id: str) -> Optional[str]:
+        """Symbol of a resting order, from the order index rather than the database"""
+        if self.backend == "memory":
+            symbol = find_memory_order(order_id)
+            if symbol is not None:
+                return symbol
+        # In-memory books not loaded yet are found through their Redis mirror
+        location = locate_order(self.redis, order_id)
+        return location[0] if location else None
+    
+    def cancel_orders(self, symbol: str, order_ids: List[str], trader_id: Optional[str] = None) -> List[Dict]:
+        """Take resting orders off a symbol's book; returns the details of those cancelled"""
+        if self.journal is not None:
+            self.journal.record_cancel(symbol, order_ids)
+        
+        order_book = self.get_order_book(symbol)
+        with getattr(order_book, "lock", None) or nullcontext():
+            cancelled = order_book.cancel_orders(order_ids, trader_id)
+            self.publish_book_changes(order_book)
+        if self.metrics and cancelled:
+            self.metrics.record_cancels(symbol, len(cancelled))
+        if self.executions is not None:
+            spec = get_symbol_spec(symbol)
+            now = datetime.now(timezone.utc)
+            for order_details in cancelled:
+                self.executions.publish_execution_report({
+                    "order_id": order_details["order_id"],
+                    "trader_id": order_details.get("trader_id"),
+                    "symbol": symbol,
+                    "side": order_details.get("side"),
+                    "status": OrderStatus.CANCELLED,
+                    "filled_quantity": spec.quantity(int(order_details.get("filled_lots", 0))),
+                    "timestamp": now
+                })
+        return cancelled
+    
+    def trader_open_orders(self, trader_id: str, symbol: Optional[str] = None) -> Dict[str, List[str]]:
+        """Resting order ids of a trader by symbol (optionally one symbol), from the trader's order index"""
+        orders = trader_open_orders(self.redis, trader_id)
+        if self.backend == "memory":
+            for book_symbol, order_ids in memory_trader_orders(trader_id).items():
+                orders[book_symbol] = list(dict.fromkeys(orders.get(book_symbol, []) + order_ids))
+        if symbol is not None:
+            return {symbol: orders[symbol]} if symbol in orders else {}
+        return orders
+    
+    def process_order(self, order, db=None, commit: bool = True) -> List[Dict]:
         """
         Process an incoming order against the order book
         Returns a list of executed trades
+        Pass commit=False to leave committing the db session and flushing candle
+        updates (flush_market_data) to the caller (batched intake)
         """
-        # Skip market orders for now if no price is set
-        if order.order_type == "market" and not order.price:
-            return []
+        if self.journal is not None:
+            # Units first, so the journal records the exact ticks and lots that are matched
+            self._set_order_units(order)
+            self.journal.record_order(order)
         
-        # Get the order book for this symbol
-        order_book = OrderBook(self.redis, order.symbol)
+        # Match the whole sweep server-side in one call
+        if self.backend == "redis_script":
+            return self._process_order_scripted(order, db, commit)
         
-        # For buy orders, we need to match against the lowest sell orders (asks)
-        # For sell orders, we need to match against the highest buy orders (bids)
-        trades = []
+        # Get the order book for this symbol
+        order_book = self.get_order_book(order.symbol)
+        spec = self._set_order_units(order)
         
-        if order.side == OrderSide.BUY:
-            trades = self._match_buy_order(order, order_book, db)
-        else:
-            trades = self._match_sell_order(order, order_book, db)
-        
-        # If the order wasn't fully matched and it's a limit order, add it to the book
-        remaining_quantity = order.quantity - order.filled_quantity
-        if remaining_quantity > 0 and order.order_type == "limit":
-            # Update order status
-            if order.filled_quantity > 0:
-                order.status = OrderStatus.PARTIALLY_FILLED
+        clock = time.perf_counter_ns
+        started = clock()
+        # In-memory books are shared between threads; hold the book for the whole match
+        with getattr(order_book, "lock", None) or nullcontext():
+            # Buy orders match against the lowest sell orders (asks),
+            # sell orders against the highest buy orders (bids)
+            if order.order_type == OrderType.MARKET:
+                trades = self._match_order(order, order_book, db,
+                                           limit_ticks=self._market_limit(order, order_book, spec),
+                                           max_levels=MARKET_ORDER_MAX_LEVELS)
             else:
-                order.status = OrderStatus.ACTIVE
-                
-            # Add to order book
-            order_book.add_order(order)
-        elif remaining_quantity <= 0:
-            order.status = OrderStatus.FILLED
+                trades = self._match_order(order, order_book, db, limit_ticks=order.price_ticks)
+            
+            # If the order wasn't fully matched and it's a limit order, add it to the book
+            remaining_lots = order.quantity_lots - order.filled_lots
+            if remaining_lots <= 0:
+                order.status = OrderStatus.FILLED
+            elif order.order_type == OrderType.LIMIT:
+                # Update order status
+                if order.filled_lots > 0:
+                    order.status = OrderStatus.PARTIALLY_FILLED
+                else:
+                    order.status = OrderStatus.ACTIVE
+                    
+                # Add to order book
+                order_book.add_order(order)
+            else:
+                # Market orders never rest; what the protection limits left unfilled is cancelled
+                order.status = OrderStatus.CANCELLED
+            
+            matched = clock()
+            self.publish_book_changes(order_book)
+            publish_time = clock() - matched
         
         # Update the order in database if db session is provided
         if db and hasattr(order, '__tablename__'):
-            db.add(order)
-            db.commit()
+            self._persist_order(db, order, commit)
         
+        recorded = clock()
+        self._record_trades(trades, commit)
+        self._publish_order_report(order, trades)
+        self._record_metrics(order.symbol, trades, matched - started, publish_time + clock() - recorded)
         return trades
     
-    def _match_buy_order(self, buy_order, order_book: OrderBook, db=None) -> List[Dict]:
-        """Match a buy order against the sell orders in the book"""
-        trades = []
-        remaining_quantity = buy_order.quantity
+    def _process_order_scripted(self, order, db=None, commit: bool = True) -> List[Dict]:
+        """
+        Match an order with the atomic Redis script.
+        The sweep, the maker updates and resting the remainder happen in a single EVALSHA.
+        """
+        order_book = OrderBook(self.redis, order.symbol)
+        if self._match_script is None:
+            self._match_script = self.redis.register_script(MATCH_ORDER_SCRIPT)
         
-        while remaining_quantity > 0:
-            # Get the best (lowest) ask
-            sell_order_id, sell_price = order_book.get_best_ask()
-            
-            # If no sell orders or price is higher than buy order's price, stop matching
-            if sell_order_id is None or (buy_order.price is not None and sell_price > buy_order.price):
-                break
-            
-            # Get sell order details
-            sell_order_json = order_book.redis.hget(order_book.order_details_key, sell_order_id)
-            if not sell_order_json:
-                break
-                
-            sell_order_dict = json.loads(sell_order_json)
-            sell_order_quantity = float(sell_order_dict.get("quantity", 0))
-            sell_order_filled = float(sell_order_dict.get("filled_quantity", 0))
-            available_quantity = sell_order_quantity - sell_order_filled
-            
-            if available_quantity <= 0:
-                # Remove the fully filled order and continue
-                order_book.remove_order(sell_order_id)
-                continue
-            
-            # Calculate trade quantity and price
-            trade_quantity = min(remaining_quantity, available_quantity)
-            trade_price = sell_price
-            
-            # Create trade
-            trade_id = str(uuid.uuid4())
-            trade = {
-                "trade_id": trade_id,
-                "buy_order_id": buy_order.order_id,
-                "sell_order_id": sell_order_id,
-                "symbol": buy_order.symbol,
-                "quantity": trade_quantity,
-                "price": trade_price,
-                "executed_at": datetime.now(timezone.utc)
-            }
-            trades.append(trade)
-            
-            # Update the filled quantities
-            buy_order.filled_quantity = buy_order.filled_quantity + trade_quantity
-            sell_order_dict["filled_quantity"] = sell_order_filled + trade_quantity
-            
-            # If sell order is fully filled, remove it from the book
-            if sell_order_dict["filled_quantity"] >= sell_order_quantity:
-                sell_order_dict["status"] = OrderStatus.FILLED
-                order_book.remove_order(sell_order_id)
+        spec = self._set_order_units(order)
+        clock = time.perf_counter_ns
+        started = clock()
+        order_details = build_order_details(order)
+        score = OrderBook.order_score(order.side, order.price_ticks or 0)
+        is_market = order.order_type == OrderType.MARKET
+        # Market orders sweep up to their protection price; they never rest, so it is not stored
+        sweep = dict(order_details, price_ticks=self._market_limit(order, order_book, spec)) \
+            if is_market else order_details
+        filled_lots, status, fills, levels = self._match_script(
+            keys=[order_book.buy_orders_key, order_book.sell_orders_key, order_book.order_details_key,
+                  order_book.buy_levels_key, order_book.buy_depth_key,
+                  order_book.sell_levels_key, order_book.sell_depth_key, ORDER_INDEX_KEY],
+            args=[json.dumps(sweep), score, encode_order_details(order_details),
+                  order_member(order_details), self.fetch_size,
+                  MARKET_ORDER_MAX_LEVELS if is_market else 0, order.symbol]
+        )
+        
+        matched = clock()
+        for i in range(0, len(levels), 4):
+            order_book.record_level_change(self._text(levels[i]), levels[i + 1], levels[i + 2], levels[i + 3])
+        self.publish_book_changes(order_book)
+        publish_time = clock() - matched
+        
+        trades = []
+        for i in range(0, len(fills), 6):
+            fill_started = clock()
+            maker_order_id = self._text(fills[i])
+            if order.side == OrderSide.BUY:
+                buy_order_id, sell_order_id = order.order_id, maker_order_id
             else:
-                sell_order_dict["status"] = OrderStatus.PARTIALLY_FILLED
-                # Update the order in the book
-                order_book.redis.hset(order_book.order_details_key, sell_order_id, 
-                                      json.dumps(sell_order_dict))
+                buy_order_id, sell_order_id = maker_order_id, order.order_id
             
-            # Update remaining quantity
-            remaining_quantity -= trade_quantity
+            trade = self._build_trade(spec, buy_order_id, sell_order_id, fills[i + 1], fills[i + 2])
+            trades.append(trade)
             
-            # If this is a database model, update it
-            if db and sell_order_id:
-                from app.models.order import OrderModel
-                from app.models.trade import TradeModel
-                
-                # Create and save trade
-                db_trade = TradeModel(
-                    trade_id=trade_id,
-                    buy_order_id=buy_order.order_id,
-                    sell_order_id=sell_order_id,
-                    symbol=buy_order.symbol,
-                    quantity=trade_quantity,
-                    price=trade_price
-                )
-                db.add(db_trade)
-                
-                # Update sell order in database
-                db_sell_order = db.query(OrderModel).filter(
-                    OrderModel.order_id == sell_order_id).first()
-                if db_sell_order:
-                    db_sell_order.filled_quantity = sell_order_dict["filled_quantity"]
-                    db_sell_order.status = sell_order_dict["status"]
-                    db.add(db_sell_order)
+            maker = {"filled_lots": fills[i + 3], "status": self._text(fills[i + 4])}
+            if db:
+                self._persist_fill(db, trade, maker_order_id, maker)
+            self._publish_fill(trade, maker_order_id, maker, order.side, self._text(fills[i + 5]) or None)
+            self._record_fill(order.symbol, clock() - fill_started)
+        
+        # Only the remainder of a limit order rests, market remainders are cancelled
+        status = self._text(status)
+        self._set_filled(order, spec, filled_lots)
+        if status == OrderStatus.FILLED or not is_market:
+            order.status = OrderStatus(status)
+        else:
+            order.status = OrderStatus.CANCELLED
+        match_time = clock() - started - publish_time
         
+        # Update the order in database if db session is provided
+        if db and hasattr(order, '__tablename__'):
+            self._persist_order(db, order, commit)
+        
+        recorded = clock()
+        self._record_trades(trades, commit)
+        self._publish_order_report(order, trades)
+        self._record_metrics(order.symbol, trades, match_time, publish_time + clock() - recorded)
         return trades
     
-    def _match_sell_order(self, sell_order, order_book: OrderBook, db=None) -> List[Dict]:
-        """Match a sell order against the buy orders in the book"""
-        trades = []
-        remaining_quantity = sell_order.quantity
+    def _record_metrics(self, symbol: str, trades: List[Dict], match_time: int, publish_time: int):
+        """Record an order's match and publish times (nanoseconds) and its fills"""
+        if self.metrics:
+            self.metrics.record_order(symbol, len(trades), match_time)
+            self.metrics.record(symbol, "publish", publish_time)
+    
+    def _publish_fill(self, trade: Dict, maker_order_id: str, maker_state: Dict, taker_side,
+                      maker_trader_id: Optional[str] = None):
+        """Queue a trade and the maker's execution report for downstream services"""
+        if self.executions is None:
+            return
+        self.executions.publish_trade(trade)
+        self.executions.publish_execution_report({
+            "order_id": maker_order_id,
+            "trader_id": maker_trader_id,
+            "symbol": trade["symbol"],
+            "side": OrderSide.SELL if taker_side == OrderSide.BUY else OrderSide.BUY,
+            "status": maker_state["status"],
+            "filled_quantity": get_symbol_spec(trade["symbol"]).quantity(int(maker_state["filled_lots"])),
+            "trade_id": trade["trade_id"],
+            "last_price": trade["price"],
+            "last_quantity": trade["quantity"],
+            "timestamp": trade["executed_at"]
+        })
+    
+    def _publish_order_report(self, order, trades: List[Dict]):
+        """Queue the incoming order's execution report: its final state after matching"""
+        if self.executions is None:
+            return
+        self.executions.publish_execution_report({
+            "order_id": order.order_id,
+            "trader_id": order.trader_id,
+            "symbol": order.symbol,
+            "side": order.side,
+            "order_type": order.order_type,
+            "status": order.status,
+            "quantity": order.quantity,
+            "price": order.price,
+            "filled_quantity": order.filled_quantity,
+            "trade_ids": [trade["trade_id"] for trade in trades],
+            "timestamp": trades[-1]["executed_at"] if trades else datetime.now(timezone.utc)
+        })
+    
+    def _record_fill(self, symbol: str, fill_time: int):
+        if self.metrics:
+            self.metrics.record(symbol, "fill", fill_time)
+    
+    @staticmethod
+    def _text(value) -> str:
+        return value.decode() if isinstance(value, bytes) else value
+    
+    @staticmethod
+    def _set_order_units(order):
+        """Attach the order's price in ticks and quantities in lots; returns the symbol's spec"""
+        spec = get_symbol_spec(order.symbol)
+        order.price_ticks, order.quantity_lots, order.filled_lots = order_units(order, spec)
+        return spec
+    
+    @staticmethod
+    def _set_filled(order, spec, filled_lots: int):
+        order.filled_lots = filled_lots
+        order.filled_quantity = spec.quantity(filled_lots)
+    
+    @staticmethod
+    def _build_trade(spec, buy_order_id: str, sell_order_id: str, price_ticks: int, lots: int) -> Dict:
+        """Trade record in ticks and lots, with the float price and quantity for display"""
+        return {
+            "trade_id": str(uuid.uuid4()),
+            "buy_order_id": buy_order_id,
+            "sell_order_id": sell_order_id,
+            "symbol": spec.symbol,
+            "quantity": spec.quantity(lots),
+            "price": spec.price(price_ticks),
+            "quantity_lots": lots,
+            "price_ticks": price_ticks,
+            "executed_at": datetime.now(timezone.utc)
+        }
+    
+    def _record_trades(self, trades: List[Dict], flush: bool = True):
+        """Feed executed trades to the candle aggregator"""
+        if not trades:
+            return
+        self.candles.add_trades(trades)
+        if flush:
+            self.flush_market_data()
+    
+    def flush_market_data(self):
+        """Write candle updates for the trades queued since the last flush, one call per symbol"""
+        try:
+            self.candles.flush()
+        except Exception as e:
+            # Candles can be rebuilt from the trades table; never fail an order over them
+            print(f"Error updating candles: {str(e)}")
+    
+    def publish_book_changes(self, order_book):
+        """Publish the price levels changed on a book as a sequenced depth delta"""
+        if not PUBLISH_ORDER_BOOK_DELTAS:
+            return
         
-        while remaining_quantity > 0:
-            # Get the best (highest) bid
-            buy_order_id, buy_price = order_book.get_best_bid()
-            
-            # If no buy orders or price is lower than sell order's price, stop matching
-            if buy_order_id is None or (sell_order.price is not None and buy_price < sell_order.price):
+        changes = order_book.drain_level_changes()
+        if not changes:
+            return
+        
+        if hasattr(order_book, "next_sequence"):
+            # In-memory books number their own deltas; callers hold the book lock
+            self.market_data.publish_order_book_delta(order_book.symbol, changes,
+                                                      sequence=order_book.next_sequence())
+        else:
+            self.market_data.publish_order_book_delta(order_book.symbol, changes,
+                                                      sequence_key=order_book.sequence_key)
+    
+    def _persist_order(self, db, order, commit: bool = True):
+        """Save the incoming order's state to the database"""
+        started = time.perf_counter_ns()
+        if self.persister:
+            self.persister.record_order_state(order.order_id, order.filled_quantity, order.status,
+                                              order.filled_lots)
+        else:
+            db.add(order)
+            if commit:
+                db.commit()
+        if self.metrics:
+            self.metrics.record(order.symbol, "persist", time.perf_counter_ns() - started)
+    
+    def _persist_fill(self, db, trade: Dict, maker_order_id: str, maker_order_dict: Dict):
+        """Save a trade and the maker order's new state (filled lots and status) to the database"""
+        filled_lots = maker_order_dict["filled_lots"]
+        filled_quantity = get_symbol_spec(trade["symbol"]).quantity(filled_lots)
+        if self.persister:
+            # Queued off the matching path; written in batches by the persister
+            self.persister.record_trade(trade)
+            self.persister.record_order_state(maker_order_id, filled_quantity, maker_order_dict["status"],
+                                              filled_lots)
+            return
+        
+        from app.models.order import OrderModel
+        from app.models.trade import TradeModel
+        
+        # Create and save trade
+        db_trade = TradeModel(
+            trade_id=trade["trade_id"],
+            buy_order_id=trade["buy_order_id"],
+            sell_order_id=trade["sell_order_id"],
+            symbol=trade["symbol"],
+            quantity=trade["quantity"],
+            price=trade["price"],
+            quantity_lots=trade["quantity_lots"],
+            price_ticks=trade["price_ticks"]
+        )
+        db.add(db_trade)
+        
+        # Update maker order in database
+        db_maker_order = db.query(OrderModel).filter(
+            OrderModel.order_id == maker_order_id).first()
+        if db_maker_order:
+            db_maker_order.filled_quantity = filled_quantity
+            db_maker_order.filled_lots = filled_lots
+            db_maker_order.status = maker_order_dict["status"]
+            db.add(db_maker_order)
+    
+    def _market_limit(self, order, order_book, spec) -> Optional[int]:
+        """
+        Worst price in ticks a market order may trade at: its own price if it has one,
+        tightened to MARKET_ORDER_MAX_SLIPPAGE away from the last traded price
+        (or from the best opposite price before any trade)
+        """
+        limit_ticks = order.price_ticks
+        if MARKET_ORDER_MAX_SLIPPAGE <= 0:
+            return limit_ticks
+        
+        is_buy = order.side == OrderSide.BUY
+        reference = self.market_data.get_last_price(order.symbol)
+        if reference is not None:
+            reference_ticks = spec.to_ticks(reference, exact=False)
+        else:
+            _, reference_ticks = order_book.get_best_ask() if is_buy else order_book.get_best_bid()
+            if reference_ticks is None:
+                return limit_ticks
+        
+        if is_buy:
+            protection = math.floor(reference_ticks * (1 + MARKET_ORDER_MAX_SLIPPAGE))
+            return protection if limit_ticks is None else min(limit_ticks, protection)
+        protection = math.ceil(reference_ticks * (1 - MARKET_ORDER_MAX_SLIPPAGE))
+        return protection if limit_ticks is None else max(limit_ticks, protection)
+    
+    def _match_order(self, order, order_book, db=None, limit_ticks: Optional[int] = None,
+                     max_levels: int = 0) -> List[Dict]:
+        """
+        Sweep the opposite side of the book for an incoming order, up to limit_ticks and
+        at most max_levels price levels (0: any number).
+        Resting orders are read fetch_size at a time and consumed locally; the next range is
+        only fetched once one is used up. The fills are written back in one batch at the end.
+        """
+        spec = get_symbol_spec(order.symbol)
+        is_buy = order.side == OrderSide.BUY
+        book_side = OrderSide.SELL if is_buy else OrderSide.BUY
+        remaining_lots = order.quantity_lots - order.filled_lots
+        
+        fills: List[Tuple[Dict, int]] = []
+        offset = 0
+        levels_swept = 0
+        level_ticks = None
+        stopped = False
+        
+        while remaining_lots > 0 and not stopped:
+            makers = order_book.peek_orders(book_side, self.fetch_size, offset)
+            if not makers:
                 break
+            offset += len(makers)
             
-            # Get buy order details
-            buy_order_json = order_book.redis.hget(order_book.order_details_key, buy_order_id)
-            if not buy_order_json:
-                break
+            for maker in makers:
+                price_ticks = maker["price_ticks"]
+                # Stop at the first price beyond the limit, or past the last level allowed
+                if limit_ticks is not None and (price_ticks > limit_ticks if is_buy else price_ticks < limit_ticks):
+                    stopped = True
+                    break
+                if price_ticks != level_ticks:
+                    if max_levels and levels_swept >= max_levels:
+                        stopped = True
+                        break
+                    levels_swept += 1
+                    level_ticks = price_ticks
                 
-            buy_order_dict = json.loads(buy_order_json)
-            buy_order_quantity = float(buy_order_dict.get("quantity", 0))
-            buy_order_filled = float(buy_order_dict.get("filled_quantity", 0))
-            available_quantity = buy_order_quantity - buy_order_filled
-            
-            if available_quantity <= 0:
-                # Remove the fully filled order and continue
-                order_book.remove_order(buy_order_id)
+                # Orders with nothing left open are removed with a fill of 0 lots
+                available_lots = int(maker.get("quantity_lots", 0)) - int(maker.get("filled_lots", 0))
+                trade_lots = min(remaining_lots, max(available_lots, 0))
+                fills.append((maker, trade_lots))
+                remaining_lots -= trade_lots
+                if remaining_lots <= 0:
+                    break
+        
+        # Trades execute at the resting orders' prices. Only fills the book applied count: a maker
+        # cancelled, filled or amended between peek_orders and apply_fills comes back as None
+        trades = []
+        filled_lots = order.filled_lots
+        for (maker, trade_lots), maker_state in zip(fills, order_book.apply_fills(fills)):
+            if not trade_lots or maker_state is None:
                 continue
-            
-            # Calculate trade quantity and price
-            trade_quantity = min(remaining_quantity, available_quantity)
-            trade_price = buy_price
-            
-            # Create trade
-            trade_id = str(uuid.uuid4())
-            trade = {
-                "trade_id": trade_id,
-                "buy_order_id": buy_order_id,
-                "sell_order_id": sell_order.order_id,
-                "symbol": sell_order.symbol,
-                "quantity": trade_quantity,
-                "price": trade_price,
-                "executed_at": datetime.now(timezone.utc)
-            }
-            trades.append(trade)
-            
-            # Update the filled quantities
-            sell_order.filled_quantity = sell_order.filled_quantity + trade_quantity
-            buy_order_dict["filled_quantity"] = buy_order_filled + trade_quantity
-            
-            # If buy order is fully filled, remove it from the book
-            if buy_order_dict["filled_quantity"] >= buy_order_quantity:
-                buy_order_dict["status"] = OrderStatus.FILLED
-                order_book.remove_order(buy_order_id)
+            filled_lots += trade_lots
+            fill_started = time.perf_counter_ns()
+            maker_order_id = maker["order_id"]
+            if is_buy:
+                trade = self._build_trade(spec, order.order_id, maker_order_id, maker["price_ticks"], trade_lots)
             else:
-                buy_order_dict["status"] = OrderStatus.PARTIALLY_FILLED
-                # Update the order in the book
-                order_book.redis.hset(order_book.order_details_key, buy_order_id, 
-                                      json.dumps(buy_order_dict))
-            
-            # Update remaining quantity
-            remaining_quantity -= trade_quantity
+                trade = self._build_trade(spec, maker_order_id, order.order_id, maker["price_ticks"], trade_lots)
+            trades.append(trade)
             
             # If this is a database model, update it
-            if db and buy_order_id:
-                from app.models.order import OrderModel
-                from app.models.trade import TradeModel
-                
-                # Create and save trade
-                db_trade = TradeModel(
-                    trade_id=trade_id,
-                    buy_order_id=buy_order_id,
-                    sell_order_id=sell_order.order_id,
-                    symbol=sell_order.symbol,
-                    quantity=trade_quantity,
-                    price=trade_price
-                )
-                db.add(db_trade)
-                
-                # Update buy order in database
-                db_buy_order = db.query(OrderModel).filter(
-                    OrderModel.order_id == buy_order_id).first()
-                if db_buy_order:
-                    db_buy_order.filled_quantity = buy_order_dict["filled_quantity"]
-                    db_buy_order.status = buy_order_dict["status"]
-                    db.add(db_buy_order)
-        
-        return trades
\ No newline at end of file
+            if db:
+                self._persist_fill(db, trade, maker_order_id, maker_state)
+            self._publish_fill(trade, maker_order_id, maker_state, order.side, maker.get("trader_id"))
+            self._record_fill(order.symbol, time.perf_counter_ns() - fill_started)
+        
+        self._set_filled(order, spec, filled_lots)
+        return trades
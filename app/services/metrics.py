@@ -0,0 +1,229 @@
+"""
+Latency histograms and order processing metrics.
+
+LatencyHistogram is log-linear in the style of HdrHistogram. Values below 2^significant_bits
+get a bucket each. Above that, every power of two is split into 2^(significant_bits - 1)
+buckets, so any recorded value is reported within 1 / 2^(significant_bits - 1) of itself.
+Counts live in one preallocated list (cheaper to increment than a numpy array), so recording
+never allocates; numpy is only used to read percentiles back.
+
+OrderMetrics keeps one histogram per symbol and processing stage, with order, fill, cancel,
+Redis and database call counters and failed order book mirror writes, and renders them in the
+Prometheus text format.
+"""
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from app.config import METRICS_ENABLED
+
+class LatencyHistogram:
+    """Fixed-size log-linear histogram of non-negative integer values (e.g. microseconds)"""
+
+    def __init__(self, max_value: int = 60_000_000, significant_bits: int = 7):
+        self.significant_bits = significant_bits
+        self.sub_bucket_count = 1 << significant_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.max_value = max_value
+        shifts = max(0, max_value.bit_length() - significant_bits)
+        self.counts = [0] * (self.sub_bucket_count + shifts * self.half_count)
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+    def index(self, value: int) -> int:
+        """Bucket of a value; values above max_value share the last bucket"""
+        if value < self.sub_bucket_count:
+            return value if value > 0 else 0
+        if value > self.max_value:
+            value = self.max_value
+        shift = value.bit_length() - self.significant_bits
+        return self.sub_bucket_count + (shift - 1) * self.half_count + (value >> shift) - self.half_count
+
+    def bucket_bounds(self, index: int) -> Tuple[int, int]:
+        """Lowest and highest value counted in a bucket"""
+        if index < self.sub_bucket_count:
+            return index, index
+        shift, offset = divmod(index - self.sub_bucket_count, self.half_count)
+        shift += 1
+        lowest = (self.half_count + offset) << shift
+        return lowest, lowest + (1 << shift) - 1
+
+    def record(self, value: int, count: int = 1):
+        self.counts[self.index(value)] += count
+        self.total += count
+        self.sum += value * count
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def merge(self, other: "LatencyHistogram"):
+        """Add another histogram with the same layout into this one"""
+        self.counts[:] = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def reset(self):
+        self.counts[:] = [0] * len(self.counts)
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+    def value_at_percentile(self, percentile: float) -> int:
+        """Highest value of the bucket holding the given percentile (0 when empty)"""
+        if self.total == 0:
+            return 0
+        rank = max(1, int(np.ceil(percentile / 100 * self.total)))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(self.bucket_bounds(index)[1], self.max)
+
+    def percentiles(self, percentiles: Iterable[float] = (50, 90, 99, 99.9)) -> Dict[str, int]:
+        return {f"p{percentile:g}".replace(".", "_"): self.value_at_percentile(percentile)
+                for percentile in percentiles}
+
+    def summary(self) -> Dict:
+        """Count, mean, min/max and the usual percentiles"""
+        summary = {"count": self.total, "mean": round(self.sum / self.total, 1) if self.total else 0,
+                   "min": self.min or 0, "max": self.max}
+        summary.update(self.percentiles())
+        return summary
+
+    def buckets(self) -> List[Tuple[int, int]]:
+        """(highest value, count) of every non-empty bucket, in value order"""
+        return [(self.bucket_bounds(int(index))[1], int(self.counts[index]))
+                for index in np.flatnonzero(self.counts)]
+
+# Order processing stages timed per symbol:
+# validate - request validation and pre-trade risk checks
+# persist  - each database write on the order path (insert, state update, refresh)
+# match    - sweeping the book and resting the remainder, fills included
+# fill     - the work for one fill (trade record and maker update), a breakdown of match
+# publish  - depth deltas and candle updates after matching
+STAGES = ("validate", "persist", "match", "fill", "publish")
+
+# Stage timings are recorded in nanoseconds, up to a minute
+STAGE_MAX_NANOSECONDS = 60_000_000_000
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+class SymbolMetrics:
+    """Stage histograms and counters of one symbol"""
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.lock = threading.Lock()
+        self.stages = {stage: LatencyHistogram(STAGE_MAX_NANOSECONDS) for stage in STAGES}
+        self.orders = 0
+        self.fills = 0
+        self.cancels = 0
+
+class OrderMetrics:
+    """
+    Process-wide registry of per-symbol stage latencies and order counters, plus Redis and
+    database call counters. Timers are read with time.perf_counter_ns by the callers.
+    """
+
+    def __init__(self):
+        self._symbols: Dict[str, SymbolMetrics] = {}
+        self._lock = threading.Lock()
+        self.redis_calls = 0
+        self.redis_commands = 0
+        self.db_calls = 0
+        self.mirror_errors = 0
+
+    def symbol(self, symbol: str) -> SymbolMetrics:
+        metrics = self._symbols.get(symbol)
+        if metrics is None:
+            with self._lock:
+                metrics = self._symbols.setdefault(symbol, SymbolMetrics(symbol))
+        return metrics
+
+    def record(self, symbol: str, stage: str, nanoseconds: int):
+        metrics = self.symbol(symbol)
+        with metrics.lock:
+            metrics.stages[stage].record(nanoseconds)
+
+    def record_order(self, symbol: str, fills: int, match_nanoseconds: int):
+        """One matched order: its match time and fill count"""
+        metrics = self.symbol(symbol)
+        with metrics.lock:
+            metrics.stages["match"].record(match_nanoseconds)
+            metrics.orders += 1
+            metrics.fills += fills
+
+    def record_cancels(self, symbol: str, count: int):
+        metrics = self.symbol(symbol)
+        with metrics.lock:
+            metrics.cancels += count
+
+    def record_redis_call(self, commands: int = 1):
+        """One round trip to Redis carrying this many commands"""
+        with self._lock:
+            self.redis_calls += 1
+            self.redis_commands += commands
+
+    def record_db_call(self):
+        with self._lock:
+            self.db_calls += 1
+
+    def record_mirror_error(self):
+        """One batch of in-memory book changes that could not be written to Redis"""
+        with self._lock:
+            self.mirror_errors += 1
+
+    def prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = [
+            "# HELP order_stage_latency_seconds Time spent in each order processing stage",
+            "# TYPE order_stage_latency_seconds summary",
+        ]
+        counters = {"orders": [], "fills": [], "cancels": []}
+        for symbol, metrics in sorted(self._symbols.items()):
+            with metrics.lock:
+                histograms = {stage: (histogram.total, histogram.sum,
+                                      [histogram.value_at_percentile(quantile * 100) for quantile in SUMMARY_QUANTILES])
+                              for stage, histogram in metrics.stages.items() if histogram.total}
+                counts = {"orders": metrics.orders, "fills": metrics.fills, "cancels": metrics.cancels}
+            label = _label(symbol)
+            for stage, (total, nanoseconds, values) in histograms.items():
+                labels = f'symbol="{label}",stage="{stage}"'
+                for quantile, value in zip(SUMMARY_QUANTILES, values):
+                    lines.append(f'order_stage_latency_seconds{{{labels},quantile="{quantile:g}"}} {value / 1e9:.9f}')
+                lines.append(f"order_stage_latency_seconds_sum{{{labels}}} {nanoseconds / 1e9:.9f}")
+                lines.append(f"order_stage_latency_seconds_count{{{labels}}} {total}")
+            for name, count in counts.items():
+                counters[name].append(f'{name}_total{{symbol="{label}"}} {count}')
+
+        for name, help_text in (("orders", "Orders matched"), ("fills", "Fills executed"),
+                                ("cancels", "Resting orders cancelled")):
+            lines += [f"# HELP {name}_total {help_text}", f"# TYPE {name}_total counter"] + counters[name]
+        for name, help_text, value in (
+                ("redis_calls_total", "Round trips to Redis", self.redis_calls),
+                ("redis_commands_total", "Redis commands sent, pipelined ones included", self.redis_commands),
+                ("db_calls_total", "SQL statements executed", self.db_calls),
+                ("order_book_mirror_errors_total", "Failed writes of in-memory book changes to Redis",
+                 self.mirror_errors)):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+def _label(value: str) -> str:
+    """Escape a Prometheus label value"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+_metrics: Optional[OrderMetrics] = None
+_metrics_lock = threading.Lock()
+
+def get_order_metrics() -> Optional[OrderMetrics]:
+    """Get the process-wide order metrics, or None when they are disabled"""
+    global _metrics
+    if not METRICS_ENABLED:
+        return None
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = OrderMetrics()
+    return _metrics
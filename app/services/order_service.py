@@ -1,20 +1,40 @@
+import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
+from sqlalchemy import insert, update
 from sqlalchemy.orm import Session
+from app.config import MAX_ORDER_BATCH_SIZE
 from app.db.redis_client import get_redis
+from app.models.instrument import get_symbol_spec
 from app.models.order import OrderModel, OrderCreate, Order, OrderSide, OrderType, OrderStatus
 from app.models.order_book import OrderBook
 from app.services.matching_engine import MatchingEngine
-from typing import List, Optional, Dict, Tuple
+from app.services.metrics import get_order_metrics
+from app.services.risk import get_risk_cache
+from app.services.sharding import get_shard_router
+from typing import List, Optional, Dict, Tuple, Union
 
 class OrderService:
     def __init__(self, db: Session):
         self.db = db
         self.redis = get_redis()
         self.matching_engine = MatchingEngine(self.redis)
+        # Pre-trade risk checks (None when disabled)
+        self.risk = get_risk_cache()
+        # Per-symbol stage latencies (None when disabled)
+        self.metrics = get_order_metrics()
+        # Routes orders and cancels to the shard worker owning the symbol (None: match here)
+        self.router = get_shard_router()
+        # Set once create_orders has started changing order books, so callers know whether
+        # a failed batch can be retried as a whole
+        self.matching_started = False
     
     def create_order(self, order_create: OrderCreate) -> Tuple[Order, List[Dict]]:
         """Create a new order and process it through the matching engine"""
+        if self.router:
+            return self.router.create_order(order_create)
+        
+        started = time.perf_counter_ns()
         # Validate the order
         is_valid, error_message = self.validate_order(order_create)
         if not is_valid:
@@ -22,6 +42,14 @@ class OrderService:
         
         # Generate a unique order ID
         order_id = str(uuid.uuid4())
+        units = self._order_units(order_create)
+        
+        # Check and book the order against the trader's risk limits
+        risk_error = self._reserve_risk(order_id, order_create, units)
+        if risk_error:
+            raise ValueError(risk_error)
+        validated = time.perf_counter_ns()
+        self._record_stage(order_create.symbol, "validate", validated - started)
         
         # Create new order model
         db_order = OrderModel(
@@ -33,13 +61,19 @@ class OrderService:
             quantity=order_create.quantity,
             price=order_create.price,
             status=OrderStatus.ACTIVE,  # Will be updated by matching engine
-            filled_quantity=0
+            filled_quantity=0,
+            **units
         )
         
         # Save to database
-        self.db.add(db_order)
-        self.db.commit()
+        try:
+            self.db.add(db_order)
+            self.db.commit()
+        except Exception:
+            self._release_risk(order_id)
+            raise
         self.db.refresh(db_order)
+        self._record_stage(order_create.symbol, "persist", time.perf_counter_ns() - validated)
         
         # Create Pydantic model for response
         order = Order(
@@ -58,17 +92,168 @@ class OrderService:
         
         # Process the order through the matching engine
         trades = self.matching_engine.process_order(db_order, self.db)
+        self._update_risk(db_order, trades)
         
-        # Refresh the order after processing
-        self.db.refresh(db_order)
+        # Refresh the order after processing (write-behind leaves the in-memory state current)
+        if self.matching_engine.persister is None:
+            refreshed = time.perf_counter_ns()
+            self.db.refresh(db_order)
+            self._record_stage(order_create.symbol, "persist", time.perf_counter_ns() - refreshed)
         
         # Update the Pydantic model with the latest data
         order.status = db_order.status
         order.filled_quantity = db_order.filled_quantity
         order.updated_at = db_order.updated_at
         
+        if self.matching_engine.persister is not None:
+            # The persister owns the write; drop the session's unflushed copy of the new state
+            self.db.expire(db_order)
+        
         return order, trades
     
+    def create_orders(self, order_creates: List[OrderCreate],
+                      order_ids: Optional[List[str]] = None) -> List[Union[Tuple[Order, List[Dict]], Exception]]:
+        """
+        Create and match a batch of orders in arrival order with a single commit.
+        All valid orders are inserted with one multi-row INSERT ... RETURNING before matching.
+        order_ids gives ids assigned before the orders were queued; new ones are generated otherwise.
+        Returns one entry per order: (order, trades), or the exception that rejected it.
+        """
+        if self.router:
+            # A shard may have matched part of the batch before failing
+            self.matching_started = True
+            return self.router.create_orders(order_creates, order_ids)
+        
+        errors = self.validate_orders(order_creates)
+        results: List[Union[Tuple[Order, List[Dict]], Exception]] = [
+            ValueError(error) if error else None for error in errors
+        ]
+        
+        accepted = [i for i, error in enumerate(errors) if error is None]
+        if not accepted:
+            return results
+        
+        rows = []
+        for i in list(accepted):
+            order_create = order_creates[i]
+            order_id = order_ids[i] if order_ids else str(uuid.uuid4())
+            units = self._order_units(order_create)
+            risk_error = self._reserve_risk(order_id, order_create, units)
+            if risk_error:
+                results[i] = ValueError(risk_error)
+                accepted.remove(i)
+                continue
+            rows.append({
+                "order_id": order_id,
+                "trader_id": order_create.trader_id,
+                "symbol": order_create.symbol,
+                "side": order_create.side,
+                "order_type": order_create.order_type,
+                "quantity": order_create.quantity,
+                "price": order_create.price,
+                "status": OrderStatus.ACTIVE,  # Will be updated by matching engine
+                "filled_quantity": 0,
+                **units
+            })
+        if not rows:
+            return results
+        
+        # Insert the whole batch before matching so makers from earlier in the batch exist
+        try:
+            db_orders = self.db.scalars(
+                insert(OrderModel).returning(OrderModel, sort_by_parameter_order=True),
+                rows
+            ).all()
+        except Exception:
+            for row in rows:
+                self._release_risk(row["order_id"])
+            raise
+        
+        persister = self.matching_engine.persister
+        if persister:
+            # Write-behind updates run in another session and need the rows committed first;
+            # keep the returned rows loaded instead of reloading each one after the commit
+            expire_on_commit = self.db.expire_on_commit
+            self.db.expire_on_commit = False
+            try:
+                self.db.commit()
+            finally:
+                self.db.expire_on_commit = expire_on_commit
+        
+        self.matching_started = True
+        for i, db_order in zip(accepted, db_orders):
+            trades = self.matching_engine.process_order(db_order, self.db, commit=False)
+            self._update_risk(db_order, trades)
+            results[i] = (self._to_order(db_order), trades)
+        
+        # One candle write per symbol for the whole batch
+        self.matching_engine.flush_market_data()
+        
+        if persister is None:
+            self.db.commit()
+        else:
+            # The persister owns the writes; drop the session's unflushed copies
+            self.db.expire_all()
+        return results
+    
+    def _record_stage(self, symbol: str, stage: str, nanoseconds: int):
+        if self.metrics:
+            self.metrics.record(symbol, stage, nanoseconds)
+    
+    @staticmethod
+    def _order_units(order_create: OrderCreate) -> Dict:
+        """Integer columns of a validated order: price in ticks and quantities in lots"""
+        spec = get_symbol_spec(order_create.symbol)
+        return {
+            "price_ticks": spec.to_ticks(order_create.price) if order_create.price is not None else None,
+            "quantity_lots": spec.to_lots(order_create.quantity),
+            "filled_lots": 0
+        }
+    
+    def _reserve_risk(self, order_id: str, order_create: OrderCreate, units: Dict) -> Optional[str]:
+        """Run the pre-trade risk checks and book the order; returns the reason for rejecting it"""
+        if self.risk is None:
+            return None
+        return self.risk.reserve(order_id, order_create.trader_id, order_create.symbol, order_create.side,
+                                 units["price_ticks"], units["quantity_lots"],
+                                 lambda: self._opposite_best_ticks(order_create))
+    
+    def _opposite_best_ticks(self, order_create: OrderCreate) -> Optional[int]:
+        """Best price (ticks) on the side of the book an order would trade against"""
+        order_book = self.matching_engine.get_order_book(order_create.symbol)
+        if order_create.side == OrderSide.BUY:
+            return order_book.get_best_ask()[1]
+        return order_book.get_best_bid()[1]
+    
+    def _release_risk(self, order_id: str):
+        if self.risk is not None:
+            self.risk.release(order_id)
+    
+    def _update_risk(self, db_order: OrderModel, trades: List[Dict]):
+        """Apply an order's trades to the risk view, and release a remainder that will not rest"""
+        if self.risk is None:
+            return
+        if trades:
+            self.risk.on_trades(trades)
+        if db_order.status not in (OrderStatus.ACTIVE, OrderStatus.PARTIALLY_FILLED):
+            self.risk.release(db_order.order_id)
+    
+    def _to_order(self, db_order: OrderModel) -> Order:
+        """Build the API model for an order"""
+        return Order(
+            order_id=db_order.order_id,
+            trader_id=db_order.trader_id,
+            symbol=db_order.symbol,
+            side=db_order.side,
+            order_type=db_order.order_type,
+            quantity=db_order.quantity,
+            price=db_order.price,
+            status=db_order.status,
+            filled_quantity=db_order.filled_quantity,
+            created_at=db_order.created_at,
+            updated_at=db_order.updated_at
+        )
+    
     def validate_order(self, order_create: OrderCreate) -> Tuple[bool, str]:
         """Validate an order before creating it"""
         # Check for required fields based on order type
@@ -83,10 +268,31 @@ class OrderService:
         if order_create.order_type == OrderType.LIMIT and order_create.price <= 0:
             return False, "Limit order price must be positive"
         
+        # Prices and quantities must sit on the symbol's tick and lot grid
+        try:
+            self._order_units(order_create)
+        except ValueError as e:
+            return False, str(e)
+        
         # Add more validation as needed
         
         return True, "Order is valid"
     
+    def validate_orders(self, order_creates: List[OrderCreate]) -> List[Optional[str]]:
+        """
+        Validate a whole batch up front, before anything is written.
+        Returns one error message per order, or None for valid orders.
+        """
+        if len(order_creates) > MAX_ORDER_BATCH_SIZE:
+            return [f"Batch exceeds {MAX_ORDER_BATCH_SIZE} orders"] * len(order_creates)
+        
+        errors: List[Optional[str]] = []
+        for order_create in order_creates:
+            is_valid, error_message = self.validate_order(order_create)
+            errors.append(None if is_valid else error_message)
+        
+        return errors
+    
     def get_order(self, order_id: str) -> Optional[Order]:
         """Get an order by ID"""
         db_order = self.db.query(OrderModel).filter(OrderModel.order_id == order_id).first()
@@ -135,39 +341,97 @@ class OrderService:
         return orders
     
     def cancel_order(self, order_id: str) -> Optional[Order]:
-        """Cancel an order"""
-        db_order = self.db.query(OrderModel).filter(OrderModel.order_id == order_id).first()
-        if not db_order:
+        """
+        Cancel a resting order.
+        The order is found through the order index and taken off the book without reading
+        the database; returns None if it is not resting (unknown, filled or already cancelled).
+        """
+        if self.router:
+            return self.router.cancel_order(order_id)
+        
+        symbol = self.matching_engine.locate_order(order_id)
+        if symbol is None:
             return None
         
-        # Only active or partially filled orders can be cancelled
-        if db_order.status not in [OrderStatus.ACTIVE, OrderStatus.PARTIALLY_FILLED]:
+        cancelled = self._cancel_resting(symbol, [order_id])
+        if not cancelled:
             return None
+        return self._cancelled_order(cancelled[0])
+    
+    def cancel_orders(self, trader_id: Optional[str] = None, symbol: Optional[str] = None) -> List[Order]:
+        """
+        Mass cancel: every resting order of a trader (optionally on one symbol), or of a symbol.
+        Each book is cleared in one scripted call; the status updates are written behind.
+        """
+        if trader_id is None and symbol is None:
+            raise ValueError("A trader_id or a symbol is required")
+        if self.router:
+            return self.router.cancel_orders(trader_id, symbol)
         
-        # Update order status
-        db_order.status = OrderStatus.CANCELLED
-        self.db.commit()
-        self.db.refresh(db_order)
+        if trader_id is not None:
+            order_ids_by_symbol = self.matching_engine.trader_open_orders(trader_id, symbol)
+        else:
+            order_ids_by_symbol = {symbol: self.matching_engine.get_order_book(symbol).open_order_ids()}
         
-        # Remove from order book
-        order_book = OrderBook(self.redis, db_order.symbol)
-        order_book.remove_order(order_id)
+        cancelled = []
+        for book_symbol, order_ids in order_ids_by_symbol.items():
+            cancelled.extend(self._cancel_resting(book_symbol, order_ids, trader_id))
+        return [self._cancelled_order(order_details) for order_details in cancelled]
+    
+    def _cancel_resting(self, symbol: str, order_ids: List[str], trader_id: Optional[str] = None) -> List[Dict]:
+        """Take resting orders off a book, record them as cancelled and release their risk"""
+        cancelled = self.matching_engine.cancel_orders(symbol, order_ids, trader_id)
+        if not cancelled:
+            return cancelled
         
+        persister = self.matching_engine.persister
+        if persister:
+            spec = get_symbol_spec(symbol)
+            for order_details in cancelled:
+                persister.record_order_state(order_details["order_id"], spec.quantity(order_details["filled_lots"]),
+                                             OrderStatus.CANCELLED, order_details["filled_lots"])
+        else:
+            # Fills are already written through; only the status changes
+            self.db.execute(
+                update(OrderModel)
+                .where(OrderModel.order_id.in_([order_details["order_id"] for order_details in cancelled]))
+                .values(status=OrderStatus.CANCELLED)
+            )
+            self.db.commit()
+        
+        for order_details in cancelled:
+            self._release_risk(order_details["order_id"])
+        return cancelled
+    
+    @staticmethod
+    def _cancelled_order(order_details: Dict) -> Order:
+        """Build the API model of a cancelled order from its book details (created_at is its arrival on the book)"""
+        spec = get_symbol_spec(order_details["symbol"])
+        price_ticks = order_details.get("price_ticks")
         return Order(
-            order_id=db_order.order_id,
-            trader_id=db_order.trader_id,
-            symbol=db_order.symbol,
-            side=db_order.side,
-            order_type=db_order.order_type,
-            quantity=db_order.quantity,
-            price=db_order.price,
-            status=db_order.status,
-            filled_quantity=db_order.filled_quantity,
-            created_at=db_order.created_at,
-            updated_at=db_order.updated_at
+            order_id=order_details["order_id"],
+            trader_id=order_details["trader_id"],
+            symbol=order_details["symbol"],
+            side=order_details["side"],
+            order_type=order_details["order_type"],
+            quantity=spec.quantity(order_details["quantity_lots"]),
+            price=spec.price(price_ticks) if price_ticks is not None else None,
+            status=OrderStatus.CANCELLED,
+            filled_quantity=spec.quantity(order_details["filled_lots"]),
+            created_at=datetime.fromtimestamp(order_details["created_at"], timezone.utc),
+            updated_at=datetime.now(timezone.utc)
         )
     
     def get_order_book(self, symbol: str, depth: int = 10) -> Dict:
-        """Get the current state of the order book for a symbol"""
-        order_book = OrderBook(self.redis, symbol)
+        """Get the aggregated price levels (L2) of the order book for a symbol"""
+        if self.router:
+            return self.router.get_order_book(symbol, depth)
+        order_book = self.matching_engine.get_order_book(symbol)
+        return order_book.get_depth_snapshot(depth)
+    
+    def get_order_book_orders(self, symbol: str, depth: int = 10) -> Dict:
+        """Get the individual resting orders (L3) at the top of the order book for a symbol"""
+        if self.router:
+            return self.router.get_order_book_orders(symbol, depth)
+        order_book = self.matching_engine.get_order_book(symbol)
         return order_book.get_order_book_snapshot(depth)
\ No newline at end of file
@@ -0,0 +1,268 @@
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import BigInteger, Float, String, cast, column, func, insert, update, values
+from app.config import (
+    WRITE_BEHIND_ENABLED, WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_DEAD_LETTER_DIR, WRITE_BEHIND_FLUSH_INTERVAL,
+    WRITE_BEHIND_MAX_PENDING, WRITE_BEHIND_MAX_RETRIES, WRITE_BEHIND_REPLAY_INTERVAL
+)
+from app.models.order import OrderModel, OrderStatus
+from app.models.trade import TradeModel
+
+class WriteBehindPersister:
+    """
+    Takes trade and order-state events off the matching path and writes them to Postgres
+    in batches from a background thread.
+    - A batch is flushed when it reaches batch_size events or flush_interval seconds
+    - Trades are written with one multi-row INSERT, order states with one UPDATE ... FROM (VALUES ...)
+    - Order states are coalesced per order, so only the latest state of each order is written
+    - The pending queue is bounded; producers block when it is full (backpressure)
+    - A batch still failing after max_retries is appended to a dead letter file rather than
+      dropped, since its trades have already executed. Later batches are appended behind it, so
+      order states are never written out of order, and the file is replayed in order every
+      replay_interval seconds (and at start) until Postgres takes it
+    """
+
+    def __init__(self, session_factory: Callable = None,
+                 batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL,
+                 max_pending: int = WRITE_BEHIND_MAX_PENDING,
+                 max_retries: int = WRITE_BEHIND_MAX_RETRIES,
+                 dead_letter_path: str = None,
+                 replay_interval: float = WRITE_BEHIND_REPLAY_INTERVAL):
+        if session_factory is None:
+            from app.db.postgres import SessionLocal
+            session_factory = SessionLocal
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.dead_letter_path = dead_letter_path or os.path.join(WRITE_BEHIND_DEAD_LETTER_DIR, "write_behind.jsonl")
+        self.replay_interval = replay_interval
+        # Batches appended to the dead letter file
+        self.dead_lettered = 0
+        self._next_replay = 0.0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="write-behind-persister", daemon=True)
+        self._thread.start()
+
+    def record_trade(self, trade: Dict):
+        """Queue a trade for insertion"""
+        self._queue.put(("trade", {
+            "trade_id": trade["trade_id"],
+            "buy_order_id": trade["buy_order_id"],
+            "sell_order_id": trade["sell_order_id"],
+            "symbol": trade["symbol"],
+            "quantity": trade["quantity"],
+            "price": trade["price"],
+            "quantity_lots": trade.get("quantity_lots"),
+            "price_ticks": trade.get("price_ticks"),
+            "executed_at": trade["executed_at"]
+        }))
+
+    def record_order_state(self, order_id: str, filled_quantity: float, status, filled_lots: int):
+        """Queue the latest fill state of an order"""
+        self._queue.put(("order", {
+            "order_id": order_id,
+            "filled_quantity": filled_quantity,
+            "filled_lots": filled_lots,
+            # The orders.status column stores enum names
+            "status": OrderStatus(status).name
+        }))
+
+    def pending(self) -> int:
+        """Number of events waiting to be written"""
+        return self._queue.qsize()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every event queued so far has been written"""
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        return done.wait(timeout)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Write what is pending and stop the background thread"""
+        self.flush(timeout)
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    def _collect(self) -> List[Tuple[str, object]]:
+        """Wait for events until the batch is full or the flush interval has passed"""
+        try:
+            events = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(events) < self.batch_size and events[-1][0] != "flush":
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                events.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return events
+
+    def _run(self):
+        while not self._stopping.is_set():
+            events = self._collect()
+            if not events:
+                if os.path.exists(self.dead_letter_path):
+                    self._replay_dead_letters()
+                continue
+
+            trades = [payload for kind, payload in events if kind == "trade"]
+            order_states: Dict[str, Dict] = {}
+            for kind, payload in events:
+                if kind == "order":
+                    order_states[payload["order_id"]] = payload
+
+            self._write_with_retry(trades, list(order_states.values()))
+
+            for kind, payload in events:
+                if kind == "flush":
+                    payload.set()
+
+    def _write_with_retry(self, trades: List[Dict], order_states: List[Dict]):
+        if not trades and not order_states:
+            return
+
+        # Batches behind dead-lettered ones wait their turn
+        if os.path.exists(self.dead_letter_path) and not self._replay_dead_letters():
+            self._dead_letter(trades, order_states)
+            return
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._write(trades, order_states)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"Write-behind persister dead-lettered {len(trades)} trades and "
+                          f"{len(order_states)} order updates to {self.dead_letter_path}: {str(e)}")
+                    self._dead_letter(trades, order_states)
+                    self._next_replay = time.monotonic() + self.replay_interval
+                    return
+                time.sleep(min(0.05 * (2 ** attempt), 2.0))
+
+    def _dead_letter(self, trades: List[Dict], order_states: List[Dict]):
+        """Append a batch to the dead letter file"""
+        try:
+            os.makedirs(os.path.dirname(self.dead_letter_path) or ".", exist_ok=True)
+            with open(self.dead_letter_path, "a") as dead_letters:
+                dead_letters.write(json.dumps({"trades": trades, "order_states": order_states}, default=_json_default) + "\n")
+                dead_letters.flush()
+                os.fsync(dead_letters.fileno())
+            self.dead_lettered += 1
+        except OSError as e:
+            print(f"Write-behind persister dropped {len(trades)} trades and "
+                  f"{len(order_states)} order updates it could not dead-letter: {str(e)}")
+
+    def _replay_dead_letters(self) -> bool:
+        """
+        Write the dead-lettered batches in order, at most every replay_interval seconds.
+        Returns True once the file is empty; batches from the first failing one on are kept.
+        """
+        if time.monotonic() < self._next_replay:
+            return False
+        try:
+            with open(self.dead_letter_path) as dead_letters:
+                lines = [line for line in dead_letters if line.strip()]
+        except FileNotFoundError:
+            return True
+
+        for i, line in enumerate(lines):
+            batch = json.loads(line)
+            for trade in batch["trades"]:
+                trade["executed_at"] = datetime.fromisoformat(trade["executed_at"])
+            try:
+                self._write(batch["trades"], batch["order_states"])
+            except Exception as e:
+                print(f"Write-behind persister could not replay {len(lines) - i} dead-lettered batches: {str(e)}")
+                self._next_replay = time.monotonic() + self.replay_interval
+                self._rewrite_dead_letters(lines[i:])
+                return False
+        os.remove(self.dead_letter_path)
+        print(f"Write-behind persister replayed {len(lines)} dead-lettered batches")
+        return True
+
+    def _rewrite_dead_letters(self, lines: List[str]):
+        temporary_path = f"{self.dead_letter_path}.tmp"
+        with open(temporary_path, "w") as dead_letters:
+            dead_letters.writelines(lines)
+            dead_letters.flush()
+            os.fsync(dead_letters.fileno())
+        os.replace(temporary_path, self.dead_letter_path)
+
+    def _write(self, trades: List[Dict], order_states: List[Dict]):
+        db = self.session_factory()
+        try:
+            if trades:
+                db.execute(insert(TradeModel.__table__).values(trades))
+
+            if order_states:
+                new_states = values(
+                    column("order_id", String),
+                    column("filled_quantity", Float),
+                    column("filled_lots", BigInteger),
+                    column("status", String),
+                    name="new_states"
+                ).data([(s["order_id"], s["filled_quantity"], s["filled_lots"], s["status"]) for s in order_states])
+
+                orders = OrderModel.__table__
+                db.execute(
+                    update(orders)
+                    .where(orders.c.order_id == new_states.c.order_id)
+                    .values(
+                        filled_quantity=new_states.c.filled_quantity,
+                        filled_lots=new_states.c.filled_lots,
+                        status=cast(new_states.c.status, orders.c.status.type),
+                        updated_at=func.now()
+                    )
+                )
+
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+_persister: Optional[WriteBehindPersister] = None
+_persister_lock = threading.Lock()
+# Dead letter file of this process's persister (None: the default one)
+_dead_letter_path: Optional[str] = None
+
+def set_dead_letter_path(path: str):
+    """Give this process's persister a dead letter file of its own (one per shard worker)"""
+    global _dead_letter_path
+    _dead_letter_path = path
+
+def get_persister() -> Optional[WriteBehindPersister]:
+    """Get the process-wide write-behind persister, or None when it is disabled"""
+    global _persister
+    if not WRITE_BEHIND_ENABLED:
+        return None
+    if _persister is None:
+        with _persister_lock:
+            if _persister is None:
+                _persister = WriteBehindPersister(dead_letter_path=_dead_letter_path)
+    return _persister
+
+def stop_persister(timeout: Optional[float] = None):
+    """Flush pending writes and stop the persister"""
+    global _persister
+    if _persister is not None:
+        _persister.stop(timeout)
+        _persister = None
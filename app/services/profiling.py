@@ -0,0 +1,215 @@
+"""
+Per-request cost accounting and on-demand request profiling.
+
+RequestProfilingMiddleware gives each HTTP request a RequestStats in a context variable. The
+instrumented Redis client (app/db/redis_client.py) and the SQLAlchemy engine hooks
+(app/db/postgres.py) add every Redis round trip and SQL statement to it, with their time.
+Worker threads started through run_in_threadpool see the same context, so the work done for a
+request is charged to it. Work done elsewhere is not: sequencer tasks, the write-behind
+persister and mirror threads are not charged. Every response gets a Server-Timing header with
+the totals.
+
+With PROFILING_ENABLED, a request sent with the X-Profile header, or one of the next requests
+armed through POST /api/v1/admin/profiling, is also sampled. A SamplingProfiler thread reads the
+stacks of the threads that worked on the request every PROFILING_INTERVAL seconds. The report
+is kept in a short history and its id is returned in the X-Profile-Id header.
+"""
+import contextvars
+import itertools
+import selectors
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+from app.config import PROFILING_ENABLED, PROFILING_HEADER, PROFILING_HISTORY, PROFILING_INTERVAL
+
+class RequestStats:
+    """Redis and SQL calls made for one request, and the threads they were made from"""
+
+    def __init__(self):
+        self.redis_calls = 0
+        self.redis_commands = 0
+        self.redis_time = 0
+        self.sql_statements = 0
+        self.sql_time = 0
+        self.threads = set()
+
+    def record_redis(self, commands: int, nanoseconds: int):
+        self.redis_calls += 1
+        self.redis_commands += commands
+        self.redis_time += nanoseconds
+        self.threads.add(threading.get_ident())
+
+    def record_sql(self, nanoseconds: int):
+        self.sql_statements += 1
+        self.sql_time += nanoseconds
+        self.threads.add(threading.get_ident())
+
+    def summary(self) -> Dict:
+        return {"redis": {"calls": self.redis_calls, "commands": self.redis_commands,
+                          "time_ms": round(self.redis_time / 1e6, 3)},
+                "sql": {"statements": self.sql_statements, "time_ms": round(self.sql_time / 1e6, 3)}}
+
+    def server_timing(self) -> str:
+        return (f'redis;dur={self.redis_time / 1e6:.3f};desc="{self.redis_calls} calls", '
+                f'sql;dur={self.sql_time / 1e6:.3f};desc="{self.sql_statements} statements"')
+
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats",
+                                                                                         default=None)
+
+def current_request_stats() -> Optional[RequestStats]:
+    """Accounting of the request being served in this context, if any"""
+    return _request_stats.get()
+
+class SamplingProfiler(threading.Thread):
+    """Samples the stacks of a set of threads at a fixed interval until stopped"""
+
+    def __init__(self, threads: set, interval: float = PROFILING_INTERVAL, max_depth: int = 64):
+        super().__init__(name="request-profiler", daemon=True)
+        self.threads = threads
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_filename}:{code.co_firstlineno}:{code.co_name}"
+
+    def run(self):
+        own = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in list(self.threads):
+                frame = frames.get(ident) if ident != own else None
+                # Skip threads that are gone, and the event loop while it waits for I/O
+                if frame is None or frame.f_code.co_filename == selectors.__file__:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(self._frame_name(frame))
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+                self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def report(self, top: int = 25) -> Dict:
+        """Hottest functions by own and inclusive samples, and the hottest stacks (root first)"""
+        own, inclusive = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for name in set(stack):
+                inclusive[name] += count
+        return {
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "self": [{"function": name, "samples": count} for name, count in own.most_common(top)],
+            "total": [{"function": name, "samples": count} for name, count in inclusive.most_common(top)],
+            "stacks": [{"stack": ";".join(stack), "samples": count} for stack, count in self.stacks.most_common(top)],
+        }
+
+class ProfileStore:
+    """Requests armed for profiling through the admin toggle, and the latest reports"""
+
+    def __init__(self, history: int = PROFILING_HISTORY):
+        self._lock = threading.Lock()
+        self._armed = 0
+        self._ids = itertools.count(1)
+        self._reports: "OrderedDict[int, Dict]" = OrderedDict()
+        self.history = history
+
+    def arm(self, requests: int) -> int:
+        """Profile the next requests; returns how many are armed"""
+        with self._lock:
+            self._armed = max(0, requests)
+            return self._armed
+
+    def take_armed(self) -> bool:
+        with self._lock:
+            if self._armed <= 0:
+                return False
+            self._armed -= 1
+            return True
+
+    def add(self, report: Dict) -> int:
+        with self._lock:
+            profile_id = next(self._ids)
+            report["id"] = profile_id
+            self._reports[profile_id] = report
+            while len(self._reports) > self.history:
+                self._reports.popitem(last=False)
+            return profile_id
+
+    def get(self, profile_id: int) -> Optional[Dict]:
+        with self._lock:
+            return self._reports.get(profile_id)
+
+    def list(self) -> List[Dict]:
+        """Summaries of the stored reports, newest first"""
+        with self._lock:
+            return [{key: report[key] for key in ("id", "method", "path", "status", "duration_ms")}
+                    for report in reversed(self._reports.values())]
+
+profile_store = ProfileStore()
+
+class RequestProfilingMiddleware:
+    """ASGI middleware accounting Redis and SQL calls per HTTP request, and profiling on demand"""
+
+    def __init__(self, app):
+        self.app = app
+        self.header = PROFILING_HEADER.lower().encode()
+
+    def _wants_profile(self, scope) -> bool:
+        if not PROFILING_ENABLED:
+            return False
+        if any(name == self.header and value not in (b"", b"0", b"false") for name, value in scope["headers"]):
+            return True
+        return profile_store.take_armed()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        profiler = SamplingProfiler(stats.threads) if self._wants_profile(scope) else None
+        if profiler:
+            # The event loop thread runs the async parts of the request
+            stats.threads.add(threading.get_ident())
+            profiler.start()
+        started = time.perf_counter_ns()
+        status = {"code": None}
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + \
+                    [(b"server-timing", stats.server_timing().encode())]
+                if profiler:
+                    profile_id = self._finish_profile(profiler, scope, stats, status["code"], started)
+                    message["headers"].append((b"x-profile-id", str(profile_id).encode()))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _request_stats.reset(token)
+            if profiler and profiler.is_alive():
+                # The response never started (e.g. the app raised); keep what was sampled
+                self._finish_profile(profiler, scope, stats, status["code"], started)
+
+    @staticmethod
+    def _finish_profile(profiler: SamplingProfiler, scope, stats: RequestStats, status, started: int) -> int:
+        profiler.stop()
+        report = {"method": scope["method"], "path": scope["path"], "status": status,
+                  "duration_ms": round((time.perf_counter_ns() - started) / 1e6, 3)}
+        report.update(stats.summary())
+        report["profile"] = profiler.report()
+        return profile_store.add(report)
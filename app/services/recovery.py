@@ -0,0 +1,281 @@
+"""
+Order book recovery: periodic snapshot files of every book, and a warm restart that rebuilds
+books missing from Redis from the latest snapshot plus the orders changed in Postgres since.
+
+The snapshot is a flat big-endian file read through mmap, so loading it is one sequential scan:
+    header  8s magic | H version | d taken at (epoch seconds) | I symbol count
+    symbol  H length | symbol (utf-8) | I order count, followed by its orders
+    order   B length | order id (utf-8) | H length | details (order_codec binary encoding)
+    trailer I crc32 of everything before it
+Details are stored in the same encoding as the Redis details hash and written back as they are.
+Recovery time is bounded by the snapshot scan plus the orders changed within one snapshot interval.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import select
+from app.config import (
+    ORDER_BOOK_BACKEND, RECOVERY_REPLAY_CHUNK_SIZE, RECOVERY_REPLAY_MARGIN, RECOVERY_SNAPSHOT_INTERVAL,
+    RECOVERY_SNAPSHOT_PATH
+)
+from app.db.redis_client import get_redis
+from app.models.order import OrderModel, OrderStatus, OrderType
+from app.models.order_book import OrderBook, build_order_details, order_units, remaining_lots
+from app.models.order_codec import ORDER_CODEC_VERSION, decode_order_details, encode_order_details
+
+SNAPSHOT_MAGIC = b"OBSNAPSH"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct(">8sHdI")
+SYMBOL_HEADER = struct.Struct(">H")
+ORDER_COUNT = struct.Struct(">I")
+ID_LENGTH = struct.Struct(">B")
+DETAILS_LENGTH = struct.Struct(">H")
+CHECKSUM = struct.Struct(">I")
+
+# Symbol -> order id -> stored details (order_codec binary)
+BookOrders = Dict[str, Dict[str, bytes]]
+
+OPEN_STATUSES = (OrderStatus.ACTIVE, OrderStatus.PARTIALLY_FILLED)
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+def _binary(order_id: str, symbol: str, order_data: bytes) -> bytes:
+    """Stored details in the binary encoding (JSON and older versions are re-encoded)"""
+    if order_data[:1] == bytes([ORDER_CODEC_VERSION]):
+        return bytes(order_data)
+    return encode_order_details(decode_order_details(order_id, symbol, order_data), codec="binary")
+
+def collect_books(redis_client, backend: str = None) -> BookOrders:
+    """
+    Stored details of every resting order: from the loaded in-memory books when that backend
+    is used, and from the Redis details hashes for every other symbol
+    """
+    books: BookOrders = {}
+    if (backend or ORDER_BOOK_BACKEND) == "memory":
+        from app.models.memory_order_book import loaded_memory_books
+        for symbol, book in loaded_memory_books().items():
+            with book.lock:
+                orders = [dict(order_details) for order_details in book.orders.values()]
+            books[symbol] = {
+                order_details["order_id"]: encode_order_details(order_details, codec="binary")
+                for order_details in orders
+            }
+
+    for key in redis_client.scan_iter(match="orderbook:*:details"):
+        symbol = _text(key)[len("orderbook:"):-len(":details")]
+        if symbol in books:
+            continue
+        books[symbol] = {
+            _text(order_id): _binary(_text(order_id), symbol, order_data)
+            for order_id, order_data in redis_client.hgetall(key).items()
+        }
+    return books
+
+def write_snapshot(path: str, books: BookOrders, taken_at: float) -> int:
+    """Write books to a snapshot file, replacing any previous one atomically; returns the file size"""
+    parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, taken_at, len(books))]
+    for symbol, orders in books.items():
+        encoded_symbol = symbol.encode()
+        parts.append(SYMBOL_HEADER.pack(len(encoded_symbol)) + encoded_symbol + ORDER_COUNT.pack(len(orders)))
+        for order_id, order_data in orders.items():
+            encoded_id = order_id.encode()
+            parts.append(ID_LENGTH.pack(len(encoded_id)) + encoded_id + DETAILS_LENGTH.pack(len(order_data)))
+            parts.append(order_data)
+    body = b"".join(parts)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(body)
+        f.write(CHECKSUM.pack(zlib.crc32(body)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return len(body) + CHECKSUM.size
+
+def read_snapshot(path: str) -> Tuple[Optional[float], BookOrders]:
+    """Read a snapshot file through mmap; returns (taken at, books), or (None, {}) if there is none"""
+    if not os.path.exists(path) or os.path.getsize(path) < SNAPSHOT_HEADER.size + CHECKSUM.size:
+        return None, {}
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        end = len(data) - CHECKSUM.size
+        with memoryview(data) as view:
+            valid = zlib.crc32(view[:end]) == CHECKSUM.unpack_from(data, end)[0]
+        if not valid:
+            raise ValueError(f"Snapshot {path} is corrupt (checksum mismatch)")
+
+        magic, version, taken_at, symbol_count = SNAPSHOT_HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot file {path}")
+
+        books: BookOrders = {}
+        offset = SNAPSHOT_HEADER.size
+        for _ in range(symbol_count):
+            (length,) = SYMBOL_HEADER.unpack_from(data, offset)
+            offset += SYMBOL_HEADER.size
+            symbol = data[offset:offset + length].decode()
+            offset += length
+            (count,) = ORDER_COUNT.unpack_from(data, offset)
+            offset += ORDER_COUNT.size
+
+            orders = books.setdefault(symbol, {})
+            for _ in range(count):
+                length = data[offset]
+                order_id = data[offset + 1:offset + 1 + length].decode()
+                offset += 1 + length
+                (length,) = DETAILS_LENGTH.unpack_from(data, offset)
+                offset += DETAILS_LENGTH.size
+                orders[order_id] = data[offset:offset + length]
+                offset += length
+    return taken_at, books
+
+def changed_orders(db, since: Optional[datetime],
+                   chunk_size: int = RECOVERY_REPLAY_CHUNK_SIZE) -> Iterable[OrderModel]:
+    """
+    Stream orders changed since a time (every open order when there is none) in update order,
+    chunk_size rows at a time through a server-side cursor
+    """
+    query = select(OrderModel)
+    if since is not None:
+        query = query.where(OrderModel.updated_at >= since).order_by(OrderModel.updated_at, OrderModel.id)
+    else:
+        query = query.where(OrderModel.status.in_(OPEN_STATUSES)).order_by(OrderModel.id)
+    yield from db.scalars(query.execution_options(yield_per=chunk_size))
+
+def apply_order_changes(books: Dict[str, Dict[str, Dict]], orders: Iterable[OrderModel],
+                        after: Optional[float] = None) -> int:
+    """
+    Bring decoded books in line with the database state of changed orders: open limit orders
+    rest with their filled quantity (keeping their time priority if already resting), all others
+    are removed. Orders not resting yet queue in database insert order, behind every order
+    already resting and no earlier than after (the snapshot time). Returns the number applied.
+    """
+    # Arrival times in microseconds, as in order_member
+    latest = max([int((after or 0) * 1e6)] + [int(order_details["created_at"] * 1e6)
+                                              for book in books.values() for order_details in book.values()])
+    applied = 0
+    # (arrival in microseconds, row id, details) of orders not resting before
+    arrivals: List[Tuple[int, int, Dict]] = []
+    for order in orders:
+        applied += 1
+        book = books.setdefault(order.symbol, {})
+        price_ticks, quantity_lots, filled_lots = order_units(order)
+        if order.status not in OPEN_STATUSES or order.order_type != OrderType.LIMIT \
+                or quantity_lots - filled_lots <= 0:
+            book.pop(order.order_id, None)
+            continue
+
+        order_details = book.get(order.order_id)
+        if order_details is None:
+            created_at = order.created_at
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            order_details = build_order_details(order)
+            arrivals.append((int(created_at.timestamp() * 1e6), order.id, order_details))
+            book[order.order_id] = order_details
+        order_details.update(price_ticks=price_ticks, quantity_lots=quantity_lots, filled_lots=filled_lots,
+                             status=OrderStatus(order.status).value)
+
+    # Database timestamps can be coarser than book arrival times; keep new arrivals strictly increasing
+    for arrival, _, order_details in sorted(arrivals, key=lambda entry: entry[:2]):
+        latest = max(arrival, latest + 1)
+        # Half a microsecond in, so order_member truncates back to the same microsecond
+        order_details["created_at"] = (latest + 0.5) / 1e6
+    return applied
+
+def recover_order_books(db, redis_client=None, path: str = RECOVERY_SNAPSHOT_PATH, force: bool = False,
+                        margin: float = RECOVERY_REPLAY_MARGIN,
+                        chunk_size: int = RECOVERY_REPLAY_CHUNK_SIZE) -> Dict[str, int]:
+    """
+    Rebuild order books from the snapshot file plus the orders changed in Postgres since it was
+    taken (from margin seconds before, to cover clock skew). Without a snapshot every open order
+    is replayed. Only books missing from Redis are written unless force is set.
+    Returns the number of resting orders loaded per recovered symbol.
+    """
+    redis_client = redis_client if redis_client else get_redis()
+    taken_at, snapshot = read_snapshot(path)
+
+    books: Dict[str, Dict[str, Dict]] = {
+        symbol: {order_id: decode_order_details(order_id, symbol, order_data)
+                 for order_id, order_data in orders.items()}
+        for symbol, orders in snapshot.items()
+    }
+    since = datetime.fromtimestamp(taken_at - margin, timezone.utc) if taken_at is not None else None
+    apply_order_changes(books, changed_orders(db, since, chunk_size), after=taken_at)
+
+    recovered = {}
+    for symbol, orders in books.items():
+        order_book = OrderBook(redis_client, symbol)
+        if not force and redis_client.exists(order_book.order_details_key):
+            continue
+        resting = [order_details for order_details in orders.values() if remaining_lots(order_details) > 0]
+        order_book.load_orders(resting)
+        recovered[symbol] = len(resting)
+    return recovered
+
+class BookSnapshotter:
+    """Writes a snapshot of every order book to a file at a fixed interval from a background thread"""
+
+    def __init__(self, redis_client=None, path: str = RECOVERY_SNAPSHOT_PATH,
+                 interval: float = RECOVERY_SNAPSHOT_INTERVAL):
+        self.redis = redis_client if redis_client else get_redis()
+        self.path = path
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="orderbook-snapshot", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop snapshotting and write a final snapshot"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.snapshot()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.snapshot()
+
+    def snapshot(self) -> Optional[Dict]:
+        """Write a snapshot now; returns its summary, or None if it failed"""
+        try:
+            # Taken before reading, so orders changing during the read are replayed from the database
+            taken_at = time.time()
+            books = collect_books(self.redis)
+            size = write_snapshot(self.path, books, taken_at)
+            return {"symbols": len(books), "orders": sum(len(orders) for orders in books.values()),
+                    "bytes": size, "taken_at": taken_at}
+        except Exception as e:
+            print(f"Order book snapshot error: {str(e)}")
+            return None
+
+_snapshotter: Optional[BookSnapshotter] = None
+
+def start_book_snapshotter() -> BookSnapshotter:
+    """Start the process-wide snapshotter"""
+    global _snapshotter
+    if _snapshotter is None:
+        _snapshotter = BookSnapshotter()
+        _snapshotter.start()
+    return _snapshotter
+
+def stop_book_snapshotter(timeout: Optional[float] = None):
+    """Stop the snapshotter, writing a final snapshot"""
+    global _snapshotter
+    if _snapshotter is not None:
+        _snapshotter.stop(timeout)
+        _snapshotter = None
@@ -0,0 +1,319 @@
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import func, select
+from app.config import (
+    RISK_CHECKS_ENABLED, RISK_MAX_OPEN_EXPOSURE, RISK_MAX_POSITION, RISK_TRADER_LIMITS,
+    RISK_RECONCILE_INTERVAL
+)
+from app.models.instrument import get_symbol_spec
+from app.models.order import OrderModel, OrderSide, OrderStatus
+from app.models.trade import TradeModel
+
+class OpenOrder:
+    """Open quantity of one order as seen by the risk cache"""
+
+    __slots__ = ("trader_id", "symbol", "is_buy", "price", "open_lots")
+
+    def __init__(self, trader_id: str, symbol: str, is_buy: bool, price: float, open_lots: int):
+        self.trader_id = trader_id
+        self.symbol = symbol
+        self.is_buy = is_buy
+        # Price used for exposure: the limit price, or a reference price for market orders
+        self.price = price
+        self.open_lots = open_lots
+
+class TraderRisk:
+    """Open exposure and per-symbol positions and open lots of one trader"""
+
+    __slots__ = ("open_notional", "positions", "open_buys", "open_sells")
+
+    def __init__(self):
+        self.open_notional = 0.0
+        # symbol -> lots (signed for positions)
+        self.positions: Dict[str, int] = {}
+        self.open_buys: Dict[str, int] = {}
+        self.open_sells: Dict[str, int] = {}
+
+class RiskCache:
+    """
+    Pre-trade risk checks against an in-memory, per-trader view of open exposure and positions.
+    - reserve() checks a new order and books its open quantity in one step, under one lock,
+      with dictionary lookups and integer arithmetic only (no I/O on the order-entry path)
+    - on_trades() and release() keep the view current from fills, cancels and expired remainders
+    - reconcile() rebuilds the view from Postgres, run every reconcile_interval seconds
+      to correct any drift (orders from other processes, missed events)
+
+    Limits are in quote currency for exposure (the notional of open orders) and in base quantity
+    for positions (worst case: current position plus every open order on the same side filling).
+    A limit of 0 is not checked.
+    """
+
+    def __init__(self, session_factory: Callable = None,
+                 max_open_exposure: float = RISK_MAX_OPEN_EXPOSURE,
+                 max_position: float = RISK_MAX_POSITION,
+                 trader_limits: Dict[str, Dict] = None,
+                 reconcile_interval: float = RISK_RECONCILE_INTERVAL):
+        if session_factory is None:
+            from app.db.postgres import SessionLocal
+            session_factory = SessionLocal
+        self.session_factory = session_factory
+        self.max_open_exposure = max_open_exposure
+        self.max_position = max_position
+        self.trader_limits = RISK_TRADER_LIMITS if trader_limits is None else trader_limits
+        self.reconcile_interval = reconcile_interval
+        self.traders: Dict[str, TraderRisk] = {}
+        self.orders: Dict[str, OpenOrder] = {}
+        self.last_prices: Dict[str, float] = {}
+        # Events applied while a reconcile reads Postgres, replayed onto the rebuilt view
+        self._journal: Optional[List[Tuple]] = None
+        # (trader, symbol) -> position limit in lots
+        self._position_limits: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Load the view from Postgres and keep reconciling it in the background"""
+        self.reconcile()
+        if self.reconcile_interval > 0:
+            self._thread = threading.Thread(target=self._run, name="risk-reconciler", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.wait(self.reconcile_interval):
+            try:
+                self.reconcile()
+            except Exception as e:
+                print(f"Risk reconciliation failed: {str(e)}")
+
+    def _limit(self, trader_id: str, name: str) -> float:
+        limits = self.trader_limits.get(trader_id)
+        if limits and name in limits:
+            return float(limits[name])
+        return getattr(self, name)
+
+    def _position_limit(self, trader_id: str, symbol: str) -> int:
+        key = (trader_id, symbol)
+        limit = self._position_limits.get(key)
+        if limit is None:
+            limit = get_symbol_spec(symbol).to_lots(self._limit(trader_id, "max_position"), exact=False)
+            self._position_limits[key] = limit
+        return limit
+
+    def reserve(self, order_id: str, trader_id: str, symbol: str, side, price_ticks: Optional[int],
+                quantity_lots: int, book_price_ticks: Callable[[], Optional[int]] = None) -> Optional[str]:
+        """
+        Check a new order against the trader's limits and, if it passes, book its open quantity.
+        Market orders (no price_ticks) are priced at the last traded price, or before the symbol
+        has traded at book_price_ticks() (the best price they would trade against); one with
+        neither is rejected while an exposure limit applies.
+        Returns the reason for rejecting it, or None once it is booked.
+        """
+        spec = get_symbol_spec(symbol)
+        is_buy = side == OrderSide.BUY
+        price = price_ticks * spec.tick_value if price_ticks is not None else self.last_prices.get(symbol)
+        if price is None and book_price_ticks is not None:
+            # Read before taking the lock: the book may live in Redis
+            best_ticks = book_price_ticks()
+            if best_ticks is not None:
+                price = best_ticks * spec.tick_value
+        with self._lock:
+            trader = self.traders.get(trader_id)
+            if trader is None:
+                trader = self.traders[trader_id] = TraderRisk()
+
+            max_open_exposure = self._limit(trader_id, "max_open_exposure")
+            if price is None:
+                if max_open_exposure:
+                    return f"No reference price for a {symbol} market order to check its exposure"
+                price = 0.0
+            notional = price * quantity_lots * spec.lot_value
+            if max_open_exposure and trader.open_notional + notional > max_open_exposure:
+                return f"Order would exceed the open exposure limit of {max_open_exposure:g}"
+
+            position_limit = self._position_limit(trader_id, symbol)
+            if position_limit:
+                position = trader.positions.get(symbol, 0)
+                if is_buy:
+                    worst = position + trader.open_buys.get(symbol, 0) + quantity_lots
+                else:
+                    worst = position - trader.open_sells.get(symbol, 0) - quantity_lots
+                if abs(worst) > position_limit:
+                    return f"Order would exceed the {symbol} position limit of {spec.quantity(position_limit):g}"
+
+            self._book(self.traders, self.orders, order_id,
+                       OpenOrder(trader_id, symbol, is_buy, price, quantity_lots))
+            if self._journal is not None:
+                self._journal.append(("reserve", order_id, OpenOrder(trader_id, symbol, is_buy, price, quantity_lots)))
+        return None
+
+    @staticmethod
+    def _book(traders: Dict[str, TraderRisk], orders: Dict[str, OpenOrder], order_id: str, order: OpenOrder):
+        """Add an open order to a view"""
+        trader = traders.get(order.trader_id)
+        if trader is None:
+            trader = traders[order.trader_id] = TraderRisk()
+        orders[order_id] = order
+        trader.open_notional += order.price * order.open_lots * get_symbol_spec(order.symbol).lot_value
+        open_lots = trader.open_buys if order.is_buy else trader.open_sells
+        open_lots[order.symbol] = open_lots.get(order.symbol, 0) + order.open_lots
+
+    def _reduce(self, order_id: str, lots: int) -> Optional[OpenOrder]:
+        """Take lots off an open order, forgetting it once nothing is left; returns the order"""
+        order = self.orders.get(order_id)
+        if order is None:
+            return None
+        lots = min(lots, order.open_lots)
+        trader = self.traders[order.trader_id]
+        trader.open_notional -= order.price * lots * get_symbol_spec(order.symbol).lot_value
+        open_lots = trader.open_buys if order.is_buy else trader.open_sells
+        open_lots[order.symbol] = open_lots.get(order.symbol, 0) - lots
+        order.open_lots -= lots
+        if order.open_lots <= 0:
+            del self.orders[order_id]
+        return order
+
+    def on_trades(self, trades: List[Dict]):
+        """Apply executed trades to both sides' open quantity and positions"""
+        with self._lock:
+            self._apply_trades(trades)
+            if self._journal is not None:
+                self._journal.append(("trades", trades))
+
+    def _apply_trades(self, trades: List[Dict]):
+        for trade in trades:
+            lots = trade["quantity_lots"]
+            self.last_prices[trade["symbol"]] = trade["price"]
+            for order_id, direction in ((trade["buy_order_id"], 1), (trade["sell_order_id"], -1)):
+                order = self._reduce(order_id, lots)
+                if order is None:
+                    # Placed elsewhere or before the last reconcile; picked up by the next one
+                    continue
+                positions = self.traders[order.trader_id].positions
+                positions[order.symbol] = positions.get(order.symbol, 0) + direction * lots
+
+    def release(self, order_id: str):
+        """Drop what is left of an order that will not trade any more (cancelled, expired or rejected)"""
+        with self._lock:
+            order = self.orders.get(order_id)
+            if order is not None:
+                self._reduce(order_id, order.open_lots)
+            if self._journal is not None:
+                self._journal.append(("release", order_id))
+
+    def reconcile(self) -> int:
+        """
+        Rebuild the view from Postgres: open orders from the orders table, positions from the
+        trades table. Pending write-behind events are flushed first, and events applied while
+        Postgres is read are replayed onto the rebuilt view (erring towards counting an event
+        twice for one interval rather than missing it). Returns the number of traders whose
+        exposure or positions changed.
+        """
+        from app.services.persister import get_persister
+        persister = get_persister()
+        if persister is not None:
+            persister.flush(timeout=10)
+
+        traders: Dict[str, TraderRisk] = {}
+        orders: Dict[str, OpenOrder] = {}
+        with self._lock:
+            self._journal = []
+        db = self.session_factory()
+        try:
+            open_orders = db.execute(
+                select(OrderModel.order_id, OrderModel.trader_id, OrderModel.symbol, OrderModel.side,
+                       OrderModel.price_ticks, OrderModel.quantity_lots, OrderModel.filled_lots)
+                .where(OrderModel.status.in_([OrderStatus.ACTIVE, OrderStatus.PARTIALLY_FILLED]))
+            )
+            for order_id, trader_id, symbol, side, price_ticks, quantity_lots, filled_lots in open_orders:
+                spec = get_symbol_spec(symbol)
+                is_buy = side == OrderSide.BUY
+                open_lots = (quantity_lots or 0) - (filled_lots or 0)
+                if open_lots <= 0:
+                    continue
+                price = price_ticks * spec.tick_value if price_ticks is not None else 0.0
+                self._book(traders, orders, order_id, OpenOrder(trader_id, symbol, is_buy, price, open_lots))
+
+            for order_column, direction in ((TradeModel.buy_order_id, 1), (TradeModel.sell_order_id, -1)):
+                positions = db.execute(
+                    select(OrderModel.trader_id, TradeModel.symbol, func.sum(TradeModel.quantity_lots))
+                    .join(OrderModel, OrderModel.order_id == order_column)
+                    .group_by(OrderModel.trader_id, TradeModel.symbol)
+                )
+                for trader_id, symbol, lots in positions:
+                    trader = traders.setdefault(trader_id, TraderRisk())
+                    trader.positions[symbol] = trader.positions.get(symbol, 0) + direction * int(lots or 0)
+        except Exception:
+            with self._lock:
+                self._journal = None
+            raise
+        finally:
+            db.close()
+
+        with self._lock:
+            current = self.traders
+            journal, self._journal = self._journal, None
+            self.traders, self.orders = traders, orders
+            for event in journal:
+                if event[0] == "reserve":
+                    if event[1] not in orders:
+                        self._book(traders, orders, event[1], event[2])
+                elif event[0] == "trades":
+                    self._apply_trades(event[1])
+                else:
+                    order = orders.get(event[1])
+                    if order is not None:
+                        self._reduce(event[1], order.open_lots)
+            changed = sum(
+                1 for trader_id in set(traders) | set(current)
+                if self._differs(traders.get(trader_id), current.get(trader_id))
+            )
+        return changed
+
+    @staticmethod
+    def _differs(a: Optional[TraderRisk], b: Optional[TraderRisk]) -> bool:
+        a = a or TraderRisk()
+        b = b or TraderRisk()
+        positions = lambda trader: {symbol: lots for symbol, lots in trader.positions.items() if lots}
+        return abs(a.open_notional - b.open_notional) > 1e-9 or positions(a) != positions(b)
+
+    def exposure(self, trader_id: str) -> Dict:
+        """Current view of one trader, in decimal units"""
+        with self._lock:
+            trader = self.traders.get(trader_id) or TraderRisk()
+            return {
+                "trader_id": trader_id,
+                "open_exposure": trader.open_notional,
+                "positions": {
+                    symbol: get_symbol_spec(symbol).quantity(lots)
+                    for symbol, lots in trader.positions.items() if lots
+                }
+            }
+
+_risk_cache: Optional[RiskCache] = None
+_risk_cache_lock = threading.Lock()
+
+def get_risk_cache() -> Optional[RiskCache]:
+    """Get the process-wide risk cache (loaded on first use), or None when risk checks are disabled"""
+    global _risk_cache
+    if not RISK_CHECKS_ENABLED:
+        return None
+    if _risk_cache is None:
+        with _risk_cache_lock:
+            if _risk_cache is None:
+                risk_cache = RiskCache()
+                risk_cache.start()
+                _risk_cache = risk_cache
+    return _risk_cache
+
+def stop_risk_cache(timeout: Optional[float] = None):
+    """Stop the background reconciliation"""
+    global _risk_cache
+    if _risk_cache is not None:
+        _risk_cache.stop(timeout)
+        _risk_cache = None
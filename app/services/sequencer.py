@@ -0,0 +1,120 @@
+import asyncio
+from typing import Any, Callable, Dict, List, Optional
+from app.config import ORDER_SEQUENCER_BATCH_SIZE, ORDER_SEQUENCER_QUEUE_SIZE
+
+class SymbolSequencer:
+    """
+    Single writer for one symbol.
+    Orders are queued in arrival order and drained in micro-batches by one asyncio task,
+    so matching for a symbol never interleaves. Each batch is handed to a blocking
+    handler in the default executor; results come back to the callers through futures.
+    """
+
+    def __init__(self, symbol: str, handler: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = ORDER_SEQUENCER_BATCH_SIZE,
+                 max_queue_size: int = ORDER_SEQUENCER_QUEUE_SIZE):
+        self.symbol = symbol
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run(), name=f"sequencer:{self.symbol}")
+
+    async def submit(self, item: Any) -> Any:
+        """Queue an item and wait for its result (raises if the handler rejected it)"""
+        future = asyncio.get_running_loop().create_future()
+        # Blocks callers when the queue is full, pushing back on intake
+        await self.queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(None, self.handler, items)
+            except Exception as e:
+                results = [e] * len(batch)
+
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+            for _ in batch:
+                self.queue.task_done()
+
+    async def stop(self):
+        """Finish the queued work, then stop the task"""
+        if self.task is None:
+            return
+        await self.queue.join()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+class OrderSequencer:
+    """Routes submissions to a per-symbol SymbolSequencer, created on first use"""
+
+    def __init__(self, handler: Callable[[List[Any]], List[Any]]):
+        self.handler = handler
+        self.sequencers: Dict[str, SymbolSequencer] = {}
+
+    async def submit(self, symbol: str, item: Any) -> Any:
+        sequencer = self.sequencers.get(symbol)
+        if sequencer is None:
+            sequencer = SymbolSequencer(symbol, self.handler)
+            self.sequencers[symbol] = sequencer
+            sequencer.start()
+        return await sequencer.submit(item)
+
+    async def stop(self):
+        for sequencer in list(self.sequencers.values()):
+            await sequencer.stop()
+        self.sequencers.clear()
+
+def process_order_batch(order_creates: List[Any]) -> List[Any]:
+    """Create and match a batch of orders for one symbol in its own db session"""
+    from app.db.postgres import SessionLocal
+    from app.services.order_service import OrderService
+
+    db = SessionLocal()
+    try:
+        return OrderService(db).create_orders(order_creates)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+_order_sequencer: Optional[OrderSequencer] = None
+
+def get_order_sequencer() -> OrderSequencer:
+    """Get the process-wide order sequencer"""
+    global _order_sequencer
+    if _order_sequencer is None:
+        _order_sequencer = OrderSequencer(process_order_batch)
+    return _order_sequencer
+
+async def stop_order_sequencer():
+    """Drain and stop all symbol sequencers"""
+    global _order_sequencer
+    if _order_sequencer is not None:
+        await _order_sequencer.stop()
+        _order_sequencer = None
@@ -0,0 +1,417 @@
+"""
+Symbol sharding across matching worker processes.
+
+Symbols are assigned to shards by a consistent hash ring with virtual nodes. Adding or removing
+a shard therefore moves only about 1/N of the symbols. Each shard is a worker process that runs
+OrderService for the symbols it owns, with its own database sessions, Redis client, in-memory
+books, persister and journal. Matching for different shards then runs on different cores.
+
+The API process does no matching and holds no books. ShardRouter sends each order, batch and
+cancel, and each order book read, to the owning shard over a multiprocessing.connection Unix socket, authenticated with a key generated at
+start. Each thread keeps pooled connections per shard. Workers serve every connection from its
+own thread.
+
+Resizing pauses routing until the requests in flight have returned. Each symbol changing owner
+is then released by its old shard: in-memory books are flushed to their Redis mirror and
+dropped. The new ring is installed and routing resumes, so the new owner loads the book from
+Redis on its first order.
+"""
+import bisect
+import hashlib
+import multiprocessing
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing.connection import Client, Listener
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from app.config import (
+    JOURNAL_DIR, SHARD_SOCKET_DIR, SHARD_VIRTUAL_NODES, SHARD_WORKERS, WRITE_BEHIND_DEAD_LETTER_DIR
+)
+from app.models.order import Order, OrderCreate
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+class HashRing:
+    """Consistent hash ring of shard ids, each placed at virtual_nodes points"""
+
+    def __init__(self, shards: Iterable[int], virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        self.shards = sorted(shards)
+        self.virtual_nodes = virtual_nodes
+        points = sorted((_hash(f"shard-{shard}#{i}"), shard) for shard in self.shards for i in range(virtual_nodes))
+        self._points = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def owner(self, symbol: str) -> int:
+        """Shard owning a symbol: the first point clockwise from the symbol's hash"""
+        index = bisect.bisect(self._points, _hash(symbol)) % len(self._points)
+        return self._owners[index]
+
+class ShardWorker:
+    """Serves a shard's requests from the router; each connection is handled by its own thread"""
+
+    def __init__(self, shard_id: int, address: str, authkey: bytes, shards: List[int],
+                 virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        self.shard_id = shard_id
+        self.address = address
+        self.authkey = authkey
+        self.virtual_nodes = virtual_nodes
+        self.ring = HashRing(shards, virtual_nodes)
+        self._stopping = threading.Event()
+
+    def serve(self):
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        with Listener(self.address, family="AF_UNIX", authkey=self.authkey) as listener:
+            while not self._stopping.is_set():
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, multiprocessing.AuthenticationError):
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), name=f"shard-{self.shard_id}-conn",
+                                 daemon=True).start()
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                conn.send(self._dispatch(request))
+                if request[0] == "stop":
+                    self._stopping.set()
+                    # Wake the accept loop so it sees the stop
+                    Client(self.address, family="AF_UNIX", authkey=self.authkey).close()
+                    return
+
+    def _dispatch(self, request: Tuple):
+        operation, *args = request
+        try:
+            return "ok", getattr(self, f"do_{operation}")(*args)
+        except ValueError as e:
+            return "rejected", str(e)
+        except Exception as e:
+            return "error", f"{type(e).__name__}: {e}"
+
+    @contextmanager
+    def _order_service(self):
+        from app.db.postgres import SessionLocal
+        from app.services.order_service import OrderService
+
+        db = SessionLocal()
+        try:
+            yield OrderService(db)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def do_create(self, order_create: Dict) -> Tuple[Dict, List[Dict]]:
+        with self._order_service() as order_service:
+            order, trades = order_service.create_order(OrderCreate(**order_create))
+        return order.model_dump(), trades
+
+    def do_create_batch(self, order_creates: List[Dict], order_ids: Optional[List[str]] = None) -> List[Tuple[str, object]]:
+        with self._order_service() as order_service:
+            results = order_service.create_orders([OrderCreate(**order_create) for order_create in order_creates],
+                                                  order_ids)
+        return [("rejected", str(result)) if isinstance(result, Exception) else ("ok", (result[0].model_dump(), result[1]))
+                for result in results]
+
+    def do_cancel(self, order_id: str) -> Optional[Dict]:
+        with self._order_service() as order_service:
+            order = order_service.cancel_order(order_id)
+        return order.model_dump() if order else None
+
+    def do_cancel_orders(self, trader_id: Optional[str], symbol: Optional[str]) -> List[Dict]:
+        with self._order_service() as order_service:
+            if symbol is not None:
+                return [order.model_dump() for order in order_service.cancel_orders(trader_id, symbol)]
+            # The trader index spans every shard; only cancel on the symbols owned here
+            cancelled = []
+            for book_symbol in order_service.matching_engine.trader_open_orders(trader_id):
+                if self.ring.owner(book_symbol) == self.shard_id:
+                    cancelled += [order.model_dump() for order in order_service.cancel_orders(trader_id, book_symbol)]
+            return cancelled
+
+    def do_order_book(self, symbol: str, depth: int) -> Dict:
+        with self._order_service() as order_service:
+            return order_service.get_order_book(symbol, depth)
+
+    def do_order_book_orders(self, symbol: str, depth: int) -> Dict:
+        with self._order_service() as order_service:
+            return order_service.get_order_book_orders(symbol, depth)
+
+    def do_assign(self, shards: List[int]) -> int:
+        self.ring = HashRing(shards, self.virtual_nodes)
+        return len(shards)
+
+    def do_release(self, symbols: List[str]) -> int:
+        """Hand symbols over to another shard: flush and drop their in-memory books"""
+        from app.models.memory_order_book import unload_memory_order_book
+        return sum(unload_memory_order_book(symbol, timeout=10) for symbol in symbols)
+
+    def do_ping(self) -> int:
+        return self.shard_id
+
+    def do_stop(self) -> int:
+        """Write out everything this worker still holds, as the API lifespan does at shutdown"""
+        from app.messaging.publisher import stop_execution_publisher
+        from app.models.memory_order_book import flush_order_book_mirror
+        from app.services.journal import stop_journal
+        from app.services.persister import stop_persister
+        from app.services.risk import stop_risk_cache
+
+        stop_risk_cache(timeout=5)
+        stop_journal(timeout=5)
+        stop_persister(timeout=10)
+        stop_execution_publisher(timeout=10)
+        flush_order_book_mirror(timeout=5)
+        return self.shard_id
+
+def run_shard_worker(shard_id: int, address: str, authkey: bytes, shards: List[int],
+                     virtual_nodes: int = SHARD_VIRTUAL_NODES):
+    """Worker process entry point"""
+    from app.services.journal import open_journal
+    from app.services.persister import set_dead_letter_path
+
+    # Each worker journals the orders it receives in a directory of its own, and keeps its own
+    # dead-lettered writes (replayed when a worker with the same id starts again)
+    open_journal(os.path.join(JOURNAL_DIR, f"shard-{shard_id}"))
+    set_dead_letter_path(os.path.join(WRITE_BEHIND_DEAD_LETTER_DIR, f"write_behind-shard-{shard_id}.jsonl"))
+    ShardWorker(shard_id, address, authkey, shards, virtual_nodes).serve()
+
+class ShardRouter:
+    """Starts the shard workers and routes each request to the shard owning its symbol"""
+
+    def __init__(self, socket_dir: str = SHARD_SOCKET_DIR, virtual_nodes: int = SHARD_VIRTUAL_NODES,
+                 start_timeout: float = 30.0):
+        self.socket_dir = os.path.abspath(socket_dir)
+        self.virtual_nodes = virtual_nodes
+        self.start_timeout = start_timeout
+        self.authkey = secrets.token_bytes(32)
+        self.ring: Optional[HashRing] = None
+        self.processes: Dict[int, multiprocessing.Process] = {}
+        self.addresses: Dict[int, str] = {}
+        # Symbols routed so far; the ones whose owner changes are handed over on resize
+        self.symbols = set()
+        self._connections: Dict[int, "queue.SimpleQueue"] = {}
+        self._routing = threading.Condition()
+        self._in_flight = 0
+        self._paused = False
+        self._resize_lock = threading.Lock()
+
+    def start(self, workers: int = SHARD_WORKERS):
+        shards = list(range(max(1, workers)))
+        self._spawn(shards, shards)
+        self.ring = HashRing(shards, self.virtual_nodes)
+
+    def _spawn(self, shard_ids: List[int], shards: List[int]):
+        os.makedirs(self.socket_dir, exist_ok=True)
+        # Spawned rather than forked: the API process has threads and open connections
+        context = multiprocessing.get_context("spawn")
+        for shard_id in shard_ids:
+            address = os.path.join(self.socket_dir, f"shard-{shard_id}.sock")
+            process = context.Process(target=run_shard_worker, name=f"shard-{shard_id}", daemon=True,
+                                      args=(shard_id, address, self.authkey, shards, self.virtual_nodes))
+            process.start()
+            self.processes[shard_id] = process
+            self.addresses[shard_id] = address
+            self._connections[shard_id] = queue.SimpleQueue()
+        for shard_id in shard_ids:
+            self._wait_ready(shard_id)
+
+    def _wait_ready(self, shard_id: int):
+        deadline = time.monotonic() + self.start_timeout
+        while True:
+            try:
+                self._call(shard_id, ("ping",))
+                return
+            except (OSError, EOFError):
+                if time.monotonic() > deadline or not self.processes[shard_id].is_alive():
+                    raise RuntimeError(f"Shard worker {shard_id} did not start")
+                time.sleep(0.05)
+
+    def _call(self, shard_id: int, request: Tuple):
+        """Send one request to a shard on a pooled connection and return its result"""
+        connections = self._connections[shard_id]
+        try:
+            conn = connections.get_nowait()
+        except queue.Empty:
+            conn = Client(self.addresses[shard_id], family="AF_UNIX", authkey=self.authkey)
+        try:
+            conn.send(request)
+            status, result = conn.recv()
+        except Exception:
+            conn.close()
+            raise
+        connections.put(conn)
+        if status == "rejected":
+            raise ValueError(result)
+        if status == "error":
+            raise RuntimeError(f"Shard {shard_id}: {result}")
+        return result
+
+    @contextmanager
+    def _routed(self):
+        """Count a request in flight; waits while a resize is handing symbols over"""
+        with self._routing:
+            while self._paused:
+                self._routing.wait()
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._routing:
+                self._in_flight -= 1
+                if self._in_flight == 0:
+                    self._routing.notify_all()
+
+    def _owner(self, symbol: str) -> int:
+        self.symbols.add(symbol)
+        return self.ring.owner(symbol)
+
+    def create_order(self, order_create: OrderCreate) -> Tuple[Order, List[Dict]]:
+        with self._routed():
+            order, trades = self._call(self._owner(order_create.symbol), ("create", order_create.model_dump()))
+        return Order(**order), trades
+
+    def create_orders(self, order_creates: List[OrderCreate],
+                      order_ids: Optional[List[str]] = None) -> List[Union[Tuple[Order, List[Dict]], Exception]]:
+        """Send each shard its part of a batch, in arrival order; results come back in input order"""
+        results: List[Union[Tuple[Order, List[Dict]], Exception]] = [None] * len(order_creates)
+        with self._routed():
+            by_shard: Dict[int, List[int]] = {}
+            for i, order_create in enumerate(order_creates):
+                by_shard.setdefault(self._owner(order_create.symbol), []).append(i)
+            for shard_id, indexes in by_shard.items():
+                batch = [order_creates[i].model_dump() for i in indexes]
+                ids = [order_ids[i] for i in indexes] if order_ids else None
+                for i, (status, result) in zip(indexes, self._call(shard_id, ("create_batch", batch, ids))):
+                    results[i] = ValueError(result) if status == "rejected" else (Order(**result[0]), result[1])
+        return results
+
+    def cancel_order(self, order_id: str, symbol: Optional[str] = None) -> Optional[Order]:
+        """
+        Cancel on the owning shard, found through the Redis order index. Orders the index does not
+        know yet (in-memory books mirror it asynchronously) are looked for on every shard.
+        """
+        from app.db.redis_client import get_redis
+        from app.models.order_book import locate_order
+
+        with self._routed():
+            if symbol is None:
+                location = locate_order(get_redis(), order_id)
+                symbol = location[0] if location else None
+            shard_ids = [self._owner(symbol)] if symbol is not None else self.ring.shards
+            for shard_id in shard_ids:
+                order = self._call(shard_id, ("cancel", order_id))
+                if order is not None:
+                    return Order(**order)
+        return None
+
+    def cancel_orders(self, trader_id: Optional[str] = None, symbol: Optional[str] = None) -> List[Order]:
+        """Mass cancel on the shard owning the symbol, or on every shard for a trader"""
+        with self._routed():
+            shard_ids = [self._owner(symbol)] if symbol is not None else self.ring.shards
+            cancelled = []
+            for shard_id in shard_ids:
+                cancelled += self._call(shard_id, ("cancel_orders", trader_id, symbol))
+        return [Order(**order) for order in cancelled]
+
+    def get_order_book(self, symbol: str, depth: int = 10) -> Dict:
+        """L2 snapshot from the owning shard's book, with the sequence of the deltas it publishes"""
+        with self._routed():
+            return self._call(self._owner(symbol), ("order_book", symbol, depth))
+
+    def get_order_book_orders(self, symbol: str, depth: int = 10) -> Dict:
+        """L3 snapshot from the owning shard's book"""
+        with self._routed():
+            return self._call(self._owner(symbol), ("order_book_orders", symbol, depth))
+
+    def assignments(self) -> Dict:
+        return {"shards": self.ring.shards,
+                "symbols": {symbol: self.ring.owner(symbol) for symbol in sorted(self.symbols)}}
+
+    def resize(self, workers: int) -> Dict[str, Tuple[int, int]]:
+        """
+        Change the number of shard workers. Symbols whose owner changes are released by the old
+        shard while routing is paused. Returns the moves as {symbol: (old shard, new shard)}.
+        """
+        with self._resize_lock:
+            shards = list(range(max(1, workers)))
+            added = [shard_id for shard_id in shards if shard_id not in self.processes]
+            removed = [shard_id for shard_id in self.ring.shards if shard_id not in shards]
+            self._spawn(added, shards)
+            ring = HashRing(shards, self.virtual_nodes)
+
+            with self._routing:
+                self._paused = True
+                while self._in_flight:
+                    self._routing.wait()
+            try:
+                moves = {symbol: (self.ring.owner(symbol), ring.owner(symbol)) for symbol in self.symbols
+                         if self.ring.owner(symbol) != ring.owner(symbol)}
+                released: Dict[int, List[str]] = {}
+                for symbol, (old, _) in moves.items():
+                    released.setdefault(old, []).append(symbol)
+                for shard_id, symbols in released.items():
+                    self._call(shard_id, ("release", symbols))
+                for shard_id in shards:
+                    self._call(shard_id, ("assign", shards))
+                self.ring = ring
+            finally:
+                with self._routing:
+                    self._paused = False
+                    self._routing.notify_all()
+
+            for shard_id in removed:
+                self._stop_worker(shard_id)
+            return moves
+
+    def _stop_worker(self, shard_id: int, timeout: Optional[float] = 30.0):
+        try:
+            self._call(shard_id, ("stop",))
+        except (OSError, EOFError, RuntimeError) as e:
+            print(f"Error stopping shard {shard_id}: {str(e)}")
+        process = self.processes.pop(shard_id)
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+        connections = self._connections.pop(shard_id)
+        while not connections.empty():
+            connections.get_nowait().close()
+        self.addresses.pop(shard_id, None)
+
+    def stop(self, timeout: Optional[float] = 30.0):
+        for shard_id in list(self.processes):
+            self._stop_worker(shard_id, timeout)
+
+_router: Optional[ShardRouter] = None
+
+def get_shard_router() -> Optional[ShardRouter]:
+    """Get the shard router of this process, or None when it does not route (sharding off, or a worker)"""
+    return _router
+
+def start_shard_router(workers: int = SHARD_WORKERS) -> ShardRouter:
+    """Start the shard workers and route this process's orders to them"""
+    global _router
+    if _router is None:
+        router = ShardRouter()
+        router.start(workers)
+        _router = router
+    return _router
+
+def stop_shard_router(timeout: Optional[float] = 30.0):
+    """Stop routing and shut the shard workers down after they write out their state"""
+    global _router
+    if _router is not None:
+        _router.stop(timeout)
+        _router = None
@@ -0,0 +1,240 @@
+"""
+Benchmark harness for MatchingEngine.process_order.
+
+Replays a recorded journal range or a synthetic order flow through each order book backend and
+reports throughput, latency percentiles and Redis round trips per order as JSON. A stored
+baseline turns it into a regression check: the exit status is 1 when any backend got slower
+or chattier than the baseline allows.
+
+    python -m app.utils.benchmark --orders 50000 --redis-url fake --output bench.json
+    python -m app.utils.benchmark --journal data/journal --baseline bench.json
+
+Runs against a real Redis flush the selected database before each backend.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+import numpy as np
+import redis
+from app.models.memory_order_book import InMemoryOrderBook
+from app.services.journal import ORDER, JournalReader, ReplayOrder
+from app.services.matching_engine import MatchingEngine
+from app.utils.order_flow import FlowCancel, OrderFlow
+
+BACKENDS = ("memory", "redis", "redis_script")
+DEFAULT_REDIS_URL = "redis://localhost:6379/15"
+
+class RoundTripCounter:
+    """Counts Redis round trips made through a client: one per command, one per non-empty pipeline"""
+
+    def __init__(self, redis_client):
+        self.count = 0
+        execute_command = redis_client.execute_command
+        pipeline = redis_client.pipeline
+
+        def counted_command(*args, **options):
+            self.count += 1
+            return execute_command(*args, **options)
+
+        def counted_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            def counted_execute(*execute_args, **execute_kwargs):
+                if pipe.command_stack:
+                    self.count += 1
+                return execute(*execute_args, **execute_kwargs)
+
+            pipe.execute = counted_execute
+            return pipe
+
+        redis_client.execute_command = counted_command
+        redis_client.pipeline = counted_pipeline
+
+def connect(redis_url: str):
+    """A client for the benchmark: a local Redis, or an in-process fake for 'fake'"""
+    if redis_url == "fake":
+        try:
+            import fakeredis
+        except ImportError:
+            raise SystemExit("--redis-url fake needs the fakeredis package (pip install fakeredis)")
+        return fakeredis.FakeRedis()
+    return redis.from_url(redis_url)
+
+def synthetic_stream(symbols: List[str], orders: int, seed: int, **flow_options) -> Callable[[], Iterable]:
+    """A factory of identical synthetic streams, one per backend run"""
+    return lambda: OrderFlow(symbols, seed=seed, **flow_options).events(orders)
+
+def journal_stream(directory: str, start: Optional[int] = None, end: Optional[int] = None) -> Callable[[], Iterable]:
+    """A factory of streams replaying a journal range"""
+    def events():
+        for record in JournalReader(directory).records(start, end):
+            if record.kind == ORDER:
+                yield ReplayOrder(record)
+            else:
+                for order_id in record.order_ids:
+                    yield FlowCancel(record.symbol, order_id)
+    return events
+
+def percentiles(latencies_ns: np.ndarray) -> Dict:
+    """Latency summary in microseconds"""
+    if latencies_ns.size == 0:
+        return {}
+    p50, p99, p999 = np.percentile(latencies_ns, [50, 99, 99.9]) / 1000
+    return {"p50": round(float(p50), 2), "p99": round(float(p99), 2), "p99_9": round(float(p999), 2),
+            "max": round(float(latencies_ns.max()) / 1000, 2), "mean": round(float(latencies_ns.mean()) / 1000, 2)}
+
+def run_backend(backend: str, redis_client, events: Iterable, warmup: int = 0) -> Dict:
+    """Drive one backend with a stream; the first warmup events are processed but not measured"""
+    matching_engine = MatchingEngine(redis_client, backend=backend, persister=False, journal=False,
+                                     executions=False)
+    if backend == "memory":
+        # Books owned by this run: nothing loaded from or mirrored to Redis
+        books = {}
+        def get_order_book(symbol: str):
+            if symbol not in books:
+                books[symbol] = InMemoryOrderBook(symbol)
+            return books[symbol]
+        matching_engine.get_order_book = get_order_book
+
+    counter = RoundTripCounter(redis_client)
+    order_latencies: List[int] = []
+    orders = cancels = fills = 0
+    round_trips = 0
+    elapsed_ns = 0
+    perf_counter_ns = time.perf_counter_ns
+
+    for index, event in enumerate(events):
+        measured = index >= warmup
+        before = counter.count
+        if isinstance(event, FlowCancel):
+            started = perf_counter_ns()
+            matching_engine.cancel_orders(event.symbol, [event.order_id])
+            took = perf_counter_ns() - started
+            if measured:
+                cancels += 1
+                elapsed_ns += took
+            continue
+
+        started = perf_counter_ns()
+        trades = matching_engine.process_order(event)
+        took = perf_counter_ns() - started
+        if measured:
+            orders += 1
+            fills += len(trades)
+            elapsed_ns += took
+            order_latencies.append(took)
+            round_trips += counter.count - before
+
+    seconds = elapsed_ns / 1e9
+    return {
+        "orders": orders,
+        "cancels": cancels,
+        "fills": fills,
+        "seconds": round(seconds, 4),
+        "orders_per_second": round(orders / seconds, 1) if seconds > 0 else None,
+        "fills_per_second": round(fills / seconds, 1) if seconds > 0 else None,
+        "latency_us": percentiles(np.array(order_latencies, dtype=np.int64)),
+        "redis_round_trips_per_order": round(round_trips / orders, 3) if orders else None,
+    }
+
+def run_benchmark(stream: Callable[[], Iterable], backends: Iterable[str], redis_url: str, warmup: int = 0) -> Dict:
+    """Run the same stream through each backend on a clean Redis database"""
+    results = {}
+    for backend in backends:
+        redis_client = connect(redis_url)
+        redis_client.flushdb()
+        try:
+            results[backend] = run_backend(backend, redis_client, stream(), warmup=warmup)
+        except redis.exceptions.RedisError as e:
+            # e.g. an in-process fake without the Lua libraries the scripted backend needs
+            results[backend] = {"error": str(e)}
+        finally:
+            redis_client.flushdb()
+    return results
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Regressions of results against a baseline: throughput lower or p99 latency higher than the
+    tolerance allows, or more Redis round trips per order
+    """
+    regressions = []
+    for backend, current in results.items():
+        previous = baseline.get(backend)
+        if not previous or "error" in previous:
+            continue
+        if "error" in current:
+            regressions.append(f"{backend}: {current['error']}")
+            continue
+        if previous.get("orders_per_second") and \
+                current["orders_per_second"] < previous["orders_per_second"] * (1 - tolerance):
+            regressions.append(f"{backend}: orders/s {current['orders_per_second']} "
+                               f"< baseline {previous['orders_per_second']}")
+        previous_p99 = previous.get("latency_us", {}).get("p99")
+        if previous_p99 and current["latency_us"]["p99"] > previous_p99 * (1 + tolerance):
+            regressions.append(f"{backend}: p99 {current['latency_us']['p99']}us > baseline {previous_p99}us")
+        previous_round_trips = previous.get("redis_round_trips_per_order")
+        if previous_round_trips is not None and \
+                current["redis_round_trips_per_order"] > previous_round_trips + 0.01:
+            regressions.append(f"{backend}: round trips/order {current['redis_round_trips_per_order']} "
+                               f"> baseline {previous_round_trips}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the matching engine against each order book backend")
+    parser.add_argument("--backend", action="append", choices=BACKENDS,
+                        help="Backend to run (repeatable, default: all)")
+    parser.add_argument("--redis-url", default=DEFAULT_REDIS_URL,
+                        help="Scratch Redis database, flushed before each run, or 'fake' for an in-process fake")
+    parser.add_argument("--journal", help="Replay this journal directory instead of a synthetic flow")
+    parser.add_argument("--start", type=int, help="First journal sequence number")
+    parser.add_argument("--end", type=int, help="Last journal sequence number")
+    parser.add_argument("--orders", type=int, default=20000, help="Synthetic events to generate")
+    parser.add_argument("--symbols", default="BTC/USD,ETH/USD", help="Comma-separated synthetic symbols")
+    parser.add_argument("--seed", type=int, default=1, help="Synthetic flow seed")
+    parser.add_argument("--market-ratio", type=float, default=0.1, help="Share of synthetic market orders")
+    parser.add_argument("--cancel-ratio", type=float, default=0.2, help="Share of synthetic cancels")
+    parser.add_argument("--warmup", type=int, default=1000, help="Events processed before measuring")
+    parser.add_argument("--output", help="Write the JSON report to this file as well as stdout")
+    parser.add_argument("--baseline", help="Compare against a stored report and exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative drop in throughput or rise in p99 against the baseline")
+    args = parser.parse_args()
+
+    if args.journal:
+        stream = journal_stream(args.journal, args.start, args.end)
+        source = {"journal": args.journal, "start": args.start, "end": args.end}
+    else:
+        symbols = [symbol.strip() for symbol in args.symbols.split(",") if symbol.strip()]
+        stream = synthetic_stream(symbols, args.orders, args.seed, market_ratio=args.market_ratio,
+                                  cancel_ratio=args.cancel_ratio)
+        source = {"synthetic": {"events": args.orders, "symbols": symbols, "seed": args.seed,
+                                "market_ratio": args.market_ratio, "cancel_ratio": args.cancel_ratio}}
+
+    report = {
+        "source": source,
+        "redis": "fake" if args.redis_url == "fake" else "redis",
+        "warmup": args.warmup,
+        "python": platform.python_version(),
+        "results": run_benchmark(stream, args.backend or BACKENDS, args.redis_url, warmup=args.warmup),
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report["results"], json.load(f)["results"], args.tolerance)
+        report["regressions"] = regressions
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Load generator for the order API.
+
+Sends a synthetic order flow (random walk prices, limit/market mix, cancels) at a target mean
+rate with Poisson or bursty arrivals. The target is the HTTP API or the service layer in
+process. Requests are open-loop. Each request is timed from its scheduled arrival ("response")
+and from when it was actually sent ("service"). A client that falls behind therefore shows up
+as latency instead of a silently lower rate. Latencies go into log-linear histograms per
+operation, and a JSON report is printed.
+
+    python -m app.utils.load_test --rate 500 --duration 30
+    python -m app.utils.load_test --target service --rate 2000 --arrivals bursty --count 100000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+from app.config import API_PREFIX
+from app.services.metrics import LatencyHistogram
+from app.utils.order_flow import FlowCancel, FlowOrder, OrderFlow, bursty_arrivals, poisson_arrivals
+
+class RejectedError(Exception):
+    """The order was refused by validation or risk checks"""
+
+class HttpTarget:
+    """Sends orders and cancels to the REST API"""
+
+    def __init__(self, base_url: str, max_connections: int = 100, timeout: float = 10.0):
+        import httpx
+        self.client = httpx.AsyncClient(base_url=base_url, timeout=timeout,
+                                        limits=httpx.Limits(max_connections=max_connections))
+        self.path = f"{API_PREFIX}/orders/"
+
+    async def submit(self, order: FlowOrder) -> str:
+        response = await self.client.post(self.path, json=order.to_create().model_dump(mode="json"))
+        if response.status_code == 400:
+            raise RejectedError(response.json().get("detail"))
+        response.raise_for_status()
+        return response.json()["order_id"]
+
+    async def cancel(self, order_id: str) -> bool:
+        response = await self.client.delete(f"{self.path}{order_id}")
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+
+    async def close(self):
+        await self.client.aclose()
+
+class ServiceTarget:
+    """Calls OrderService in process from a thread pool, one database session per thread"""
+
+    def __init__(self, threads: int = 16):
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="load-test")
+        self.local = threading.local()
+        self.sessions = []
+
+    def _service(self):
+        from app.db.postgres import SessionLocal
+        from app.services.order_service import OrderService
+        service = getattr(self.local, "service", None)
+        if service is None:
+            db = SessionLocal()
+            self.sessions.append(db)
+            service = self.local.service = OrderService(db)
+        return service
+
+    def _submit(self, order: FlowOrder) -> str:
+        try:
+            created_order, trades = self._service().create_order(order.to_create())
+        except ValueError as e:
+            raise RejectedError(str(e))
+        return created_order.order_id
+
+    def _cancel(self, order_id: str) -> bool:
+        return self._service().cancel_order(order_id) is not None
+
+    async def submit(self, order: FlowOrder) -> str:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._submit, order)
+
+    async def cancel(self, order_id: str) -> bool:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._cancel, order_id)
+
+    async def close(self):
+        self.executor.shutdown(wait=True)
+        for db in self.sessions:
+            db.close()
+
+class LoadStats:
+    """Outcome counts and latency histograms (microseconds) per operation"""
+
+    OPERATIONS = ("limit", "market", "cancel")
+
+    def __init__(self):
+        self.response = {operation: LatencyHistogram() for operation in self.OPERATIONS}
+        self.service = {operation: LatencyHistogram() for operation in self.OPERATIONS}
+        self.outcomes = {operation: Counter() for operation in self.OPERATIONS}
+        self.errors = Counter()
+        self.started = None
+        self.finished = None
+
+    def record(self, operation: str, outcome: str, scheduled: float, sent: float, done: float):
+        self.outcomes[operation][outcome] += 1
+        self.response[operation].record(int((done - scheduled) * 1e6))
+        self.service[operation].record(int((done - sent) * 1e6))
+
+    def report(self, histograms: bool = False) -> Dict:
+        elapsed = (self.finished - self.started) if self.started is not None else 0.0
+        sent = sum(histogram.total for histogram in self.service.values())
+        report = {"seconds": round(elapsed, 3), "requests": sent,
+                  "requests_per_second": round(sent / elapsed, 1) if elapsed > 0 else None,
+                  "operations": {}, "errors": dict(self.errors.most_common(10))}
+        for operation in self.OPERATIONS:
+            if not self.outcomes[operation]:
+                continue
+            entry = {"outcomes": dict(self.outcomes[operation]),
+                     "response_us": self.response[operation].summary(),
+                     "service_us": self.service[operation].summary()}
+            if histograms:
+                entry["response_histogram"] = self.response[operation].buckets()
+            report["operations"][operation] = entry
+        return report
+
+async def run_load(target, events: Iterable, arrivals: Iterable[float], duration: Optional[float] = None,
+                   count: Optional[int] = None, max_in_flight: int = 100) -> LoadStats:
+    """
+    Send events at their arrival offsets (seconds from the start) until the duration or count
+    runs out. At most max_in_flight requests are outstanding; beyond that, sends wait and the
+    wait counts towards the response latency.
+    """
+    stats = LoadStats()
+    semaphore = asyncio.Semaphore(max_in_flight)
+    # Generated order id -> id assigned by the server, for cancels
+    order_ids: Dict[str, str] = {}
+    pending = set()
+
+    async def send(event, scheduled: float):
+        try:
+            sent = time.perf_counter()
+            if isinstance(event, FlowCancel):
+                order_id = order_ids.pop(event.order_id, None)
+                if order_id is None:
+                    # Rejected, or not acknowledged yet
+                    stats.outcomes["cancel"]["skipped"] += 1
+                    return
+                operation = "cancel"
+                outcome = "cancelled" if await target.cancel(order_id) else "missed"
+            else:
+                operation = event.order_type.value
+                try:
+                    order_ids[event.order_id] = await target.submit(event)
+                    outcome = "accepted"
+                except RejectedError:
+                    outcome = "rejected"
+            stats.record(operation, outcome, scheduled, sent, time.perf_counter())
+        except Exception as e:
+            stats.errors[f"{type(e).__name__}: {e}"[:200]] += 1
+        finally:
+            semaphore.release()
+
+    stats.started = time.perf_counter()
+    for index, (offset, event) in enumerate(zip(arrivals, events)):
+        if (count is not None and index >= count) or (duration is not None and offset > duration):
+            break
+        scheduled = stats.started + offset
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await semaphore.acquire()
+        task = asyncio.create_task(send(event, scheduled))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    if pending:
+        await asyncio.gather(*pending)
+    stats.finished = time.perf_counter()
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate order flow against the API or the service layer")
+    parser.add_argument("--target", choices=("http", "service"), default="http",
+                        help="REST API over HTTP, or OrderService in this process")
+    parser.add_argument("--url", default="http://localhost:8000", help="API base URL for --target http")
+    parser.add_argument("--rate", type=float, default=100.0, help="Mean requests per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load")
+    parser.add_argument("--count", type=int, help="Stop after this many requests")
+    parser.add_argument("--arrivals", choices=("poisson", "bursty"), default="poisson")
+    parser.add_argument("--burst-size", type=int, default=50, help="Mean arrivals per burst")
+    parser.add_argument("--burst-factor", type=float, default=10.0, help="Rate within a burst over the mean rate")
+    parser.add_argument("--symbols", default="BTC/USD,ETH/USD", help="Comma-separated symbols")
+    parser.add_argument("--start-price", type=float, default=100.0)
+    parser.add_argument("--price-step", type=float, default=0.01, help="Random walk step")
+    parser.add_argument("--market-ratio", type=float, default=0.1, help="Share of market orders")
+    parser.add_argument("--cancel-ratio", type=float, default=0.2, help="Share of cancels")
+    parser.add_argument("--traders", type=int, default=50)
+    parser.add_argument("--max-in-flight", type=int, default=100, help="Outstanding request limit")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--histograms", action="store_true", help="Include response latency buckets")
+    args = parser.parse_args()
+
+    symbols = [symbol.strip() for symbol in args.symbols.split(",") if symbol.strip()]
+    flow = OrderFlow(symbols, seed=args.seed, start_price=args.start_price, price_step=args.price_step,
+                     market_ratio=args.market_ratio, cancel_ratio=args.cancel_ratio, traders=args.traders)
+    if args.arrivals == "bursty":
+        arrivals = bursty_arrivals(args.rate, args.burst_size, args.burst_factor, seed=args.seed)
+    else:
+        arrivals = poisson_arrivals(args.rate, seed=args.seed)
+    duration = None if args.count is not None else args.duration
+
+    async def run():
+        target = HttpTarget(args.url, max_connections=args.max_in_flight) if args.target == "http" \
+            else ServiceTarget(threads=args.max_in_flight)
+        try:
+            return await run_load(target, (flow.next_event() for _ in itertools.count()), arrivals,
+                                  duration=duration, count=args.count, max_in_flight=args.max_in_flight)
+        finally:
+            await target.close()
+
+    stats = asyncio.run(run())
+    report = {"target": args.target, "arrivals": args.arrivals, "target_rate": args.rate}
+    report.update(stats.report(histograms=args.histograms))
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import json
+from typing import Dict
+from app.db.redis_client import get_redis
+from app.models.order_book import OrderBook
+from app.models.order_book_scripts import REPLACE_IF_UNCHANGED_SCRIPT
+from app.models.order_codec import ORDER_CODEC_VERSION, decode_order_details, encode_order_details
+
+KEY_PREFIX = "orderbook:"
+KEY_SUFFIX = ":details"
+
+def details_symbol(key: str) -> str:
+    return key[len(KEY_PREFIX):-len(KEY_SUFFIX)]
+
+def memory_report(redis_client, key: str, sample_size: int = 1000) -> Dict:
+    """
+    Memory used per resting order in one details hash: what Redis reports for the whole key,
+    and the average value size as stored, as JSON and as binary over a sample of orders
+    """
+    symbol = details_symbol(key)
+    orders = redis_client.hlen(key)
+    report = {"key": key, "orders": orders}
+    if orders == 0:
+        return report
+
+    sample = []
+    for order_id, order_data in redis_client.hscan_iter(key, count=sample_size):
+        sample.append((order_id, order_data))
+        if len(sample) >= sample_size:
+            break
+
+    stored = sum(len(order_data) for _, order_data in sample)
+    json_size = binary_size = 0
+    for order_id, order_data in sample:
+        order_details = decode_order_details(order_id, symbol, order_data)
+        json_size += len(encode_order_details(order_details, codec="json"))
+        binary_size += len(encode_order_details(order_details, codec="binary"))
+
+    report.update({
+        "sampled": len(sample),
+        "stored_value_bytes": round(stored / len(sample), 1),
+        "json_value_bytes": round(json_size / len(sample), 1),
+        "binary_value_bytes": round(binary_size / len(sample), 1),
+    })
+    try:
+        report["key_bytes_per_order"] = round(redis_client.memory_usage(key, samples=0) / orders, 1)
+    except Exception:
+        # MEMORY USAGE is not available on every server
+        pass
+    return report
+
+def is_current(order_data: bytes) -> bool:
+    """Whether a stored value is already in the current binary layout"""
+    return order_data[:1] != b"{" and order_data[0] == ORDER_CODEC_VERSION
+
+def migrate_key(redis_client, key: str, batch_size: int = 500) -> int:
+    """
+    Rewrite the JSON and older binary values of a details hash in the current binary encoding;
+    returns values rewritten
+    """
+    symbol = details_symbol(key)
+    replace = redis_client.register_script(REPLACE_IF_UNCHANGED_SCRIPT)
+    migrated = 0
+    batch = []
+
+    for order_id, order_data in redis_client.hscan_iter(key, count=batch_size):
+        if is_current(order_data):
+            continue
+        order_details = decode_order_details(order_id, symbol, order_data)
+        batch.extend([order_id, order_data, encode_order_details(order_details, codec="binary")])
+        if len(batch) >= batch_size * 3:
+            migrated += replace(keys=[key], args=batch)
+            batch = []
+    if batch:
+        migrated += replace(keys=[key], args=batch)
+    return migrated
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate resting order details in Redis to the current binary encoding")
+    parser.add_argument("--symbol", action="append", dest="symbols",
+                        help="Symbol to migrate (repeatable, default: every order book)")
+    parser.add_argument("--report-only", action="store_true", help="Only report memory per resting order")
+    parser.add_argument("--batch-size", type=int, default=500, help="Orders rewritten per script call")
+    parser.add_argument("--sample", type=int, default=1000, help="Orders sampled for the memory report")
+    parser.add_argument("--reindex", action="store_true",
+                        help="Rebuild the indexes even if nothing was migrated (books without order indexes)")
+    args = parser.parse_args()
+
+    redis_client = get_redis()
+    if args.symbols:
+        keys = [f"{KEY_PREFIX}{symbol}{KEY_SUFFIX}" for symbol in args.symbols]
+    else:
+        keys = sorted(key.decode() for key in redis_client.scan_iter(match=f"{KEY_PREFIX}*{KEY_SUFFIX}"))
+
+    for key in keys:
+        before = memory_report(redis_client, key, args.sample)
+        print(json.dumps({"before": before}))
+        if args.report_only:
+            continue
+        migrated = migrate_key(redis_client, key, args.batch_size)
+        levels = None
+        if migrated or args.reindex:
+            # Older values rest under float price-time scores; re-index them in ticks.
+            # This replaces the book's indexes, so run it with the symbol quiet.
+            levels = OrderBook(redis_client, details_symbol(key)).rebuild_indexes()
+        after = memory_report(redis_client, key, args.sample)
+        print(json.dumps({"migrated": migrated, "levels": levels, "after": after}))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Deterministic synthetic order flow for benchmarks and load tests.
+Each symbol's mid price follows a random walk; limit orders are placed a few price steps
+around it (crossing now and then), market orders take liquidity, and cancels target earlier
+limit orders of the same symbol. Arrival schedules are Poisson or bursty at a target mean rate.
+"""
+import random
+import uuid
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Optional, Union
+from app.models.instrument import get_symbol_spec
+from app.models.order import OrderCreate, OrderSide, OrderStatus, OrderType
+
+class FlowOrder:
+    """A generated order, with the attributes the matching engine reads"""
+
+    def __init__(self, order_id: str, trader_id: str, symbol: str, side: OrderSide, order_type: OrderType,
+                 price: Optional[float], quantity: float):
+        self.order_id = order_id
+        self.trader_id = trader_id
+        self.symbol = symbol
+        self.side = side
+        self.order_type = order_type
+        self.price = price
+        self.quantity = quantity
+        self.status = OrderStatus.ACTIVE
+        self.filled_quantity = 0
+
+    def to_create(self) -> OrderCreate:
+        """The API request for this order"""
+        return OrderCreate(trader_id=self.trader_id, symbol=self.symbol, side=self.side,
+                           order_type=self.order_type, quantity=self.quantity, price=self.price)
+
+class FlowCancel:
+    """A generated cancel of an earlier limit order"""
+
+    def __init__(self, symbol: str, order_id: str):
+        self.symbol = symbol
+        self.order_id = order_id
+
+FlowEvent = Union[FlowOrder, FlowCancel]
+
+class OrderFlow:
+    """
+    Generates a reproducible stream of orders and cancels.
+    - mid price random walk of price_step per step with probability volatility
+    - limit prices up to spread_levels steps either side of the mid
+    - market_ratio of orders are market orders, cancel_ratio of events cancel an earlier limit order
+    """
+
+    def __init__(self, symbols: List[str], seed: int = 1, start_price: float = 100.0, price_step: float = 0.01,
+                 volatility: float = 0.3, spread_levels: int = 10, market_ratio: float = 0.1,
+                 cancel_ratio: float = 0.2, max_quantity: float = 10.0, traders: int = 50,
+                 cancel_window: int = 1000):
+        self.symbols = symbols
+        self.random = random.Random(seed)
+        self.price_step = price_step
+        self.volatility = volatility
+        self.spread_levels = spread_levels
+        self.market_ratio = market_ratio
+        self.cancel_ratio = cancel_ratio
+        self.max_quantity = max_quantity
+        self.traders = [f"trader-{i}" for i in range(traders)]
+        self.mid: Dict[str, float] = {symbol: start_price for symbol in symbols}
+        # Recent limit orders per symbol that cancels pick from
+        self.recent: Dict[str, Deque[str]] = {symbol: deque(maxlen=cancel_window) for symbol in symbols}
+
+    def _order_id(self) -> str:
+        return str(uuid.UUID(int=self.random.getrandbits(128), version=4))
+
+    def _price(self, symbol: str, side: OrderSide) -> float:
+        spec = get_symbol_spec(symbol)
+        # Mostly passive, sometimes a level or two through the mid
+        offset = self.random.randint(-2, self.spread_levels)
+        price = self.mid[symbol] - offset * self.price_step if side == OrderSide.BUY \
+            else self.mid[symbol] + offset * self.price_step
+        price = max(price, self.price_step)
+        return spec.price(spec.to_ticks(price, exact=False))
+
+    def _quantity(self, symbol: str) -> float:
+        spec = get_symbol_spec(symbol)
+        quantity = self.random.uniform(0, self.max_quantity)
+        return spec.quantity(max(1, spec.to_lots(round(quantity, 2), exact=False)))
+
+    def next_event(self) -> FlowEvent:
+        """The next order or cancel"""
+        symbol = self.random.choice(self.symbols)
+        if self.random.random() < self.volatility:
+            self.mid[symbol] = max(self.price_step, self.mid[symbol] + self.random.choice((-1, 1)) * self.price_step)
+
+        recent = self.recent[symbol]
+        if recent and self.random.random() < self.cancel_ratio:
+            index = self.random.randrange(len(recent))
+            order_id = recent[index]
+            del recent[index]
+            return FlowCancel(symbol, order_id)
+
+        side = self.random.choice((OrderSide.BUY, OrderSide.SELL))
+        if self.random.random() < self.market_ratio:
+            return FlowOrder(self._order_id(), self.random.choice(self.traders), symbol, side,
+                             OrderType.MARKET, None, self._quantity(symbol))
+
+        order = FlowOrder(self._order_id(), self.random.choice(self.traders), symbol, side,
+                          OrderType.LIMIT, self._price(symbol, side), self._quantity(symbol))
+        recent.append(order.order_id)
+        return order
+
+    def events(self, count: int) -> Iterator[FlowEvent]:
+        """count events in order"""
+        for _ in range(count):
+            yield self.next_event()
+
+def poisson_arrivals(rate: float, seed: int = 1) -> Iterator[float]:
+    """Arrival offsets in seconds of a Poisson process with the given mean rate"""
+    rng = random.Random(seed)
+    now = 0.0
+    while True:
+        now += rng.expovariate(rate)
+        yield now
+
+def bursty_arrivals(rate: float, burst_size: int = 50, burst_factor: float = 10.0, seed: int = 1) -> Iterator[float]:
+    """
+    Arrival offsets of an on/off process with the given mean rate: bursts of about burst_size
+    arrivals at burst_factor times the rate, separated by idle gaps that keep the mean
+    """
+    rng = random.Random(seed)
+    burst_rate = rate * burst_factor
+    # Each burst of n arrivals should take n / rate on average, busy and idle time included
+    mean_gap = burst_size / rate - burst_size / burst_rate
+    now = 0.0
+    while True:
+        size = max(1, int(rng.expovariate(1 / burst_size)))
+        for _ in range(size):
+            now += rng.expovariate(burst_rate)
+            yield now
+        now += rng.expovariate(1 / mean_gap) * size / burst_size if mean_gap > 0 else 0.0
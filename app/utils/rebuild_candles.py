@@ -0,0 +1,31 @@
+import argparse
+import time
+from datetime import datetime
+from app.db.postgres import SessionLocal
+from app.services.candle_backfill import rebuild_candles, traded_symbols
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild OHLC candles in Redis from the trades table")
+    parser.add_argument("--symbol", action="append", dest="symbols",
+                        help="Symbol to rebuild (repeatable, default: every traded symbol)")
+    parser.add_argument("--intervals", help="Comma separated intervals, e.g. 1m,5m,1h (default: live intervals)")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="Only trades at or after this ISO time")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="Only trades before this ISO time")
+    parser.add_argument("--chunk-size", type=int, default=None, help="Trades read per chunk")
+    args = parser.parse_args()
+
+    intervals = args.intervals.split(",") if args.intervals else None
+    options = {"chunk_size": args.chunk_size} if args.chunk_size else {}
+
+    db = SessionLocal()
+    try:
+        for symbol in args.symbols or traded_symbols(db):
+            started = time.perf_counter()
+            loaded = rebuild_candles(db, symbol, intervals, args.start, args.end, **options)
+            summary = ", ".join(f"{name}: {count}" for name, count in loaded.items())
+            print(f"{symbol}: {summary} ({time.perf_counter() - started:.2f}s)")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
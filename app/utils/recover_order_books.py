@@ -0,0 +1,30 @@
+import argparse
+import json
+import time
+from app.config import RECOVERY_SNAPSHOT_PATH
+from app.db.postgres import SessionLocal
+from app.services.recovery import BookSnapshotter, recover_order_books
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot order books to a file, or rebuild them in Redis from it")
+    parser.add_argument("--path", default=RECOVERY_SNAPSHOT_PATH, help="Snapshot file")
+    parser.add_argument("--snapshot", action="store_true", help="Write a snapshot of the current books and exit")
+    parser.add_argument("--force", action="store_true",
+                        help="Rebuild books that still exist in Redis too (replaces them)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.snapshot:
+        summary = BookSnapshotter(path=args.path, interval=0).snapshot()
+        print(json.dumps({"snapshot": summary, "seconds": round(time.perf_counter() - started, 3)}))
+        return
+
+    db = SessionLocal()
+    try:
+        recovered = recover_order_books(db, path=args.path, force=args.force)
+    finally:
+        db.close()
+    print(json.dumps({"recovered": recovered, "seconds": round(time.perf_counter() - started, 3)}))
+
+if __name__ == "__main__":
+    main()
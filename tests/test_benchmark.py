@@ -0,0 +1,38 @@
+# tests/test_benchmark.py
+import unittest
+from unittest.mock import MagicMock
+
+from app.utils.benchmark import compare, run_backend
+from app.utils.order_flow import FlowCancel, OrderFlow
+
+class TestBenchmark(unittest.TestCase):
+    def test_synthetic_flow_is_reproducible(self):
+        """The same seed gives the same events, so every backend sees the same stream"""
+        def describe(event):
+            if isinstance(event, FlowCancel):
+                return ("cancel", event.symbol, event.order_id)
+            return (event.order_id, event.symbol, event.side, event.order_type, event.price, event.quantity)
+
+        first = [describe(event) for event in OrderFlow(["BTC/USD", "ETH/USD"], seed=7).events(300)]
+        second = [describe(event) for event in OrderFlow(["BTC/USD", "ETH/USD"], seed=7).events(300)]
+        self.assertEqual(first, second)
+        self.assertTrue(any(event[0] == "cancel" for event in first))
+
+    def test_memory_backend_report_and_regression_check(self):
+        """A run reports throughput and latency percentiles, and slower runs fail the baseline"""
+        events = OrderFlow(["BTC/USD"], seed=3, cancel_ratio=0.1).events(500)
+        report = run_backend("memory", MagicMock(), events, warmup=50)
+
+        self.assertEqual(report["orders"] + report["cancels"], 450)
+        self.assertGreater(report["fills"], 0)
+        self.assertLessEqual(report["latency_us"]["p50"], report["latency_us"]["p99"])
+        self.assertLessEqual(report["latency_us"]["p99"], report["latency_us"]["p99_9"])
+
+        self.assertEqual(compare({"memory": report}, {"memory": report}, tolerance=0.2), [])
+        slower = dict(report, orders_per_second=report["orders_per_second"] / 2)
+        regressions = compare({"memory": slower}, {"memory": report}, tolerance=0.2)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn("orders/s", regressions[0])
+
+if __name__ == '__main__':
+    unittest.main()
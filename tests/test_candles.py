@@ -0,0 +1,51 @@
+# tests/test_candles.py
+import unittest
+import numpy as np
+
+from app.services.candle_backfill import compute_candles
+from app.services.candles import aggregate_trades
+
+def trade(timestamp, price, quantity):
+    return {"symbol": "BTC/USD", "price": price, "quantity": quantity, "executed_at": timestamp}
+
+class TestCandleAggregation(unittest.TestCase):
+    def test_trades_collapse_into_one_candle_per_interval(self):
+        """Trades are folded into time-ordered OHLCV candles, open and close by execution order"""
+        trades = [
+            trade(120.5, 100.0, 1.0),
+            trade(130.0, 103.0, 2.0),
+            trade(150.0, 99.0, 0.5),
+            trade(179.9, 101.0, 1.5),
+            trade(180.0, 102.0, 1.0),
+        ]
+
+        self.assertEqual(aggregate_trades(trades, 60), [
+            [120, 100.0, 103.0, 99.0, 101.0, 5.0],
+            [180, 102.0, 102.0, 102.0, 102.0, 1.0],
+        ])
+        self.assertEqual(aggregate_trades(trades, 300), [
+            [0, 100.0, 103.0, 99.0, 102.0, 6.0],
+        ])
+
+    def test_chunked_rebuild_matches_live_aggregation(self):
+        """Candles computed chunk by chunk equal those built trade by trade"""
+        rng = np.random.default_rng(7)
+        timestamps = np.cumsum(rng.uniform(0, 20, 500))
+        prices = 100 + np.cumsum(rng.normal(0, 0.5, 500))
+        quantities = rng.uniform(0.1, 2.0, 500)
+        trades = np.column_stack([timestamps, prices, quantities])
+
+        candles = compute_candles(np.array_split(trades, 7), {"1m": 60, "15m": 900})
+
+        for name, seconds in (("1m", 60), ("15m", 900)):
+            expected = aggregate_trades(
+                [trade(*row) for row in trades.tolist()], seconds
+            )
+            rebuilt = np.column_stack(candles[name]).tolist()
+            self.assertEqual(len(rebuilt), len(expected))
+            for row, expected_row in zip(rebuilt, expected):
+                self.assertEqual(row[0], expected_row[0])
+                np.testing.assert_allclose(row[1:], expected_row[1:])
+
+if __name__ == '__main__':
+    unittest.main()
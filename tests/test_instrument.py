@@ -0,0 +1,39 @@
+# tests/test_instrument.py
+import unittest
+
+from app.models.instrument import SymbolSpec
+from app.models.order import OrderSide
+from app.models.order_book import OrderBook, member_order_id, order_member
+
+class TestSymbolSpec(unittest.TestCase):
+    def setUp(self):
+        self.spec = SymbolSpec("BTC/USD", tick_size="0.01", lot_size="0.0001")
+
+    def test_prices_and_quantities_convert_exactly(self):
+        """Values on the grid convert to ints and back without float drift"""
+        self.assertEqual(self.spec.to_ticks(50100.29), 5010029)
+        self.assertEqual(self.spec.to_lots(0.3), 3000)
+        self.assertEqual(self.spec.to_lots(0.1) + self.spec.to_lots(0.2), self.spec.to_lots(0.3))
+        self.assertEqual(self.spec.price(5010029), 50100.29)
+        self.assertEqual(self.spec.quantity(3000), 0.3)
+
+        with self.assertRaises(ValueError):
+            self.spec.to_ticks(100.005)
+        with self.assertRaises(ValueError):
+            self.spec.to_lots(0.00005)
+        self.assertEqual(self.spec.to_ticks(100.004, exact=False), 10000)
+
+    def test_scores_and_members_give_price_time_priority(self):
+        """Sorting by (score, member) puts the best price first, then the earliest order"""
+        orders = [
+            {"order_id": "late", "side": OrderSide.BUY, "price_ticks": 10000, "created_at": 1700000001.5},
+            {"order_id": "early", "side": OrderSide.BUY, "price_ticks": 10000, "created_at": 1700000000.25},
+            {"order_id": "better", "side": OrderSide.BUY, "price_ticks": 10001, "created_at": 1700000002.0},
+            {"order_id": "older", "side": OrderSide.BUY, "price_ticks": 10000, "created_at": 999999999.0},
+        ]
+        ranked = sorted(orders, key=lambda o: (OrderBook.order_score(o["side"], o["price_ticks"]), order_member(o)))
+        self.assertEqual([o["order_id"] for o in ranked], ["better", "older", "early", "late"])
+        self.assertEqual(member_order_id(order_member(orders[0]).encode()), "late")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# tests/test_load_test.py
+import asyncio
+import itertools
+import unittest
+
+from app.services.metrics import LatencyHistogram
+from app.utils.load_test import RejectedError, run_load
+from app.utils.order_flow import OrderFlow, bursty_arrivals, poisson_arrivals
+
+class RecordingTarget:
+    """Accepts every order under a new id and remembers what was cancelled"""
+
+    def __init__(self, reject_every: int = 0):
+        self.ids = itertools.count()
+        self.reject_every = reject_every
+        self.submitted = 0
+        self.cancelled = []
+
+    async def submit(self, order):
+        self.submitted += 1
+        if self.reject_every and self.submitted % self.reject_every == 0:
+            raise RejectedError("too big")
+        return f"server-{next(self.ids)}"
+
+    async def cancel(self, order_id):
+        self.cancelled.append(order_id)
+        return True
+
+class TestLoadGenerator(unittest.TestCase):
+    def test_histogram_percentiles_within_bucket_precision(self):
+        """Log-linear buckets report values within 1/64 and keep small values exact"""
+        histogram = LatencyHistogram()
+        for value in range(1, 10001):
+            histogram.record(value)
+        for percentile, expected in ((50, 5000), (99, 9900), (99.9, 9990)):
+            self.assertAlmostEqual(histogram.value_at_percentile(percentile), expected, delta=expected / 64)
+        self.assertEqual(histogram.value_at_percentile(0.5), 50)
+        self.assertEqual(histogram.value_at_percentile(100), 10000)
+
+    def test_arrivals_keep_the_mean_rate(self):
+        for arrivals in (poisson_arrivals(1000, seed=3), bursty_arrivals(1000, burst_size=20, seed=3)):
+            offsets = list(itertools.islice(arrivals, 50000))
+            self.assertAlmostEqual(len(offsets) / offsets[-1], 1000, delta=50)
+
+    def test_cancels_use_server_order_ids(self):
+        """Cancels are sent with the id the server returned; rejected orders are never cancelled"""
+        target = RecordingTarget(reject_every=5)
+        flow = OrderFlow(["BTC/USD"], seed=4, cancel_ratio=0.3)
+        stats = asyncio.run(run_load(target, flow.events(300), (i / 1e6 for i in itertools.count()),
+                                     count=300, max_in_flight=1))
+
+        report = stats.report()
+        self.assertEqual(report["errors"], {})
+        self.assertTrue(target.cancelled)
+        self.assertTrue(all(order_id.startswith("server-") for order_id in target.cancelled))
+        self.assertEqual(report["operations"]["cancel"]["outcomes"]["cancelled"], len(target.cancelled))
+        rejected = sum(entry["outcomes"].get("rejected", 0) for entry in report["operations"].values())
+        self.assertEqual(rejected, target.submitted // 5)
+        self.assertEqual(report["requests"] + report["operations"]["cancel"]["outcomes"].get("skipped", 0), 300)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,8 +2,9 @@
 import unittest
 import uuid
 from datetime import datetime, timezone
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
+from app.models.memory_order_book import InMemoryOrderBook
 from app.services.matching_engine import MatchingEngine
 from app.models.order import OrderSide, OrderType, OrderStatus
 
@@ -48,5 +49,69 @@ class TestMatchingEngine(unittest.TestCase):
         self.assertEqual(buy_order.filled_quantity, 0)
         self.assertEqual(buy_order.status, OrderStatus.ACTIVE)
 
+class TestMarketOrders(unittest.TestCase):
+    def setUp(self):
+        self.redis_mock = MagicMock()
+        # No last traded price yet
+        self.redis_mock.get.return_value = None
+        self.matching_engine = MatchingEngine(self.redis_mock, backend="memory", persister=False)
+        self.order_book = InMemoryOrderBook("BTC/USD")
+        self.matching_engine.get_order_book = lambda symbol: self.order_book
+        # Small ranges so sweeps have to refetch
+        self.matching_engine.fetch_size = 2
+        for price in (100.0, 100.0, 101.0, 102.0, 110.0):
+            self.order_book.add_order(MockOrder(OrderSide.SELL, price, 1.0))
+
+    def market_order(self, side, quantity):
+        order = MockOrder(side, None, quantity)
+        order.order_type = OrderType.MARKET
+        return order
+
+    def test_market_order_sweeps_levels_across_fetches(self):
+        """A market order takes liquidity level by level, in ranges of fetch_size orders"""
+        order = self.market_order(OrderSide.BUY, 3.5)
+        trades = self.matching_engine.process_order(order)
+
+        self.assertEqual([(t["price"], t["quantity"]) for t in trades],
+                         [(100.0, 1.0), (100.0, 1.0), (101.0, 1.0), (102.0, 0.5)])
+        self.assertEqual(order.status, OrderStatus.FILLED)
+        self.assertEqual(self.order_book.get_depth_snapshot()["asks"][0],
+                         {"price": 102.0, "quantity": 0.5, "orders": 1})
+
+    @patch("app.services.matching_engine.MARKET_ORDER_MAX_SLIPPAGE", 0.05)
+    @patch("app.services.matching_engine.MARKET_ORDER_MAX_LEVELS", 2)
+    def test_protection_limits_cancel_the_remainder(self):
+        """Market orders stop at the level and slippage limits and never rest"""
+        order = self.market_order(OrderSide.BUY, 10.0)
+        trades = self.matching_engine.process_order(order)
+        self.assertEqual([t["price"] for t in trades], [100.0, 100.0, 101.0])
+        self.assertEqual(order.status, OrderStatus.CANCELLED)
+        self.assertEqual(order.filled_quantity, 3.0)
+        self.assertEqual(self.order_book.get_best_bid(), (None, None))
+
+        # 5% above the last price of 101 allows 102 but not 110
+        self.redis_mock.get.return_value = b"101"
+        order = self.market_order(OrderSide.BUY, 10.0)
+        trades = self.matching_engine.process_order(order)
+        self.assertEqual([t["price"] for t in trades], [102.0])
+        self.assertEqual(order.status, OrderStatus.CANCELLED)
+
+    def test_maker_cancelled_during_the_sweep_is_not_counted_as_filled(self):
+        """Lots of a maker removed between peek_orders and apply_fills are not filled on the taker"""
+        peek_orders = self.order_book.peek_orders
+
+        def peek_then_cancel(side, count, offset=0):
+            makers = peek_orders(side, count, offset)
+            if offset == 0:
+                self.order_book.cancel_orders([makers[0]["order_id"]])
+            return makers
+        self.order_book.peek_orders = peek_then_cancel
+
+        order = MockOrder(OrderSide.BUY, 100.0, 2.0)
+        trades = self.matching_engine.process_order(order)
+        self.assertEqual([(t["price"], t["quantity"]) for t in trades], [(100.0, 1.0)])
+        self.assertEqual(order.filled_quantity, 1.0)
+        self.assertEqual(order.status, OrderStatus.PARTIALLY_FILLED)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
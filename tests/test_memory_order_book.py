@@ -0,0 +1,174 @@
+# tests/test_memory_order_book.py
+import unittest
+from unittest.mock import MagicMock
+
+from app.models.memory_order_book import InMemoryOrderBook, RedisBookMirror
+from app.models.order import OrderSide, OrderStatus
+from app.services.matching_engine import MatchingEngine
+from app.services.metrics import OrderMetrics
+from tests.test_matching_engine import MockOrder
+from tests.test_order_book import RedisBookTestCase
+
+class TestInMemoryOrderBook(unittest.TestCase):
+    def setUp(self):
+        self.order_book = InMemoryOrderBook("BTC/USD")
+        self.ticks = self.order_book.spec.to_ticks
+        self.lots = self.order_book.spec.to_lots
+
+    def test_best_prices_follow_price_time_priority(self):
+        """Best bid is the highest price, best ask the lowest, FIFO within a level"""
+        first_bid = MockOrder(OrderSide.BUY, 100.0, 1.0)
+        second_bid = MockOrder(OrderSide.BUY, 100.0, 1.0)
+        self.order_book.add_order(MockOrder(OrderSide.BUY, 99.0, 1.0))
+        self.order_book.add_order(first_bid)
+        self.order_book.add_order(second_bid)
+        self.order_book.add_order(MockOrder(OrderSide.SELL, 102.0, 1.0))
+        self.order_book.add_order(MockOrder(OrderSide.SELL, 101.0, 1.0))
+
+        self.assertEqual(self.order_book.get_best_bid(), (first_bid.order_id, self.ticks(100.0)))
+        self.assertEqual(self.order_book.get_best_ask()[1], self.ticks(101.0))
+
+        self.order_book.remove_order(first_bid.order_id)
+        self.assertEqual(self.order_book.get_best_bid(), (second_bid.order_id, self.ticks(100.0)))
+
+        self.order_book.remove_order(second_bid.order_id)
+        self.assertEqual(self.order_book.get_best_bid()[1], self.ticks(99.0))
+
+    def test_fill_order_removes_fully_filled_orders(self):
+        """Partial fills keep the order resting; a full fill removes it"""
+        ask = MockOrder(OrderSide.SELL, 101.0, 5.0)
+        self.order_book.add_order(ask)
+
+        details = self.order_book.fill_order(ask.order_id, self.lots(2.0))
+        self.assertEqual(details["status"], OrderStatus.PARTIALLY_FILLED)
+        self.assertEqual(self.order_book.get_best_ask()[0], ask.order_id)
+
+        details = self.order_book.fill_order(ask.order_id, self.lots(3.0))
+        self.assertEqual(details["status"], OrderStatus.FILLED)
+        self.assertEqual(self.order_book.get_best_ask(), (None, None))
+
+    def test_depth_snapshot_aggregates_price_levels(self):
+        """L2 levels hold open quantity and order count through adds, fills and cancels"""
+        first_ask = MockOrder(OrderSide.SELL, 101.0, 5.0)
+        second_ask = MockOrder(OrderSide.SELL, 101.0, 2.0)
+        self.order_book.add_order(first_ask)
+        self.order_book.add_order(second_ask)
+        self.order_book.add_order(MockOrder(OrderSide.SELL, 102.0, 1.0))
+        self.order_book.add_order(MockOrder(OrderSide.BUY, 100.0, 4.0))
+
+        self.order_book.fill_order(first_ask.order_id, self.lots(1.5))
+        snapshot = self.order_book.get_depth_snapshot(depth=10)
+        self.assertEqual(snapshot["asks"], [
+            {"price": 101.0, "quantity": 5.5, "orders": 2},
+            {"price": 102.0, "quantity": 1.0, "orders": 1}
+        ])
+        self.assertEqual(snapshot["bids"], [{"price": 100.0, "quantity": 4.0, "orders": 1}])
+
+        self.order_book.remove_order(second_ask.order_id)
+        self.order_book.fill_order(first_ask.order_id, self.lots(3.5))
+        snapshot = self.order_book.get_depth_snapshot(depth=1)
+        self.assertEqual(snapshot["asks"], [{"price": 102.0, "quantity": 1.0, "orders": 1}])
+
+    def test_level_changes_are_drained_as_absolute_totals(self):
+        """Changed levels are reported once with their new totals; removed levels have 0 orders"""
+        ask = MockOrder(OrderSide.SELL, 101.0, 5.0)
+        self.order_book.add_order(ask)
+        self.order_book.add_order(MockOrder(OrderSide.BUY, 100.0, 2.0))
+        self.assertEqual(self.order_book.drain_level_changes(), {
+            "bids": [[100.0, 2.0, 1]],
+            "asks": [[101.0, 5.0, 1]]
+        })
+        self.assertIsNone(self.order_book.drain_level_changes())
+
+        self.order_book.fill_order(ask.order_id, self.lots(5.0))
+        self.assertEqual(self.order_book.drain_level_changes(), {"bids": [], "asks": [[101.0, 0, 0]]})
+
+        sequence = self.order_book.next_sequence()
+        self.assertEqual(self.order_book.get_depth_snapshot()["seq"], sequence)
+
+    def test_mirror_receives_the_level_totals_after_each_change(self):
+        """Every mirrored change carries its level's (lots, orders), (0, 0) once the level is gone"""
+        mirror = MagicMock()
+        order_book = InMemoryOrderBook("BTC/USD", mirror)
+        first_ask = MockOrder(OrderSide.SELL, 101.0, 5.0)
+        second_ask = MockOrder(OrderSide.SELL, 101.0, 2.0)
+        order_book.add_order(first_ask)
+        order_book.add_order(second_ask)
+        order_book.fill_order(first_ask.order_id, self.lots(1.0))
+        order_book.remove_order(second_ask.order_id)
+        order_book.fill_order(first_ask.order_id, self.lots(4.0))
+
+        levels = [call.args[2] for call in mirror.method_calls]
+        self.assertEqual([call[0] for call in mirror.method_calls], ["save", "save", "save", "remove", "remove"])
+        self.assertEqual(levels, [(self.lots(5.0), 1), (self.lots(7.0), 2), (self.lots(6.0), 2),
+                                  (self.lots(4.0), 1), (0, 0)])
+
+    def test_cancel_orders_keeps_trader_index_and_depth(self):
+        """Mass cancels take only resting orders off the book and out of the trader index"""
+        quotes = [MockOrder(OrderSide.BUY, 100.0, 1.0), MockOrder(OrderSide.SELL, 101.0, 2.0)]
+        other = MockOrder(OrderSide.SELL, 101.0, 3.0)
+        other.trader_id = "other_trader"
+        for order in quotes + [other]:
+            self.order_book.add_order(order)
+        self.order_book.fill_order(quotes[1].order_id, self.lots(0.5))
+
+        order_ids = list(self.order_book.trader_orders["test_trader"])
+        cancelled = self.order_book.cancel_orders(order_ids + ["unknown"])
+
+        self.assertEqual({d["order_id"] for d in cancelled}, {order.order_id for order in quotes})
+        self.assertTrue(all(d["status"] == OrderStatus.CANCELLED for d in cancelled))
+        self.assertNotIn("test_trader", self.order_book.trader_orders)
+        self.assertEqual(self.order_book.open_order_ids(), [other.order_id])
+        self.assertEqual(self.order_book.get_depth_snapshot()["asks"], [{"price": 101.0, "quantity": 3.0, "orders": 1}])
+        self.assertEqual(self.order_book.cancel_orders(order_ids), [])
+
+    def test_matching_engine_uses_memory_backend(self):
+        """A crossing order trades against the in-memory book without touching Redis"""
+        redis_mock = MagicMock()
+        matching_engine = MatchingEngine(redis_mock, backend="memory")
+        matching_engine.get_order_book = lambda symbol: self.order_book
+
+        ask = MockOrder(OrderSide.SELL, 101.0, 5.0)
+        self.order_book.add_order(ask)
+
+        buy_order = MockOrder(OrderSide.BUY, 102.0, 3.0)
+        trades = matching_engine.process_order(buy_order)
+
+        self.assertEqual(len(trades), 1)
+        self.assertEqual(trades[0]["price"], 101.0)
+        self.assertEqual(buy_order.status, OrderStatus.FILLED)
+        self.assertEqual(self.order_book.get_order(ask.order_id)["filled_lots"], self.lots(3.0))
+        self.assertEqual(buy_order.filled_quantity, 3.0)
+        redis_mock.zrange.assert_not_called()
+
+class TestRedisBookMirror(RedisBookTestCase):
+    def test_failed_mirror_batch_is_counted_and_written_again(self):
+        """A batch Redis refused is retried ahead of newer changes, so the mirrored depth catches up"""
+        mirror = RedisBookMirror(self.redis)
+        mirror.metrics = OrderMetrics()
+        apply = mirror._apply
+        attempts = []
+
+        def apply_once_failing(ops):
+            attempts.append(len(ops))
+            if len(attempts) == 1:
+                raise ConnectionError("Redis unavailable")
+            apply(ops)
+
+        mirror._apply = apply_once_failing
+        order_book = InMemoryOrderBook("BTC/USD", mirror)
+        ask = MockOrder(OrderSide.SELL, 101.0, 5.0)
+        order_book.add_order(ask)
+        mirror.flush(timeout=5)
+        order_book.add_order(MockOrder(OrderSide.SELL, 101.0, 2.0))
+        order_book.fill_order(ask.order_id, self.lots(1.0))
+        mirror.flush(timeout=5)
+
+        self.assertEqual(mirror.metrics.mirror_errors, 1)
+        self.assertGreater(len(attempts), 1)
+        self.assertEqual(self.order_book.get_depth_snapshot()["asks"],
+                         [{"price": 101.0, "quantity": 6.0, "orders": 2}])
+        self.assertEqual(self.order_book.get_order(ask.order_id)["filled_lots"], self.lots(1.0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+# tests/test_messaging.py
+import json
+import unittest
+from unittest.mock import MagicMock
+
+from app.messaging.consumer import BatchNotMatchedError, SymbolConsumer
+from app.messaging.publisher import ExecutionPublisher, OrderPublisher, order_queue
+from app.messaging.transport import InProcessTransport
+from app.models.memory_order_book import InMemoryOrderBook
+from app.models.order import OrderCreate, OrderSide, OrderStatus, OrderType
+from app.services.matching_engine import MatchingEngine
+from tests.test_matching_engine import MockOrder
+
+def make_order(price: float) -> OrderCreate:
+    return OrderCreate(trader_id="trader_1", symbol="BTC/USD", side=OrderSide.BUY,
+                       order_type=OrderType.LIMIT, quantity=1.0, price=price)
+
+class TestQueuedIngestion(unittest.TestCase):
+    def setUp(self):
+        self.transport = InProcessTransport()
+        self.publisher = OrderPublisher(self.transport)
+        for i in range(25):
+            self.publisher.publish(f"order-{i}", make_order(100.0 + i))
+
+    def test_orders_are_matched_in_order_in_prefetch_sized_batches(self):
+        """Queued orders reach the handler in publish order, with their ids, and every batch is acked"""
+        batches = []
+
+        def handler(orders, redelivered):
+            batches.append(orders)
+            return {"matched": len(orders), "rejected": 0}
+
+        consumer = SymbolConsumer(self.transport, "BTC/USD", handler=handler, prefetch=10, poll_interval=0.01)
+        consumer.start()
+        consumer.stop(timeout=5)
+
+        orders = [order for batch in batches for order in batch]
+        self.assertEqual([order_id for order_id, _ in orders], [f"order-{i}" for i in range(25)])
+        self.assertEqual(orders[3][1].price, 103.0)
+        self.assertTrue(all(len(batch) <= 10 for batch in batches))
+        self.assertLess(len(batches), 25)
+        self.assertEqual(consumer.orders, 25)
+        self.assertEqual(self.transport.pending(order_queue("BTC/USD")), 0)
+
+    def test_batch_failing_before_matching_is_retried_as_redelivered_then_rejected(self):
+        """A batch that keeps failing before matching is retried with duplicate checks, then dropped"""
+        attempts = []
+
+        def handler(orders, redelivered):
+            attempts.append(redelivered)
+            raise BatchNotMatchedError("database unavailable")
+
+        consumer = SymbolConsumer(self.transport, "BTC/USD", handler=handler, prefetch=100,
+                                  poll_interval=0.01, max_retries=2)
+        consumer.start()
+        consumer.stop(timeout=5)
+
+        self.assertEqual(attempts, [False, True, True])
+        self.assertEqual(consumer.orders, 0)
+        self.assertEqual(self.transport.pending(order_queue("BTC/USD")), 0)
+
+    def test_batch_failing_after_matching_started_is_not_matched_again(self):
+        """Once the books changed, a failed batch is rejected instead of being matched twice"""
+        attempts = []
+
+        def handler(orders, redelivered):
+            attempts.append(redelivered)
+            raise RuntimeError("commit failed")
+
+        consumer = SymbolConsumer(self.transport, "BTC/USD", handler=handler, prefetch=100,
+                                  poll_interval=0.01, max_retries=2)
+        consumer.start()
+        consumer.stop(timeout=5)
+
+        self.assertEqual(attempts, [False])
+        self.assertEqual(self.transport.pending(order_queue("BTC/USD")), 0)
+
+class FlakyChannel:
+    """Confirmed channel double that fails its first publish_batch calls"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.batches = []
+        self.is_open = True
+
+    def publish_batch(self, messages, timeout):
+        if self.failures:
+            self.failures -= 1
+            raise TimeoutError("broker slow")
+        self.batches.append(messages)
+
+    def close(self):
+        self.is_open = False
+
+class TestExecutionPublisher(unittest.TestCase):
+    def test_messages_are_published_in_confirmed_batches_and_retried_in_order(self):
+        """Buffered messages go out in batches; a failed batch is published again before later ones"""
+        channel = FlakyChannel(failures=2)
+        publisher = ExecutionPublisher(lambda: channel, batch_size=10, flush_interval=0.01)
+        for i in range(25):
+            publisher.publish_trade({"symbol": "BTC/USD", "trade_id": f"trade-{i}"})
+        publisher.stop(timeout=5)
+
+        messages = [message for batch in channel.batches for message in batch]
+        self.assertEqual([json.loads(body)["trade_id"] for _, body, _ in messages],
+                         [f"trade-{i}" for i in range(25)])
+        self.assertTrue(all(len(batch) <= 10 for batch in channel.batches))
+        self.assertEqual(messages[0][0], "trade.BTC/USD")
+        self.assertEqual((publisher.published, publisher.retries, publisher.dropped), (25, 2, 0))
+
+    def test_engine_publishes_trades_and_execution_reports(self):
+        """A fill produces the trade and a report for each side; a cancel produces a report"""
+        executions = MagicMock()
+        matching_engine = MatchingEngine(MagicMock(), backend="memory", persister=False, journal=False,
+                                         executions=executions)
+        books = {}
+        matching_engine.get_order_book = lambda symbol: books.setdefault(symbol, InMemoryOrderBook(symbol))
+
+        maker = MockOrder(OrderSide.SELL, 100.0, 2.0)
+        matching_engine.process_order(maker)
+        taker = MockOrder(OrderSide.BUY, 100.0, 1.0)
+        trades = matching_engine.process_order(taker)
+        matching_engine.cancel_orders("BTC/USD", [maker.order_id])
+
+        executions.publish_trade.assert_called_once_with(trades[0])
+        reports = [call.args[0] for call in executions.publish_execution_report.call_args_list]
+        self.assertEqual([(report["order_id"], report["status"]) for report in reports], [
+            (maker.order_id, OrderStatus.ACTIVE),
+            (maker.order_id, OrderStatus.PARTIALLY_FILLED),
+            (taker.order_id, OrderStatus.FILLED),
+            (maker.order_id, OrderStatus.CANCELLED),
+        ])
+        self.assertEqual(reports[1]["filled_quantity"], 1.0)
+        self.assertEqual(reports[2]["trade_ids"], [trades[0]["trade_id"]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+# tests/test_metrics.py
+import unittest
+from unittest.mock import MagicMock
+
+from app.models.memory_order_book import InMemoryOrderBook
+from app.models.order import OrderSide
+from app.services.matching_engine import MatchingEngine
+from app.services.metrics import OrderMetrics
+from tests.test_matching_engine import MockOrder
+
+class TestOrderMetrics(unittest.TestCase):
+    def test_engine_records_stages_and_counters_per_symbol(self):
+        """Matching feeds per-symbol stage histograms and counters, rendered for Prometheus"""
+        matching_engine = MatchingEngine(MagicMock(), backend="memory", persister=False, journal=False)
+        books = {}
+        matching_engine.get_order_book = lambda symbol: books.setdefault(symbol, InMemoryOrderBook(symbol))
+        matching_engine.metrics = metrics = OrderMetrics()
+
+        for price in (100.0, 101.0, 102.0):
+            matching_engine.process_order(MockOrder(OrderSide.SELL, price, 1.0))
+        trades = matching_engine.process_order(MockOrder(OrderSide.BUY, 101.0, 1.5))
+        self.assertEqual(len(trades), 2)
+        resting = MockOrder(OrderSide.BUY, 90.0, 1.0)
+        matching_engine.process_order(resting)
+        matching_engine.cancel_orders("BTC/USD", [resting.order_id, "unknown"])
+
+        symbol = metrics.symbol("BTC/USD")
+        self.assertEqual((symbol.orders, symbol.fills, symbol.cancels), (5, 2, 1))
+        self.assertEqual(symbol.stages["match"].total, 5)
+        self.assertEqual(symbol.stages["publish"].total, 5)
+        self.assertEqual(symbol.stages["fill"].total, 2)
+
+        text = metrics.prometheus()
+        self.assertIn('order_stage_latency_seconds_count{symbol="BTC/USD",stage="match"} 5', text)
+        self.assertIn('order_stage_latency_seconds{symbol="BTC/USD",stage="fill",quantile="0.99"}', text)
+        self.assertIn('fills_total{symbol="BTC/USD"} 2', text)
+        self.assertIn('cancels_total{symbol="BTC/USD"} 1', text)
+        self.assertIn("# TYPE redis_calls_total counter", text)
+
+if __name__ == '__main__':
+    unittest.main()
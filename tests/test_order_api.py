@@ -0,0 +1,133 @@
+# tests/test_order_api.py
+import unittest
+from unittest.mock import patch
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.api import orders as orders_api
+from app.messaging.consumer import match_queued_orders
+from app.db.postgres import Base
+from app.models.order import OrderCreate, OrderModel, OrderSide, OrderStatus, OrderType
+from app.services.matching_engine import MatchingEngine
+from app.services.order_service import OrderService
+from tests.test_order_book import RedisBookTestCase
+
+def order(side: str, price: float, quantity: float = 1.0) -> dict:
+    return {"trader_id": "trader_1", "symbol": "BTC/USD", "side": side, "order_type": "limit",
+            "quantity": quantity, "price": price}
+
+class OrderApiTestCase(RedisBookTestCase):
+    """Orders API and OrderService on SQLite and a fakeredis book"""
+
+    def setUp(self):
+        super().setUp()
+        redis = patch("app.services.order_service.get_redis", return_value=self.redis)
+        redis.start()
+        self.addCleanup(redis.stop)
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=engine)
+        self.session_factory = sessionmaker(bind=engine)
+
+        app = FastAPI()
+        app.include_router(orders_api.router, prefix="/orders")
+
+        def get_db():
+            db = self.session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[orders_api.get_db] = get_db
+        self.client = TestClient(app)
+
+    def stored(self):
+        db = self.session_factory()
+        try:
+            return {row.order_id: (row.status, row.filled_quantity) for row in db.scalars(select(OrderModel))}
+        finally:
+            db.close()
+
+class TestCreateOrders(OrderApiTestCase):
+    def test_batch_is_matched_in_order_with_rejections_in_place(self):
+        """Valid orders are stored and matched in arrival order; invalid ones get their error"""
+        db = self.session_factory()
+        order_service = OrderService(db)
+        results = order_service.create_orders([OrderCreate(**order("sell", 100.0)),
+                                               OrderCreate(**order("buy", 100.0, quantity=-1.0)),
+                                               OrderCreate(**order("buy", 100.0))],
+                                              ["sell-1", "bad-1", "buy-1"])
+        db.close()
+
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual([results[0][0].order_id, results[2][0].order_id], ["sell-1", "buy-1"])
+        self.assertEqual([(trade["buy_order_id"], trade["sell_order_id"]) for trade in results[2][1]],
+                         [("buy-1", "sell-1")])
+        self.assertEqual(self.stored(), {"sell-1": (OrderStatus.FILLED, 1.0), "buy-1": (OrderStatus.FILLED, 1.0)})
+
+    def test_batch_endpoint_reports_errors_per_order(self):
+        response = self.client.post("/orders/batch", json=[order("sell", 100.0), order("buy", 0.0)])
+
+        self.assertEqual(response.status_code, 201)
+        results = response.json()["results"]
+        self.assertEqual(results[0]["order"]["status"], "active")
+        self.assertIsNone(results[0]["error"])
+        self.assertEqual(results[1]["error"], "Limit order price must be positive")
+
+    def test_oversized_batch_is_rejected_before_either_path(self):
+        for sequencer in (False, True):
+            with patch.object(orders_api, "MAX_ORDER_BATCH_SIZE", 2), \
+                    patch.object(orders_api, "ORDER_SEQUENCER_ENABLED", sequencer), \
+                    patch.object(orders_api, "get_order_sequencer") as get_order_sequencer:
+                response = self.client.post("/orders/batch", json=[order("sell", 100.0)] * 3)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()["detail"], "Batch exceeds 2 orders")
+            get_order_sequencer.assert_not_called()
+        self.assertEqual(self.stored(), {})
+
+    def test_sequenced_batch_reports_failures_per_order(self):
+        """With the sequencer, an order failing unexpectedly does not hide the ones already matched"""
+
+        class Sequencer:
+            def __init__(self, session_factory):
+                self.session_factory = session_factory
+
+            async def submit(self, symbol, order_create):
+                if order_create.price == 99.0:
+                    raise RuntimeError("matching failed")
+                db = self.session_factory()
+                try:
+                    return OrderService(db).create_order(order_create)
+                finally:
+                    db.close()
+
+        with patch.object(orders_api, "ORDER_SEQUENCER_ENABLED", True), \
+                patch.object(orders_api, "get_order_sequencer", return_value=Sequencer(self.session_factory)):
+            response = self.client.post("/orders/batch", json=[order("sell", 100.0), order("sell", 99.0)])
+
+        self.assertEqual(response.status_code, 201)
+        first, second = response.json()["results"]
+        self.assertEqual(first["order"]["status"], "active")
+        self.assertEqual(second["error"], "Order could not be processed (RuntimeError)")
+        self.assertEqual(list(self.stored()), [first["order"]["order_id"]])
+
+class TestQueuedBatchFailure(OrderApiTestCase):
+    def test_batch_failing_after_matching_stores_its_orders_as_rejected(self):
+        """Orders of a batch that fails mid-match come off the books and resolve as REJECTED"""
+        orders = [("sell-1", OrderCreate(**order("sell", 101.0))), ("buy-1", OrderCreate(**order("buy", 100.0)))]
+
+        with patch("app.db.postgres.SessionLocal", self.session_factory), \
+                patch.object(MatchingEngine, "flush_market_data", side_effect=RuntimeError("candle write failed")):
+            with self.assertRaises(RuntimeError):
+                match_queued_orders(orders)
+
+        self.assertEqual(self.stored(), {"sell-1": (OrderStatus.REJECTED, 0.0), "buy-1": (OrderStatus.REJECTED, 0.0)})
+        self.assertEqual(self.order_book.get_depth_snapshot()["asks"], [])
+        self.assertIsNone(self.engine().locate_order("buy-1"))
+
+if __name__ == '__main__':
+    unittest.main()
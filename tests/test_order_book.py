@@ -0,0 +1,127 @@
+# tests/test_order_book.py
+import unittest
+from unittest.mock import patch
+
+import fakeredis
+
+from app.models.order import OrderSide, OrderStatus, OrderType
+from app.models.order_book import OrderBook
+from app.services.matching_engine import MatchingEngine
+from tests.test_matching_engine import MockOrder
+
+class RedisBookTestCase(unittest.TestCase):
+    """Redis order book on fakeredis. Its Lua has no struct library, so details are stored as JSON"""
+
+    def setUp(self):
+        codec = patch("app.models.order_codec.ORDER_DETAILS_CODEC", "json")
+        codec.start()
+        self.addCleanup(codec.stop)
+        self.redis = fakeredis.FakeRedis()
+        self.order_book = OrderBook(self.redis, "BTC/USD")
+        self.ticks = self.order_book.spec.to_ticks
+        self.lots = self.order_book.spec.to_lots
+
+    def engine(self, backend: str = "redis") -> MatchingEngine:
+        return MatchingEngine(self.redis, backend=backend, persister=False, journal=False, executions=False)
+
+    def rest(self, side, price: float, quantity: float) -> MockOrder:
+        order = MockOrder(side, price, quantity)
+        self.engine().process_order(order)
+        return order
+
+class TestApplyFills(RedisBookTestCase):
+    def test_fills_apply_only_to_makers_unchanged_since_peek(self):
+        """A maker read twice is only filled once; the stale second fill comes back as None"""
+        maker = self.rest(OrderSide.SELL, 100.0, 5.0)
+        peeked = self.order_book.peek_orders(OrderSide.SELL, 10)
+
+        first = self.order_book.apply_fills([(peeked[0], self.lots(3.0))])
+        second = self.order_book.apply_fills([(peeked[0], self.lots(3.0))])
+
+        self.assertEqual(first[0]["status"], OrderStatus.PARTIALLY_FILLED)
+        self.assertEqual(second, [None])
+        self.assertEqual(self.order_book.get_order(maker.order_id)["filled_lots"], self.lots(3.0))
+        self.assertEqual(self.order_book.get_depth_snapshot()["asks"],
+                         [{"price": 100.0, "quantity": 2.0, "orders": 1}])
+
+    def test_maker_cancelled_during_the_match_does_not_trade(self):
+        """A maker cancelled between peek and apply stays cancelled and the taker rests instead"""
+        maker = self.rest(OrderSide.SELL, 100.0, 5.0)
+        peek_orders = OrderBook.peek_orders
+
+        def peek_then_cancel(order_book, *args, **kwargs):
+            makers = peek_orders(order_book, *args, **kwargs)
+            order_book.cancel_orders([maker.order_id])
+            return makers
+
+        taker = MockOrder(OrderSide.BUY, 100.0, 2.0)
+        with patch.object(OrderBook, "peek_orders", peek_then_cancel):
+            trades = self.engine().process_order(taker)
+
+        self.assertEqual(trades, [])
+        self.assertEqual(taker.status, OrderStatus.ACTIVE)
+        self.assertIsNone(self.order_book.get_order(maker.order_id))
+        self.assertEqual(self.redis.zcard(self.order_book.sell_orders_key), 0)
+        snapshot = self.order_book.get_depth_snapshot()
+        self.assertEqual(snapshot["asks"], [])
+        self.assertEqual(snapshot["bids"], [{"price": 100.0, "quantity": 2.0, "orders": 1}])
+
+class TestMatchScript(RedisBookTestCase):
+    """The atomic match script (backend redis_script): sweep, maker updates and resting in one call"""
+
+    def setUp(self):
+        super().setUp()
+        self.matching_engine = self.engine("redis_script")
+        # Small ranges so sweeps have to refetch inside the script
+        self.matching_engine.fetch_size = 2
+        self.asks = [self.submit(OrderSide.SELL, price, 1.0) for price in (100.0, 100.0, 101.0, 102.0, 110.0)]
+
+    def submit(self, side, price, quantity: float) -> MockOrder:
+        order = MockOrder(side, price, quantity)
+        if price is None:
+            order.order_type = OrderType.MARKET
+        self.trades = self.matching_engine.process_order(order)
+        return order
+
+    def test_crossing_limit_order_trades_at_resting_prices_and_rests_the_remainder(self):
+        """A limit order sweeps up to its price in time priority and rests what is left"""
+        order = self.submit(OrderSide.BUY, 100.5, 3.0)
+
+        self.assertEqual([(t["sell_order_id"], t["price"], t["quantity"]) for t in self.trades],
+                         [(self.asks[0].order_id, 100.0, 1.0), (self.asks[1].order_id, 100.0, 1.0)])
+        self.assertEqual((order.status, order.filled_quantity), (OrderStatus.PARTIALLY_FILLED, 2.0))
+        self.assertIsNone(self.order_book.get_order(self.asks[0].order_id))
+        resting = self.order_book.get_order(order.order_id)
+        self.assertEqual((resting["filled_lots"], resting["status"]), (self.lots(2.0), OrderStatus.PARTIALLY_FILLED))
+        snapshot = self.order_book.get_depth_snapshot()
+        self.assertEqual(snapshot["bids"], [{"price": 100.5, "quantity": 1.0, "orders": 1}])
+        self.assertEqual(snapshot["asks"][0], {"price": 101.0, "quantity": 1.0, "orders": 1})
+
+    def test_partial_fill_leaves_the_maker_resting(self):
+        """A smaller taker partially fills the first maker, which keeps its place in the queue"""
+        order = self.submit(OrderSide.BUY, 100.0, 0.25)
+
+        self.assertEqual([(t["price"], t["quantity"]) for t in self.trades], [(100.0, 0.25)])
+        self.assertEqual(order.status, OrderStatus.FILLED)
+        maker = self.order_book.get_order(self.asks[0].order_id)
+        self.assertEqual((maker["filled_lots"], maker["status"]), (self.lots(0.25), OrderStatus.PARTIALLY_FILLED))
+        self.assertEqual(self.order_book.get_depth_snapshot()["asks"][0], {"price": 100.0, "quantity": 1.75, "orders": 2})
+
+        self.submit(OrderSide.BUY, 100.0, 0.75)
+        self.assertEqual([t["sell_order_id"] for t in self.trades], [self.asks[0].order_id])
+        self.assertIsNone(self.order_book.get_order(self.asks[0].order_id))
+
+    def test_market_order_sweeps_levels_and_cancels_the_remainder(self):
+        """A market order sweeps across fetches up to its protection price; the rest is cancelled"""
+        order = self.submit(OrderSide.BUY, None, 10.0)
+
+        # 5% above the best ask of 100 allows 102 but not 110
+        self.assertEqual([(t["price"], t["quantity"]) for t in self.trades],
+                         [(100.0, 1.0), (100.0, 1.0), (101.0, 1.0), (102.0, 1.0)])
+        self.assertEqual((order.status, order.filled_quantity), (OrderStatus.CANCELLED, 4.0))
+        self.assertIsNone(self.order_book.get_order(order.order_id))
+        snapshot = self.order_book.get_depth_snapshot()
+        self.assertEqual((snapshot["bids"], snapshot["asks"]), ([], [{"price": 110.0, "quantity": 1.0, "orders": 1}]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+# tests/test_order_codec.py
+import json
+import struct
+import unittest
+
+from app.models.order import OrderSide, OrderStatus, OrderType
+from app.models.order_codec import decode_order_details, encode_order_details
+
+ORDER_DETAILS = {
+    "order_id": "7f1c9a8e-0d4b-4f3e-9a57-3c2b1d0e6f11",
+    "trader_id": "trader1",
+    "symbol": "BTC/USD",
+    "side": OrderSide.SELL,
+    "order_type": OrderType.LIMIT,
+    "quantity_lots": 250000000,
+    "price_ticks": 5010025000000,
+    "status": OrderStatus.PARTIALLY_FILLED,
+    "filled_lots": 75000000,
+    "created_at": 1700000000.123456
+}
+
+class TestOrderCodec(unittest.TestCase):
+    def test_binary_round_trip(self):
+        """Binary details decode to the same fields, without storing order id or symbol"""
+        encoded = encode_order_details(ORDER_DETAILS, codec="binary")
+        self.assertNotIn(ORDER_DETAILS["order_id"].encode(), encoded)
+        self.assertLess(len(encoded), len(json.dumps(ORDER_DETAILS)) / 4)
+
+        decoded = decode_order_details(ORDER_DETAILS["order_id"], "BTC/USD", encoded)
+        self.assertEqual(decoded, ORDER_DETAILS)
+
+    def test_float_values_are_converted_to_ticks_and_lots(self):
+        """JSON and version 1 values, written with float prices and quantities, decode to the same ints"""
+        legacy_json = json.dumps({
+            "order_id": ORDER_DETAILS["order_id"], "trader_id": "trader1", "symbol": "BTC/USD",
+            "side": "sell", "order_type": "limit", "quantity": 2.5, "price": 50100.25,
+            "status": "partially_filled", "filled_quantity": 0.75, "created_at": 1700000000.123456
+        }).encode()
+        version_1 = struct.pack(">BBBBddddB", 1, 1, 0, 3, 2.5, 0.75, 50100.25, 1700000000.123456, 7) + b"trader1"
+
+        for encoded in (legacy_json, version_1):
+            decoded = decode_order_details(ORDER_DETAILS["order_id"].encode(), "BTC/USD", encoded)
+            self.assertEqual(decoded, ORDER_DETAILS)
+
+if __name__ == '__main__':
+    unittest.main()
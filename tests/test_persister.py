@@ -0,0 +1,120 @@
+# tests/test_persister.py
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+
+from sqlalchemy.dialects import postgresql
+
+from app.models.order import OrderStatus
+from app.services.persister import WriteBehindPersister
+
+def trade(trade_id: str) -> dict:
+    return {"trade_id": trade_id, "buy_order_id": "b1", "sell_order_id": "s1", "symbol": "BTC/USD",
+            "quantity": 1.0, "price": 100.0, "quantity_lots": 10 ** 8, "price_ticks": 10 ** 10,
+            "executed_at": datetime.now(timezone.utc)}
+
+class RecordingDatabase:
+    """Session factory whose sessions record committed statements (compiled for PostgreSQL)"""
+
+    def __init__(self):
+        self.failures = 0
+        self.commits = []
+
+    def __call__(self):
+        return RecordingSession(self)
+
+class RecordingSession:
+    def __init__(self, database: RecordingDatabase):
+        self.database = database
+        self.statements = []
+
+    def execute(self, statement):
+        compiled = statement.compile(dialect=postgresql.dialect())
+        self.statements.append((str(compiled), compiled.params))
+
+    def commit(self):
+        if self.database.failures:
+            self.database.failures -= 1
+            raise ConnectionError("database unavailable")
+        self.database.commits.append(self.statements)
+
+    def rollback(self):
+        self.statements = []
+
+    def close(self):
+        pass
+
+class TestWriteBehindPersister(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dead_letter_path = os.path.join(directory.name, "write_behind.jsonl")
+        self.database = RecordingDatabase()
+
+    def persister(self, **options) -> WriteBehindPersister:
+        options.setdefault("flush_interval", 0.01)
+        persister = WriteBehindPersister(self.database, dead_letter_path=self.dead_letter_path, **options)
+        self.addCleanup(persister.stop, 5)
+        return persister
+
+    def test_batch_is_written_with_one_insert_and_one_update(self):
+        """Trades go out in one multi-row INSERT, the latest state per order in one UPDATE ... FROM VALUES"""
+        persister = self.persister(batch_size=100, flush_interval=0.5)
+        for i in range(3):
+            persister.record_trade(trade(f"t{i}"))
+        persister.record_order_state("b1", 1.0, OrderStatus.PARTIALLY_FILLED, 10 ** 8)
+        persister.record_order_state("s1", 3.0, OrderStatus.FILLED, 3 * 10 ** 8)
+        persister.record_order_state("b1", 3.0, OrderStatus.FILLED, 3 * 10 ** 8)
+        self.assertTrue(persister.flush(5))
+
+        self.assertEqual(len(self.database.commits), 1)
+        (insert_sql, insert_params), (update_sql, update_params) = self.database.commits[0]
+        self.assertTrue(insert_sql.startswith("INSERT INTO trades"))
+        self.assertEqual(sorted(value for key, value in insert_params.items() if key.startswith("trade_id")),
+                         ["t0", "t1", "t2"])
+        self.assertTrue(update_sql.startswith("UPDATE orders SET"))
+        self.assertIn("FROM (VALUES", update_sql)
+        self.assertIn("WHERE orders.order_id = new_states.order_id", update_sql)
+        # One row per order, with its latest state
+        values = list(update_params.values())
+        rows = [tuple(values[i:i + 4]) for i in range(0, len(values), 4)]
+        self.assertEqual(sorted(rows), [("b1", 3.0, 3 * 10 ** 8, "FILLED"), ("s1", 3.0, 3 * 10 ** 8, "FILLED")])
+
+    def test_failed_writes_are_retried(self):
+        self.database.failures = 2
+        persister = self.persister(max_retries=3)
+        persister.record_trade(trade("t1"))
+        self.assertTrue(persister.flush(5))
+
+        self.assertEqual(len(self.database.commits), 1)
+        self.assertFalse(os.path.exists(self.dead_letter_path))
+
+    def test_batches_failing_after_retries_are_dead_lettered_and_replayed_in_order(self):
+        """Nothing is dropped: failed batches and those behind them wait on disk until Postgres is back"""
+        self.database.failures = 1000
+        persister = self.persister(max_retries=1, replay_interval=0)
+        persister.record_trade(trade("t1"))
+        self.assertTrue(persister.flush(5))
+        persister.record_order_state("b1", 1.0, OrderStatus.FILLED, 10 ** 8)
+        self.assertTrue(persister.flush(5))
+
+        with open(self.dead_letter_path) as dead_letters:
+            batches = [json.loads(line) for line in dead_letters]
+        self.assertEqual([len(batch["trades"]) for batch in batches], [1, 0])
+        self.assertEqual(batches[1]["order_states"][0]["order_id"], "b1")
+        self.assertEqual(self.database.commits, [])
+
+        self.database.failures = 0
+        persister.record_trade(trade("t2"))
+        self.assertTrue(persister.flush(5))
+
+        self.assertFalse(os.path.exists(self.dead_letter_path))
+        written = [statement.split(" ")[0] + ":" + ",".join(str(value) for key, value in params.items()
+                                                            if key.startswith("trade_id"))
+                   for commit in self.database.commits for statement, params in commit]
+        self.assertEqual(written, ["INSERT:t1", "UPDATE:", "INSERT:t2"])
+
+if __name__ == '__main__':
+    unittest.main()
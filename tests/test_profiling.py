@@ -0,0 +1,53 @@
+# tests/test_profiling.py
+import time
+import unittest
+from unittest.mock import patch
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, text
+
+from app.db.postgres import count_statement, time_statement
+from app.services.profiling import RequestProfilingMiddleware, profile_store
+
+class TestRequestProfiling(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://")
+        event.listen(engine, "before_cursor_execute", count_statement)
+        event.listen(engine, "after_cursor_execute", time_statement)
+
+        app = FastAPI()
+        app.add_middleware(RequestProfilingMiddleware)
+
+        @app.get("/work")
+        def work():
+            # Sync endpoints run in the thread pool; their statements are charged to the request
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                conn.execute(text("SELECT 2"))
+            time.sleep(0.02)
+            return {"ok": True}
+
+        self.client = TestClient(app)
+
+    def test_statements_are_charged_to_the_request(self):
+        response = self.client.get("/work")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('desc="2 statements"', response.headers["server-timing"])
+        self.assertIn('desc="0 calls"', response.headers["server-timing"])
+        self.assertNotIn("x-profile-id", response.headers)
+
+    def test_header_and_admin_toggle_profile_a_request(self):
+        with patch("app.services.profiling.PROFILING_ENABLED", True):
+            response = self.client.get("/work", headers={"X-Profile": "1"})
+            report = profile_store.get(int(response.headers["x-profile-id"]))
+            self.assertEqual(report["path"], "/work")
+            self.assertEqual(report["sql"]["statements"], 2)
+            self.assertGreater(report["profile"]["samples"], 0)
+
+            profile_store.arm(1)
+            self.assertIn("x-profile-id", self.client.get("/work").headers)
+            self.assertNotIn("x-profile-id", self.client.get("/work").headers)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# tests/test_risk.py
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.db.postgres import Base
+from app.models.order import OrderModel, OrderSide, OrderStatus, OrderType
+from app.models.trade import TradeModel
+from app.services.risk import RiskCache
+
+def lots(quantity: float) -> int:
+    return int(round(quantity * 10 ** 8))
+
+def ticks(price: float) -> int:
+    return int(round(price * 10 ** 8))
+
+def trade(buy_order_id: str, sell_order_id: str, price: float, quantity: float) -> dict:
+    return {"buy_order_id": buy_order_id, "sell_order_id": sell_order_id, "symbol": "BTC/USD",
+            "price": price, "quantity": quantity, "price_ticks": ticks(price), "quantity_lots": lots(quantity)}
+
+class TestRiskCache(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=engine)
+        self.session_factory = sessionmaker(bind=engine)
+        self.risk = RiskCache(self.session_factory, max_open_exposure=1000.0, max_position=5.0,
+                              trader_limits={"big": {"max_open_exposure": 0}}, reconcile_interval=0)
+
+    def reserve(self, order_id, trader_id, side, price, quantity):
+        return self.risk.reserve(order_id, trader_id, "BTC/USD", side,
+                                 ticks(price) if price is not None else None, lots(quantity))
+
+    def test_limits_follow_fills_and_cancels(self):
+        """Open exposure is released by fills and cancels; fills move positions towards the limit"""
+        self.assertIsNone(self.reserve("b1", "alice", OrderSide.BUY, 100.0, 4.0))
+        self.assertIn("exposure", self.reserve("b2", "alice", OrderSide.BUY, 100.0, 7.0))
+        # Worst case long: 4 open + 2 new > 5
+        self.assertIn("position", self.reserve("b3", "alice", OrderSide.BUY, 10.0, 2.0))
+        # Per-trader override lifts the exposure limit but not the position limit
+        self.assertIsNone(self.reserve("b4", "big", OrderSide.BUY, 100.0, 5.0))
+
+        self.assertIsNone(self.reserve("s1", "bob", OrderSide.SELL, 100.0, 3.0))
+        self.risk.on_trades([trade("b1", "s1", 100.0, 3.0)])
+        self.assertEqual(self.risk.exposure("alice"), {"trader_id": "alice", "open_exposure": 100.0,
+                                                       "positions": {"BTC/USD": 3.0}})
+        self.assertEqual(self.risk.exposure("bob")["positions"], {"BTC/USD": -3.0})
+
+        self.risk.release("b1")
+        self.assertEqual(self.risk.exposure("alice")["open_exposure"], 0.0)
+        # 3 held + 2 new is within the limit, 3 held + 3 is not
+        self.assertIsNone(self.reserve("b5", "alice", OrderSide.BUY, 100.0, 2.0))
+        self.risk.release("b5")
+        self.assertIsNotNone(self.reserve("b6", "alice", OrderSide.BUY, 100.0, 3.0))
+
+    def test_market_orders_are_priced_before_the_symbol_trades(self):
+        """Without a last price a market order is priced off the book, and rejected without either"""
+        self.assertIn("reference price", self.reserve("m1", "alice", OrderSide.BUY, None, 1.0))
+        # Exposure is not checked for this trader, so there is nothing to price
+        self.assertIsNone(self.reserve("m2", "big", OrderSide.BUY, None, 1.0))
+
+        self.assertIn("exposure", self.risk.reserve("m3", "alice", "BTC/USD", OrderSide.BUY, None, lots(4.0),
+                                                    lambda: ticks(300.0)))
+        self.assertIsNone(self.risk.reserve("m4", "alice", "BTC/USD", OrderSide.BUY, None, lots(3.0),
+                                            lambda: ticks(300.0)))
+        self.assertEqual(self.risk.exposure("alice")["open_exposure"], 900.0)
+
+    def test_reconcile_rebuilds_from_postgres(self):
+        """Reconciliation replaces drifted state with open orders and positions from the database"""
+        db = self.session_factory()
+        for order_id, trader_id, side, quantity, filled, status in [
+            ("b1", "alice", OrderSide.BUY, 2.0, 2.0, OrderStatus.FILLED),
+            ("s1", "bob", OrderSide.SELL, 5.0, 2.0, OrderStatus.PARTIALLY_FILLED),
+        ]:
+            db.add(OrderModel(order_id=order_id, trader_id=trader_id, symbol="BTC/USD", side=side,
+                              order_type=OrderType.LIMIT, quantity=quantity, price=100.0, status=status,
+                              filled_quantity=filled, price_ticks=ticks(100.0), quantity_lots=lots(quantity),
+                              filled_lots=lots(filled)))
+        db.add(TradeModel(trade_id="t1", buy_order_id="b1", sell_order_id="s1", symbol="BTC/USD",
+                          quantity=2.0, price=100.0, quantity_lots=lots(2.0), price_ticks=ticks(100.0)))
+        db.commit()
+        db.close()
+
+        # Drift: an order the cache never heard the end of
+        self.reserve("lost", "alice", OrderSide.BUY, 100.0, 1.0)
+        self.assertEqual(self.risk.reconcile(), 2)
+
+        self.assertEqual(self.risk.exposure("alice"), {"trader_id": "alice", "open_exposure": 0.0,
+                                                       "positions": {"BTC/USD": 2.0}})
+        self.assertEqual(self.risk.exposure("bob"), {"trader_id": "bob", "open_exposure": 300.0,
+                                                     "positions": {"BTC/USD": -2.0}})
+        # Bob's open sell of 3 plus a new one of 1 stays within -5 (2 sold + 3 open = 5 already)
+        self.assertIn("position", self.reserve("s2", "bob", OrderSide.SELL, 100.0, 1.0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+# tests/test_sequencer.py
+import asyncio
+import unittest
+
+from app.services.sequencer import OrderSequencer
+
+class TestOrderSequencer(unittest.IsolatedAsyncioTestCase):
+    async def test_orders_are_processed_in_arrival_order_and_batched(self):
+        """Submissions for a symbol reach the handler in order, several per batch"""
+        batches = []
+
+        def handler(items):
+            batches.append(list(items))
+            return [ValueError("rejected") if item < 0 else item * 10 for item in items]
+
+        sequencer = OrderSequencer(handler)
+        results = await asyncio.gather(
+            *[sequencer.submit("BTC/USD", item) for item in (1, 2, -1, 3)],
+            return_exceptions=True
+        )
+        await sequencer.stop()
+
+        self.assertEqual([item for batch in batches for item in batch], [1, 2, -1, 3])
+        self.assertLess(len(batches), 4)
+        self.assertEqual(results[:2], [10, 20])
+        self.assertIsInstance(results[2], ValueError)
+        self.assertEqual(results[3], 30)
+
+if __name__ == '__main__':
+    unittest.main()
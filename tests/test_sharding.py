@@ -0,0 +1,102 @@
+# tests/test_sharding.py
+import queue
+import tempfile
+import threading
+import time
+import unittest
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from app.models.order import Order, OrderCreate, OrderSide, OrderStatus, OrderType
+from app.services.sharding import HashRing, ShardRouter, ShardWorker
+
+SYMBOLS = [f"SYM{i}/USD" for i in range(2000)]
+
+class TestHashRing(unittest.TestCase):
+    def test_symbols_spread_over_shards(self):
+        owners = Counter(HashRing(range(4)).owner(symbol) for symbol in SYMBOLS)
+        self.assertEqual(set(owners), {0, 1, 2, 3})
+        for count in owners.values():
+            self.assertAlmostEqual(count, 500, delta=125)
+
+    def test_adding_a_shard_only_moves_symbols_to_it(self):
+        """Growing from 4 to 5 shards moves about a fifth of the symbols, all onto the new shard"""
+        before, after = HashRing(range(4)), HashRing(range(5))
+        moved = [symbol for symbol in SYMBOLS if before.owner(symbol) != after.owner(symbol)]
+        self.assertTrue(all(after.owner(symbol) == 4 for symbol in moved))
+        self.assertAlmostEqual(len(moved), 400, delta=120)
+        # Ownership does not depend on the process computing it
+        self.assertEqual([HashRing(range(4)).owner(symbol) for symbol in SYMBOLS[:50]],
+                         [before.owner(symbol) for symbol in SYMBOLS[:50]])
+
+class StubOrderService:
+    """Stands in for a worker's OrderService; rejects orders above 100 and reports its shard"""
+
+    def __init__(self, shard_id: int):
+        self.shard_id = shard_id
+
+    def create_orders(self, order_creates, order_ids=None):
+        return [ValueError("Quantity too large") if order_create.quantity > 100 else
+                (Order(order_id=order_id, status=OrderStatus.ACTIVE, created_at=datetime.now(timezone.utc),
+                       **order_create.model_dump()), [])
+                for order_create, order_id in zip(order_creates, order_ids)]
+
+    def get_order_book(self, symbol, depth):
+        return {"symbol": symbol, "shard": self.shard_id, "depth": depth, "seq": 7}
+
+class StubShardWorker(ShardWorker):
+    @contextmanager
+    def _order_service(self):
+        yield StubOrderService(self.shard_id)
+
+class TestShardRouting(unittest.TestCase):
+    def setUp(self):
+        socket_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(socket_dir.cleanup)
+        # Workers serve from threads here instead of spawned processes
+        self.router = ShardRouter(socket_dir=socket_dir.name)
+        shards = [0, 1]
+        for shard_id in shards:
+            address = f"{self.router.socket_dir}/shard-{shard_id}.sock"
+            worker = StubShardWorker(shard_id, address, self.router.authkey, shards)
+            thread = threading.Thread(target=worker.serve, daemon=True)
+            thread.start()
+            # Cleanups run last first: stop the worker, then wait for it to close its socket
+            self.addCleanup(thread.join, 5)
+            self.router.addresses[shard_id] = address
+            self.router._connections[shard_id] = queue.SimpleQueue()
+        self.router.ring = HashRing(shards)
+        for shard_id in shards:
+            self.addCleanup(self.router._call, shard_id, ("stop",))
+            deadline = time.monotonic() + 5
+            while True:
+                try:
+                    self.assertEqual(self.router._call(shard_id, ("ping",)), shard_id)
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.01)
+        # One symbol owned by each shard
+        self.symbols = {self.router.ring.owner(symbol): symbol for symbol in SYMBOLS[:20]}
+
+    def test_batch_is_split_by_owner_and_returned_in_input_order(self):
+        order_creates = [OrderCreate(trader_id="t1", symbol=self.symbols[i % 2], side=OrderSide.BUY,
+                                     order_type=OrderType.LIMIT, quantity=1000.0 if i == 2 else 1.0, price=100.0)
+                         for i in range(4)]
+        results = self.router.create_orders(order_creates, [f"order-{i}" for i in range(4)])
+
+        self.assertEqual([result[0].order_id for result in results if not isinstance(result, Exception)],
+                         ["order-0", "order-1", "order-3"])
+        self.assertIsInstance(results[2], ValueError)
+        self.assertEqual([result[0].symbol for result in (results[0], results[1], results[3])],
+                         [self.symbols[0], self.symbols[1], self.symbols[1]])
+
+    def test_order_book_reads_come_from_the_owning_shard(self):
+        for shard_id, symbol in self.symbols.items():
+            self.assertEqual(self.router.get_order_book(symbol, 5),
+                             {"symbol": symbol, "shard": shard_id, "depth": 5, "seq": 7})
+
+if __name__ == '__main__':
+    unittest.main()
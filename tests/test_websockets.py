@@ -0,0 +1,86 @@
+# tests/test_websockets.py
+import asyncio
+import json
+import unittest
+from unittest.mock import patch
+
+from app.api.websockets import ClientStream
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+        # Cleared to simulate a client that stops reading
+        self.reading = asyncio.Event()
+        self.reading.set()
+
+    async def send_text(self, text):
+        await self.reading.wait()
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000, reason=None):
+        self.closed_with = code
+
+def delta(seq, bids=(), asks=()):
+    message = {"seq": seq, "type": "delta", "symbol": "BTC/USD", "bids": list(bids), "asks": list(asks)}
+    return json.dumps(message), message
+
+class TestClientStream(unittest.IsolatedAsyncioTestCase):
+    async def test_snapshot_is_followed_only_by_newer_deltas(self):
+        """Deltas arriving while a snapshot is taken are held, then sent only if newer"""
+        websocket = RecordingWebSocket()
+        client = ClientStream(websocket)
+
+        def take_snapshot(symbol, depth):
+            # Deltas published while the snapshot is being read
+            for seq in (4, 5, 6):
+                client.deliver(json.dumps({"seq": seq}), {"seq": seq})
+            return {"symbol": symbol, "seq": 5, "bids": [], "asks": []}
+
+        with patch("app.api.websockets.get_depth_snapshot", side_effect=take_snapshot):
+            await client.send_snapshot("BTC/USD")
+
+        client.deliver(json.dumps({"seq": 6}), {"seq": 6})
+        client.deliver(json.dumps({"seq": 7}), {"seq": 7})
+        await asyncio.sleep(0.01)
+        client.close()
+
+        self.assertEqual(websocket.sent[0]["type"], "snapshot")
+        self.assertEqual([message["seq"] for message in websocket.sent], [5, 6, 7])
+
+    async def test_slow_book_client_receives_conflated_delta(self):
+        """Deltas pending behind a slow send are merged into one with the latest level values"""
+        websocket = RecordingWebSocket()
+        websocket.reading.clear()
+        client = ClientStream(websocket, conflate=True)
+
+        client.deliver(*delta(1, bids=[[100.0, 1.0, 1]]))
+        await asyncio.sleep(0.01)
+        client.deliver(*delta(2, bids=[[100.0, 3.0, 2]], asks=[[101.0, 1.0, 1]]))
+        client.deliver(*delta(3, bids=[[100.0, 0, 0]]))
+        websocket.reading.set()
+        await asyncio.sleep(0.01)
+        client.close()
+
+        self.assertEqual(len(websocket.sent), 2)
+        self.assertEqual(websocket.sent[1]["first_seq"], 2)
+        self.assertEqual(websocket.sent[1]["seq"], 3)
+        self.assertEqual(websocket.sent[1]["bids"], [[100.0, 0, 0]])
+        self.assertEqual(websocket.sent[1]["asks"], [[101.0, 1.0, 1]])
+
+    async def test_client_over_buffer_limit_is_dropped(self):
+        """A client that cannot keep up with a non-conflatable stream is disconnected"""
+        websocket = RecordingWebSocket()
+        websocket.reading.clear()
+        client = ClientStream(websocket, max_pending=2)
+
+        for trade_id in range(4):
+            client.deliver(json.dumps({"trade_id": trade_id}), {"trade_id": trade_id})
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+
+        self.assertTrue(client.dropped)
+        self.assertEqual(websocket.closed_with, 1008)
+
+if __name__ == '__main__':
+    unittest.main()